@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import random
+import socket
+import argparse
+import resource
+import subprocess
+import time
+import timeit
+from twisted.internet import reactor, protocol
+from twisted.protocols.basic import LineReceiver
+import core.common as cmn
+import core.transports as transports
+
+
+class BotClient(LineReceiver):
+    """
+    A player that joins a table with a quick join and plays random legal moves, the legal cards are sent with ASK_CARD.
+    It measures the time between sending a move and receiving the next message from the server and the wall time of
+    its game. Stalls in the transport that delay a message without delaying the answer to the move (e. g. Nagle's
+    algorithm) only show up in the game time.
+    """
+
+    def __init__(self, bench, name):
+        self._bench = bench
+        self._name = name
+        self._state = cmn.WAIT_FOR_HANDSHAKE
+        self._move_sent = None
+        self._game_started = None
+
+    def connectionMade(self):
+        if transports.address_family(self.transport.getPeer()) == "tcp":
+            self.transport.setTcpNoDelay(True)
+
+    def lineReceived(self, line):
+        bench = self._bench
+        bench.num_received += 1
+        if self._move_sent is not None:
+            bench.latencies.append(timeit.default_timer() - self._move_sent)
+            self._move_sent = None
+
+        # Handshake and username.
+        if self._state == cmn.WAIT_FOR_HANDSHAKE:
+            self._send(str(cmn.handshake_fun(int(line))))
+            self._state = cmn.PENDING
+            return
+        if self._state == cmn.PENDING:
+            self._send(self._name)
+            self._state = cmn.WAIT_FOR_NAME
+            return
+        msg_id, _, msg = line.partition("#")
+        msg_id = int(msg_id)
+        if self._state == cmn.WAIT_FOR_NAME:
+            if msg_id != cmn.NEW_USER:
+                bench.fail("%s was not accepted: %s" % (self._name, line))
+                return
+            self._state = cmn.ACCEPTED
+            self._send("%d#" % cmn.JOIN_TABLE)
+            return
+
+        # The game.
+        if msg_id == cmn.START_GAME:
+            self._game_started = timeit.default_timer()
+        elif msg_id == cmn.ASK_TRUMP:
+            self._move("%d#H" % cmn.SAY_TRUMP)
+        elif msg_id == cmn.ASK_TRICKS:
+            self._move("%d#0" % cmn.SAY_TRICKS)
+        elif msg_id == cmn.INVALID_NUM_TRICKS:
+            self._move("%d#1" % cmn.SAY_TRICKS)
+        elif msg_id == cmn.ASK_CARD:
+            legal = json.loads(msg.split("#", 2)[2])
+            card = str(random.choice(legal))
+            self._move("%d#%s" % (cmn.SAY_CARD, card))
+        elif msg_id == cmn.FINAL_WINNERS:
+            bench.game_times.append(timeit.default_timer() - self._game_started)
+            bench.player_finished()
+        elif 400 <= msg_id < 500:
+            bench.fail("%s got the error %s" % (self._name, line))
+
+    def _send(self, line):
+        self._bench.num_sent += 1
+        self.sendLine(line)
+
+    def _move(self, line):
+        self._move_sent = timeit.default_timer()
+        self._send(line)
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        self._bench.connection_lost()
+
+
+class BotFactory(protocol.ClientFactory):
+    """
+    Creates the bots.
+    """
+
+    def __init__(self, bench, name):
+        self._bench = bench
+        self._name = name
+
+    def buildProtocol(self, addr):
+        return BotClient(self._bench, self._name)
+
+    def clientConnectionFailed(self, connector, reason):
+        self._bench.fail("%s could not connect: %s" % (self._name, reason.getErrorMessage()))
+
+
+class Benchmark(object):
+    """
+    Plays the games of all bots and collects the numbers.
+    """
+
+    def __init__(self, num_players):
+        self.num_players = num_players
+        self.num_finished = 0
+        self.num_sent = 0
+        self.num_received = 0
+        self.latencies = []
+        self.game_times = []  # the wall time of the game of each player
+        self.error = None
+
+    def player_finished(self):
+        """
+        Stop the reactor when all players got the final winners.
+        """
+        self.num_finished += 1
+        if self.num_finished == self.num_players:
+            reactor.stop()
+
+    def connection_lost(self):
+        """
+        Only the server may close the connections of players that have not finished their game.
+        """
+        if self.num_finished < self.num_players and self.error is None:
+            self.fail("A connection was lost before the games were finished.")
+
+    def fail(self, error):
+        """
+        Stop the benchmark with an error.
+        :param error: the error message
+        """
+        if self.error is None:
+            self.error = error
+            reactor.stop()
+
+
+def _wait_for_port(port, timeout):
+    """
+    Wait until the server accepts connections.
+    :param port: the port
+    :param timeout: seconds until the server must be up
+    :return: True if the server is up
+    """
+    start = timeit.default_timer()
+    while timeit.default_timer() - start < timeout:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return True
+        except socket.error:
+            time.sleep(0.05)
+    return False
+
+
+def _percentile(values, p):
+    """
+    Return the p-th percentile of the values.
+    :param values: the sorted values
+    :param p: the percentile in [0, 100]
+    :return: the percentile
+    """
+    return values[min(len(values)-1, int(len(values) * p / 100.0))]
+
+
+parser = argparse.ArgumentParser(description="Wizard cardgame - Load benchmark of the server")
+parser.add_argument("--port", type=int, default=9876,
+                    help="port of the benchmarked server, default: 9876")
+parser.add_argument("--backend", choices=["twisted", "asyncio"], default="twisted",
+                    help="the event loop of the server, default: twisted")
+parser.add_argument("--transport", choices=["tcp", "unix", "memory"], default="tcp",
+                    help="the connections of the bots, memory runs the server in the benchmark process, default: tcp")
+parser.add_argument("-n", "--num_players", type=int, default=3,
+                    help="number of players per table, default: 3")
+parser.add_argument("-k", "--num_rounds", type=int, default=None,
+                    help="number of rounds per game, default: floor(60/num_players)")
+parser.add_argument("-t", "--num_tables", type=int, default=50,
+                    help="number of tables that are played at the same time, default: 50")
+parser.add_argument("--timeout", type=float, default=300.0,
+                    help="seconds until the benchmark is cancelled, default: 300")
+
+
+def main(args):
+    """
+    Start the server, play the games and print the results.
+    :param args: command line arguments
+    :return: the exit code
+    """
+    assert 0 < args.num_players <= cmn.MAX_NUM_PLAYERS
+    if args.transport != "tcp" and args.backend != "twisted":
+        print "The %s transport needs the twisted backend." % args.transport
+        return 1
+    address = "tcp:127.0.0.1:%d" % args.port
+    server_argv = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+                   "--port", str(args.port), "-n", str(args.num_players), "--backend", args.backend]
+    if args.num_rounds is not None:
+        server_argv += ["-k", str(args.num_rounds)]
+    if args.transport == "unix":
+        address = "unix:/tmp/wizard-benchmark-%d.sock" % os.getpid()
+        server_argv += ["--listen", address]
+
+    # The in-process server shares the reactor with the bots.
+    server = None
+    if args.transport == "memory":
+        import server as wizard_server
+        address = "memory:benchmark"
+        transports.listen(address, wizard_server.ClientConnector(args.num_players, args.num_rounds))
+    else:
+        server = subprocess.Popen(server_argv)
+    try:
+        if server is not None and (not _wait_for_port(args.port, 10.0) or
+                                   (args.transport == "unix" and not os.path.exists(address[5:]))):
+            print "The server did not start."
+            return 1
+
+        # Connect all bots at once and play until the last game is over.
+        bench = Benchmark(args.num_players * args.num_tables)
+        for i in xrange(bench.num_players):
+            transports.connect(address, BotFactory(bench, "bot%d" % i))
+        reactor.callLater(args.timeout, bench.fail, "The games were not finished after %g seconds." % args.timeout)
+        start = timeit.default_timer()
+        reactor.run()
+        elapsed = timeit.default_timer() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if bench.error is not None:
+        print bench.error
+        return 1
+
+    # The CPU time of the server is only known after it exited. The in-process server shares it with the bots.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if server is not None else resource.RUSAGE_SELF)
+    latencies = sorted(bench.latencies)
+    game_times = sorted(bench.game_times)
+    print "Backend:            %s" % args.backend
+    print "Transport:          %s" % args.transport
+    print "Games:              %d tables with %d players" % (args.num_tables, args.num_players)
+    print "Elapsed:            %.2f s" % elapsed
+    print "Messages:           %d sent, %d received (%.0f messages/s)" % \
+          (bench.num_sent, bench.num_received, (bench.num_sent + bench.num_received) / elapsed)
+    print "Move round trip:    median %.2f ms, p99 %.2f ms, max %.2f ms" % \
+          (_percentile(latencies, 50)*1000, _percentile(latencies, 99)*1000, latencies[-1]*1000)
+    print "Game wall time:     median %.2f s, max %.2f s" % (_percentile(game_times, 50), game_times[-1])
+    print "%-20s%.2f s user, %.2f s system" % ("Server CPU time:" if server is not None else "CPU time:",
+                                              usage.ru_utime, usage.ru_stime)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
@@ -94,7 +94,8 @@ class GameApp(object):
         # Create MVC.
         model = LoginModel(self._ev_manager)
         view = LoginView(self._ev_manager)
-        controller = LoginController(self._ev_manager, model, view, self._args.login_file)
+        controller = LoginController(self._ev_manager, model, view, self._args.login_file,
+                                     not self._args.text_protocol)
 
         # Initialize the components and start the ticker.
         self._ev_manager.post(events.InitModelEvent())
@@ -159,6 +160,8 @@ parser.add_argument("--model", type=str, default="Login", choices=["Login"],
                     help="the model that is loaded on startup")
 parser.add_argument("--login_file", type=str, default="recent_logins.txt",
                     help="file that stores the recent login data")
+parser.add_argument("--text_protocol", action="store_true",
+                    help="do not ask the server for the binary protocol")
 
 
 def main(args):
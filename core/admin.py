@@ -0,0 +1,176 @@
+import os
+import stat
+import logging
+import itertools
+from twisted.internet.protocol import Factory
+from twisted.internet.protocol import connectionDone
+from twisted.protocols.basic import LineReceiver
+from twisted.internet import reactor
+from twisted.internet import task
+
+
+HELP = """help: list the commands
+tables: list the tables with their players, spectators, round and state
+connections: list the connections with their state, table, buffered bytes and message rates
+game ID: dump the state of the game at the table
+profile ID start|stop: profile the message handling of the table, stop prints the profile
+tournament: show the round and the standings of the tournament"""
+
+
+def buffered_bytes(transport):
+    """
+    Return the bytes that were written to the transport but not yet sent.
+    :param transport: the transport
+    :return: the number of bytes, 0 if the transport does not tell
+    """
+    data_buffer = getattr(transport, "dataBuffer", "")
+    return len(data_buffer) - getattr(transport, "offset", 0) + getattr(transport, "_tempDataLen", 0)
+
+
+class AdminConsole(LineReceiver):
+    """
+    A line based console for the operators of the server. Each command (see HELP) is answered with its output and an
+    empty line. Long listings are written with a cooperative task, so the reactor is never paused for more than a few
+    milliseconds.
+    """
+
+    delimiter = "\n"
+
+    def __init__(self, connector):
+        self._connector = connector
+        self._task = None
+
+    def connectionMade(self):
+        logging.info("Admin console connected.")
+        self.transport.write("Wizard server console, type help for the commands.\n\n")
+
+    def connectionLost(self, reason=connectionDone):
+        if self._task is not None:
+            self._task.stop()
+            self._task = None
+        logging.info("Admin console disconnected.")
+
+    def lineReceived(self, line):
+        """
+        Run the command.
+        :param line: the command line
+        """
+        if self._task is not None:
+            self._reply("The previous command is still running.")
+            return
+        args = line.split()
+        if len(args) == 0:
+            return
+        command = self.COMMANDS.get(args[0])
+        if command is None:
+            self._reply("Unknown command '%s', type help for the commands." % args[0])
+            return
+        try:
+            command(self, args[1:])
+        except (ValueError, IndexError):
+            self._reply("Invalid arguments, type help for the usage.")
+
+    def _reply(self, text):
+        """
+        Write the output of a command. Empty lines are left out, they end the output.
+        :param text: the output
+        """
+        self.transport.write("".join(line + "\n" for line in text.splitlines() if line.strip()) + "\n")
+
+    def _write_lines(self, lines):
+        """
+        Write the lines of a long listing in a cooperative task.
+        :param lines: iterable of lines
+        """
+        def write():
+            for line in lines:
+                self.transport.write(line + "\n")
+                yield
+            self.transport.write("\n")
+        self._task = task.cooperate(write())
+        self._task.whenDone().addBoth(self._listing_done)
+
+    def _listing_done(self, result):
+        self._task = None
+
+    def _help(self, args):
+        self._reply(HELP)
+
+    def _tables(self, args):
+        tables = self._connector.tables.values()
+        header = "%6s %8s %8s %12s %8s %7s  %s" % ("table", "players", "seated", "spectators", "worker", "round",
+                                                    "state")
+        rows = ("%6d %8d %8d %12d %8s %7s  %s" %
+                (t.table_id, t.game.num_players, t.num_seated, len(t.spectators),
+                 "-" if t.worker is None else t.worker.worker_id, t.game.round if t.game.started else "-",
+                 self._connector.table_state(t))
+                for t in tables)
+        self._write_lines(itertools.chain([header], rows, ["%d tables" % len(tables)]))
+
+    def _connections(self, args):
+        now = self._connector.clock.seconds()
+        clients = self._connector.clients.values() + list(self._connector.handshakes)
+        header = "%6s %-16s %-22s %-6s %6s %10s %10s %10s %8s" % ("id", "username", "host", "state", "table",
+                                                                  "buffered", "recv/s", "sent/s", "lagging")
+        rows = ("%6d %-16s %-22s %-6s %6s %10d %10.2f %10.2f %8s" %
+                (c.client_id, c.username[:16], c.hostname, c.state_name, "-" if c.table is None else c.table_id,
+                 buffered_bytes(c.transport) + self._connector.output.pending_bytes(c),
+                 c.num_received / max(now - c.connected_at, 1.0), c.num_sent / max(now - c.connected_at, 1.0),
+                 "yes" if c.lagging else "no")
+                for c in clients)
+        self._write_lines(itertools.chain([header], rows, ["%d connections" % len(clients)]))
+
+    def _table_command(self, table_id, command, args=()):
+        """
+        Run a command on the table, in the worker process if the table runs there.
+        :param table_id: the table id
+        :param command: the command
+        :param args: the command arguments
+        """
+        table = self._connector.tables.get(table_id)
+        if table is None:
+            self._reply("Unknown table %d." % table_id)
+            return
+        d = self._connector.admin_table(table, command, list(args))
+        d.addCallback(self._reply)
+        d.addErrback(lambda failure: self._reply("The command failed: %s" % failure.getErrorMessage()))
+
+    def _game(self, args):
+        self._table_command(int(args[0]), "game")
+
+    def _profile(self, args):
+        if args[1] not in ("start", "stop"):
+            raise ValueError()
+        self._table_command(int(args[0]), "profile", args[1:2])
+
+    def _tournament(self, args):
+        self._write_lines(self._connector.tournament_status())
+
+    COMMANDS = {"help": _help, "tables": _tables, "connections": _connections, "game": _game, "profile": _profile,
+                "tournament": _tournament}
+
+
+class AdminFactory(Factory):
+    """
+    Creates the console for each connection to the admin socket.
+    """
+
+    def __init__(self, connector):
+        self._connector = connector
+
+    def buildProtocol(self, addr):
+        return AdminConsole(self._connector)
+
+
+def listen_admin_socket(path, connector):
+    """
+    Listen on the admin socket. Only the user of the server process may connect. A stale socket file is removed.
+    :param path: the path of the UNIX socket
+    :param connector: the client connector
+    :return: the listening port
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    port = reactor.listenUNIX(path, AdminFactory(connector), mode=stat.S_IRUSR | stat.S_IWUSR)
+    logging.info("Admin console on %s.", path)
+    return port
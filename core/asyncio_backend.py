@@ -0,0 +1,208 @@
+import signal
+import socket
+import logging
+from twisted.internet.address import IPv4Address
+
+# The backend runs the Twisted protocol of the server on an asyncio loop, the server code is shared with the Twisted
+# backend. On Python 2 the loop comes from trollius, the deprecated backport of asyncio.
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+
+class DelayedCall(object):
+    """
+    The handle of a delayed call with the interface of the Twisted DelayedCall that the server uses.
+    """
+
+    def __init__(self, loop, delay, f, args, kwargs):
+        self._called = False
+        self._cancelled = False
+        self._f = f
+        self._args = args
+        self._kwargs = kwargs
+        self._handle = loop.call_later(delay, self._call)
+
+    def _call(self):
+        self._called = True
+        self._f(*self._args, **self._kwargs)
+
+    def active(self):
+        """
+        Return whether the call is still pending.
+        :return: True if the call was neither made nor cancelled
+        """
+        return not (self._called or self._cancelled)
+
+    def cancel(self):
+        """
+        Cancel the call.
+        """
+        self._cancelled = True
+        self._handle.cancel()
+
+
+class Clock(object):
+    """
+    Provides seconds, callLater and the shutdown triggers like the Twisted reactor, so the timers of the server
+    (LoopingCall, the timing wheel, the output batcher) run on the asyncio event loop.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._shutdown_triggers = []
+
+    def seconds(self):
+        """
+        Return the current time of the event loop.
+        :return: the time in seconds
+        """
+        return self._loop.time()
+
+    def callLater(self, delay, f, *args, **kwargs):
+        """
+        Call f(*args, **kwargs) after the delay.
+        :param delay: the delay in seconds
+        :param f: the function
+        :return: the DelayedCall
+        """
+        return DelayedCall(self._loop, delay, f, args, kwargs)
+
+    def addSystemEventTrigger(self, phase, event_type, f, *args, **kwargs):
+        """
+        Call f(*args, **kwargs) when serve stops the loop. Only the "before" phase of "shutdown" is supported.
+        :param phase: the phase, "before"
+        :param event_type: the event, "shutdown"
+        :param f: the function
+        """
+        assert phase == "before" and event_type == "shutdown", "Only the before shutdown trigger is supported."
+        self._shutdown_triggers.append((f, args, kwargs))
+
+    def shutdown(self):
+        """
+        Call the shutdown triggers.
+        """
+        triggers, self._shutdown_triggers = self._shutdown_triggers, []
+        for f, args, kwargs in triggers:
+            f(*args, **kwargs)
+
+
+class Transport(object):
+    """
+    Gives an asyncio transport the part of the Twisted transport interface that ClientConnection and LagMonitor use.
+    The streaming producer is paused and resumed by the flow control of the asyncio transport.
+    """
+
+    def __init__(self, transport, peer):
+        self._transport = transport
+        self._peer = peer
+        self.bufferSize = 65536
+        self.producer = None
+        self.disconnecting = False
+
+    def getPeer(self):
+        return self._peer
+
+    def setTcpNoDelay(self, enabled):
+        sock = self._transport.get_extra_info("socket")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if enabled else 0)
+
+    def write(self, data):
+        self._transport.write(data)
+
+    def writeSequence(self, data):
+        self._transport.writelines(data)
+
+    def loseConnection(self):
+        self.disconnecting = True
+        self._transport.close()
+
+    def abortConnection(self):
+        self.disconnecting = True
+        self._transport.abort()
+
+    def stopProducing(self):
+        # Like a Twisted transport, stopping the transport as a producer closes the connection.
+        self.loseConnection()
+
+    def registerProducer(self, producer, streaming):
+        assert streaming, "Only streaming producers are supported."
+        self.producer = producer
+        self._transport.set_write_buffer_limits(high=self.bufferSize)
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+if asyncio is not None:
+    class Protocol(asyncio.Protocol):
+        """
+        Passes the events of an asyncio connection to the Twisted protocol that the factory builds for it.
+        """
+
+        def __init__(self, factory):
+            self._factory = factory
+            self._protocol = None
+            self._transport = None
+
+        def connection_made(self, transport):
+            host, port = transport.get_extra_info("peername")[:2]
+            peer = IPv4Address("TCP", host, port)
+            self._protocol = self._factory.buildProtocol(peer)
+            if self._protocol is None:
+                transport.close()
+                return
+            self._transport = Transport(transport, peer)
+            self._protocol.makeConnection(self._transport)
+
+        def data_received(self, data):
+            if self._protocol is not None:
+                self._protocol.dataReceived(data)
+
+        def connection_lost(self, exc):
+            if self._protocol is not None:
+                self._transport.disconnecting = True
+                self._protocol.connectionLost()
+
+        def pause_writing(self):
+            if self._transport.producer is not None:
+                self._transport.producer.pauseProducing()
+
+        def resume_writing(self):
+            if self._transport.producer is not None:
+                self._transport.producer.resumeProducing()
+
+
+def new_event_loop():
+    """
+    Create the event loop. The server runs on Python 2, so this is the loop of trollius, which is deprecated and no
+    longer maintained. uvloop needs Python 3 and can not be used.
+    :return: the event loop
+    """
+    if asyncio is None:
+        raise RuntimeError("The asyncio backend needs the trollius package.")
+    logging.info("The asyncio backend runs on trollius, which is deprecated.")
+    return asyncio.new_event_loop()
+
+
+def serve(loop, factory, port):
+    """
+    Accept the connections on the given port with the Twisted protocol factory and run the loop until SIGINT or SIGTERM.
+    :param loop: the event loop
+    :param factory: the factory, its clock must use the same loop
+    :param port: the port
+    """
+    server = loop.run_until_complete(loop.create_server(lambda: Protocol(factory), port=port))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        factory.clock.shutdown()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
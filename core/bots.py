@@ -0,0 +1,311 @@
+import time
+import random
+import signal
+import logging
+import functools
+import traceback
+import multiprocessing
+from twisted.internet import reactor
+from twisted.internet import defer
+import common as cmn
+
+
+# The full deck, see WizardGame._create_cards.
+DECK = [c+n for c in "CDHS" for n in "23456789TJQKA"] + [c+n for c in "WL" for n in "0123"]
+
+# The guessed strength of a card counts as this many samples of its win probability, so the estimate is usable even
+# if the bot had no time to play out a single trick.
+PRIOR_SAMPLES = 4
+
+# The bot plays out at most this many random tricks per decision and checks the deadline after each batch.
+MAX_SAMPLES = 10000
+SAMPLE_BATCH = 50
+
+# Seconds after the think time before the server makes the quick move for a bot whose process did not answer.
+FALLBACK_GRACE = 0.5
+
+
+def _strength(card, trump):
+    """
+    Return the guessed chance of the card to win a trick.
+    :param card: the card
+    :param trump: the trump suit
+    :return: the chance between 0 and 1
+    """
+    if card[0] == "W":
+        return 1.0
+    if card[0] == "L":
+        return 0.0
+    value = cmn.NUMERIC_VALUES[card[1]] / 28.0
+    return 0.5 + value if card[0] == trump else value
+
+
+def _win_probabilities(cards, trick, trump, num_players, unseen, deadline, rng):
+    """
+    Estimate the chance of each card to win the trick: The players after the bot get random cards that the bot has not
+    seen. The same random cards are used for all cards of the bot, so the estimates are comparable.
+    :param cards: the cards of the bot
+    :param trick: the cards that were already played in the trick
+    :param trump: the trump suit
+    :param num_players: the number of players
+    :param unseen: the cards that the bot has not seen
+    :param deadline: the time (time.time) when the bot must stop thinking
+    :param rng: the random generator
+    :return: list with the chance of each card
+    """
+    wins = [PRIOR_SAMPLES * _strength(card, trump) for card in cards]
+    num_samples = PRIOR_SAMPLES
+    num_others = num_players - len(trick) - 1
+    seat = len(trick)
+    while num_samples < MAX_SAMPLES and time.time() < deadline:
+        for _ in xrange(SAMPLE_BATCH):
+            others = rng.sample(unseen, num_others)
+            for i, card in enumerate(cards):
+                if cmn.trick_winner(trick + [card] + others, trump) == seat:
+                    wins[i] += 1
+        num_samples += SAMPLE_BATCH
+    return [w / float(num_samples) for w in wins]
+
+
+def choose_trump(cards):
+    """
+    Return the suit with the most and the highest cards in the hand.
+    :param cards: the cards
+    :return: the suit
+    """
+    def score(suit):
+        values = [cmn.NUMERIC_VALUES[card[1]] for card in cards if card[0] == suit]
+        return len(values), sum(values)
+    return max("CDHS", key=score)
+
+
+def choose_num_tricks(question, rng):
+    """
+    Return the valid number of tricks that is closest to the expected number of tricks: the sum of the chances of the
+    cards to win a trick that the bot starts.
+    :param question: the question, see BotPlayer._question
+    :param rng: the random generator
+    :return: the number of tricks
+    """
+    cards = question["cards"]
+    unseen = list(set(DECK).difference(cards))
+    chances = _win_probabilities(cards, [], question["trump"], question["num_players"], unseen, question["deadline"],
+                                 rng)
+    expected = sum(chances)
+    return min(question["valid_tricks"], key=lambda n: abs(n - expected))
+
+
+def choose_card(question, rng):
+    """
+    Return the card to play: If the bot needs more tricks, the weakest card that probably wins the trick, else the
+    strongest card that probably loses it. Without such a card, the weakest card is played.
+    :param question: the question, see BotPlayer._question
+    :param rng: the random generator
+    :return: the card
+    """
+    legal = question["legal_cards"]
+    if len(legal) == 1:
+        return legal[0]
+    trick = question["trick"]
+    unseen = list(set(DECK).difference(question["cards"], trick))
+    chances = _win_probabilities(legal, trick, question["trump"], question["num_players"], unseen,
+                                 question["deadline"], rng)
+    ranked = sorted(zip(chances, legal))
+    if question["needed_tricks"] > 0:
+        winners = [card for chance, card in ranked if chance >= 0.5]
+        return winners[0] if len(winners) > 0 else ranked[0][1]
+    losers = [card for chance, card in ranked if chance < 0.5]
+    return losers[-1] if len(losers) > 0 else ranked[0][1]
+
+
+def decide(question):
+    """
+    Return the move of the bot. The bot thinks until the deadline of the question at most.
+    :param question: the question, see BotPlayer._question
+    :return: the trump, the number of tricks or the card
+    """
+    rng = random.Random(question["seed"])
+    if question["state"] == cmn.WAIT_FOR_SAY_TRUMP:
+        return choose_trump(question["cards"])
+    if question["state"] == cmn.WAIT_FOR_SAY_TRICKS:
+        return choose_num_tricks(question, rng)
+    return choose_card(question, rng)
+
+
+def quick_move(question):
+    """
+    Return the move of the bot without any thinking, only from the guessed strength of the cards.
+    :param question: the question, see BotPlayer._question
+    :return: the trump, the number of tricks or the card
+    """
+    return decide(dict(question, deadline=0, seed=None))
+
+
+def _init_process():
+    """
+    Prepare a process of the pool: Ctrl+C is handled by the server process, which terminates the pool.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _decide_in_process(question):
+    """
+    Run decide in a process of the pool. The exceptions are returned, because the pool drops the result of a failed
+    call without telling anyone.
+    :param question: the question
+    :return: the move and None, or None and the formatted exception
+    """
+    try:
+        return decide(question), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+class BotPool(object):
+    """
+    Runs the decisions of the bots in a pool of processes. A thinking bot uses the whole think time, so it must neither
+    block the reactor nor compete with it for the interpreter lock. The pool is started before the reactor, it forks the
+    server process.
+    """
+
+    def __init__(self, num_processes, think_time):
+        self.think_time = think_time  # seconds a bot may think about a move
+        self._pool = multiprocessing.Pool(num_processes, _init_process)
+
+    def decide(self, question):
+        """
+        Let a process of the pool decide the move.
+        :param question: the question, see BotPlayer._question
+        :return: deferred that fires with the move in the reactor thread
+        """
+        d = defer.Deferred()
+        question = dict(question, deadline=time.time() + self.think_time, seed=random.getrandbits(32))
+        self._pool.apply_async(_decide_in_process, (question,),
+                               callback=functools.partial(reactor.callFromThread, self._decided, d))
+        return d
+
+    @staticmethod
+    def _decided(d, result):
+        move, error = result
+        if error is None:
+            d.callback(move)
+        else:
+            d.errback(RuntimeError(error))
+
+    def close(self):
+        """
+        Stop the processes of the pool.
+        """
+        self._pool.terminate()
+
+
+class BotPlayer(object):
+    """
+    A player that sits at a table like a client, but without a connection: It ignores all messages except the
+    questions for its moves, which it answers from the state of the game. The decision runs in the bot pool and is
+    checked in the reactor thread before it is played, the game may have moved on in the meantime, e. g. because the
+    turn clock made the move. If the pool does not answer within the think time, the bot makes a quick move.
+    """
+
+    family = "bot"
+
+    def __init__(self, client_id, username, pool, codec, clock=reactor):
+        """
+        :param client_id: the client id, bots use negative ids, so they never collide with the ids of the clients
+        :param username: the username
+        :param pool: the bot pool
+        :param codec: the codec of the broadcasts to the table, the encoded messages are dropped
+        :param clock: provider of callLater
+        """
+        self.client_id = client_id
+        self.username = username
+        self.codec = codec
+        self.table = None
+        self.watching = None
+        self.lagging = False
+        self.handed_over = False
+        self._pool = pool
+        self._clock = clock
+        self._turn = None  # identifies the current question, the answers to older questions are dropped
+        self._fallback = None
+
+    def write_sequence(self, chunks):
+        pass
+
+    def send_message(self, msg_id, *fields):
+        """
+        Think about the move if the message asks for it.
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        if msg_id in (cmn.ASK_TRUMP, cmn.ASK_TRICKS, cmn.ASK_CARD):
+            self._think()
+
+    def _question(self, game):
+        """
+        Return what the bot knows about the game for the current move.
+        :param game: the game
+        :return: dict with the state, the number of players, the cards of the bot, the trump, the cards of
+                 the current trick, the tricks that the bot still needs, the valid numbers of tricks and the legal cards
+        """
+        snapshot = game.snapshot(self.client_id)
+        seat = snapshot["players"].index(self.username)
+        question = {"state": game.state, "num_players": game.num_players,
+                    "cards": snapshot["cards"], "trump": game.trump, "trick": [card for _, card in snapshot["trick"]],
+                    "needed_tricks": (snapshot["said_tricks"][seat] or 0) - snapshot["made_tricks"][seat],
+                    "valid_tricks": [], "legal_cards": []}
+        if game.state == cmn.WAIT_FOR_SAY_TRICKS:
+            question["valid_tricks"] = [n for n in xrange(game.round+1) if game.is_valid_num_tricks(n)]
+        elif game.state == cmn.WAIT_FOR_SAY_CARD:
+            question["legal_cards"] = sorted(game.legal_cards())
+        return question
+
+    def _think(self):
+        """
+        Ask the pool for the move and make the quick move if the pool takes too long.
+        """
+        self.stop()
+        turn = self._turn = object()
+        question = self._question(self.table.game)
+        self._fallback = self._clock.callLater(self._pool.think_time + FALLBACK_GRACE, self._timed_out, turn, question)
+        d = self._pool.decide(question)
+        d.addCallback(functools.partial(self._move, turn))
+        d.addErrback(self._failed, turn, question)
+
+    def _timed_out(self, turn, question):
+        self._fallback = None
+        logging.warning("%s did not decide in time, making a quick move.", self.username)
+        self._move(turn, quick_move(question))
+
+    def _failed(self, failure, turn, question):
+        logging.error("%s failed to decide: %s", self.username, failure.getErrorMessage())
+        self._move(turn, quick_move(question))
+
+    def _move(self, turn, move):
+        """
+        Make the move if the question is still open.
+        :param turn: the question that the move answers
+        :param move: the move
+        """
+        if turn is not self._turn or self.table is None:
+            return
+        self.stop()
+        game = self.table.game
+        if game.current_client is not self:
+            return
+        if game.state == cmn.WAIT_FOR_SAY_TRUMP:
+            game.say_trump(move)
+        elif game.state == cmn.WAIT_FOR_SAY_TRICKS:
+            game.say_tricks(move)
+        else:
+            game.say_card(move)
+
+    def stop(self):
+        """
+        Forget the open question, e. g. because the table is closed.
+        """
+        self._turn = None
+        if self._fallback is not None:
+            if self._fallback.active():
+                self._fallback.cancel()
+            self._fallback = None
@@ -47,6 +47,9 @@ class CardGameController(PygameController):
             else:
                 self._view.show_cards(event.cards)
 
+        elif isinstance(event, events.HandEvent):
+            self._view.replace_cards(list(event.cards))
+
         elif isinstance(event, events.NewTrumpEvent):
             if delta_time > 0:
                 call_event = events.CallFunctionEvent(self._view.show_trump, event.trump)
@@ -73,10 +76,10 @@ class CardGameController(PygameController):
 
         elif isinstance(event, events.AskCardEvent):
             if delta_time > 0:
-                call_event = events.CallFunctionEvent(self._view.show_user_move)
+                call_event = events.CallFunctionEvent(self._view.show_user_move, event.legal_cards)
                 self._ev_manager.post(events.DelayedEvent(delta_time, call_event))
             else:
-                self._view.show_user_move()
+                self._view.show_user_move(event.legal_cards)
 
         elif isinstance(event, events.RoundPointsEvent):
             call_event = events.CallFunctionEvent(self._view.show_round_points, event.points)
@@ -1,5 +1,6 @@
 import events
 import logging
+import common as cmn
 
 
 class CardGameModel(object):
@@ -10,6 +11,8 @@ class CardGameModel(object):
         self._ev_manager.register_listener(self)
         self._player_order = None
         self._cards = None
+        self._hand_version = 0  # the number of cards that were played from the hand in this round
+        self._legal_cards = None  # the cards that the server allows in the current turn of the user
         self._trump = None
         self.username = None
         self._current_round = 0
@@ -27,8 +30,21 @@ class CardGameModel(object):
 
         elif isinstance(event, events.NewCardsEvent):
             self._cards = event.cards
+            self._hand_version = 0
             self._said_tricks = []
 
+        elif isinstance(event, events.HandEvent):
+            # The full hand that was asked for with ResyncHandEvent.
+            self._cards = event.cards
+            self._hand_version = event.version
+
+        elif isinstance(event, events.AskCardEvent):
+            self._legal_cards = set(event.legal_cards)
+            # Check the own copy of the hand against the hand of the server.
+            if event.version != self._hand_version or event.checksum != cmn.hand_checksum(self._cards):
+                logging.warning("The hand differs from the hand of the server, asking for the full hand.")
+                self._ev_manager.post(events.ResyncHandEvent())
+
         elif isinstance(event, events.NewTrumpEvent):
             self._trump = event.trump
 
@@ -48,18 +64,11 @@ class CardGameModel(object):
                 self._ev_manager.post(events.SayTricksEvent(event.n))
 
         elif isinstance(event, events.UserSaysCardEvent):
-            played_colors = [card[0] for card in self._played_cards if card[0] not in ["W", "L"]]
-
-            if len(played_colors) > 0:
-                # Some has played a suit.
-                follow_suit = played_colors[0][0]
-                if event.card[0] not in ["W", "L", follow_suit]:
-                    # The player did not follow suit. Check if this is ok.
-                    player_colors = [card[0] for card in self._cards]
-                    if follow_suit in player_colors:
-                        self._ev_manager.post(events.NotFollowedSuitEvent())
-                        return
-
+            # The server sent the legal cards with ASK_CARD.
+            if self._legal_cards is not None and event.card not in self._legal_cards:
+                self._ev_manager.post(events.NotFollowedSuitEvent())
+                return
+            self._legal_cards = None
             self._ev_manager.post(events.SayCardEvent(event.card))
 
         elif isinstance(event, events.WinTrickEvent):
@@ -69,8 +78,27 @@ class CardGameModel(object):
             self._played_cards.append(event.card)
             if event.card in self._cards:
                 self._cards.remove(event.card)
+                self._hand_version += 1
             else:
                 logging.warning("Tried to remove the card %s from the played cards, but it is not in the list.")
 
         elif isinstance(event, events.PlayerPlayedCardEvent):
             self._played_cards.append(event.card)
+
+        elif isinstance(event, events.TurnTimedOutEvent):
+            # The server played the card for the user.
+            self._legal_cards = None
+            if event.state == cmn.WAIT_FOR_SAY_CARD and event.move in self._cards:
+                self._cards.remove(event.move)
+                self._hand_version += 1
+
+        elif isinstance(event, events.SnapshotEvent):
+            # The session was resumed, so the state is taken from the server.
+            snapshot = event.snapshot
+            self._player_order = snapshot["players"]
+            self._cards = list(snapshot["cards"])
+            self._hand_version = snapshot.get("hand_version", 0)
+            self._trump = snapshot["trump"]
+            self._current_round = snapshot["round"]
+            self._said_tricks = [n for n in snapshot["said_tricks"] if n is not None]
+            self._played_cards = [card for _, card in snapshot["trick"]]
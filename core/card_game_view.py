@@ -84,6 +84,7 @@ class CardGameView(PygameView):
         self._played_card_widgets = []
         self._said_tricks_widgets = {}
         self._user_move_widget = None
+        self._dimmed_card_widgets = []  # the cards that the user may not play in the current turn
         self._player_order = None
         self.final_winners = None
         self.final_points = None
@@ -103,6 +104,9 @@ class CardGameView(PygameView):
         else:
             self._user_move_widget.clear_actions()
             self._user_move_widget.add_action(actions.FadeOutAction(0.5))
+            for w in self._dimmed_card_widgets:
+                w.opacity = 1
+            self._dimmed_card_widgets = []
         self._user_move = b
 
     def _create_widgets(self):
@@ -244,7 +248,23 @@ class CardGameView(PygameView):
         for w in self._said_tricks_widgets.values():
             w.clear_actions()
             w.add_action(actions.FadeOutAction(0.5))
+        self._create_card_widgets(cards)
 
+    def replace_cards(self, cards):
+        """
+        Replace the hand with the full hand from the server, the said tricks stay visible.
+        :param cards: the cards
+        """
+        for w in self._card_widgets.values():
+            if w not in self._played_card_widgets:
+                self._background_widget.remove_widget(w)
+        self._create_card_widgets(cards)
+
+    def _create_card_widgets(self, cards):
+        """
+        Create the card widgets of the hand.
+        :param cards: the cards
+        """
         self._card_widgets = {}
         card_size = (130, 184)
         x_min = 290
@@ -379,11 +399,70 @@ class CardGameView(PygameView):
         im_w.add_action(actions.MoveToAction((x, y), 1))
         self._played_card_widgets.append(im_w)
 
-    def show_user_move(self):
+    def _play_user_card(self, card):
+        """
+        Move the card of the user to the played cards.
+        :param card: the card
+        """
+        x = self.screen.get_width()/2 - 200 + len(self._played_card_widgets) * 60
+        y = 150 + len(self._played_card_widgets) * 10
+        w = self._card_widgets[card]
+        w.unhandle_clicked()
+        w.z_index = 20 + len(self._played_card_widgets)
+        self._played_card_widgets.append(w)
+        w.add_action(actions.MoveToAction((x, y), 1))
+        self.user_move = False
+
+    def _restore(self, snapshot):
+        """
+        Rebuild the widgets from the snapshot that the server sent after the session was resumed.
+        :param snapshot: the snapshot
+        """
+        # Remove the widgets of the old state.
+        for w in self._card_widgets.values():
+            self._background_widget.remove_widget(w)
+        for w in self._played_card_widgets:
+            if w not in self._card_widgets.values():
+                self._background_widget.remove_widget(w)
+        self._played_card_widgets = []
+        if self._ask_tricks_widget is not None:
+            self._background_widget.remove_widget(self._ask_tricks_widget)
+            self._ask_tricks_widget = None
+        self._choose_trump_widget.opacity = 0
+        self._warnings["invalid_num_tricks"].hide()
+
+        if self._player_order is None:
+            self._warnings["wait_box"].add_action(actions.FadeOutAction(0.5))
+            self._player_order = snapshot["players"]
+            self._show_player_order(self._player_order)
+
+        self.show_cards(list(snapshot["cards"]))
+        if snapshot["trump"] is not None:
+            self.show_trump(snapshot["trump"])
+
+        # Show the said and made tricks.
+        for player, said, made in zip(snapshot["players"], snapshot["said_tricks"], snapshot["made_tricks"]):
+            if said is not None:
+                w = self._said_tricks_widgets[player]
+                w.text = "%d / %d" % (made, said)
+                w.clear_actions()
+                w.add_action(actions.FadeInAction(0.5))
+
+        for player, card in snapshot["trick"]:
+            self._player_played_card(player, card)
+        self.user_move = False
+
+    def show_user_move(self, legal_cards=None):
         """
-        Show some info that it is the user's turn.
+        Show some info that it is the user's turn and dim the cards that may not be played.
+        :param legal_cards: the cards that the server allows, None for all cards
         """
         self.user_move = True
+        if legal_cards is not None:
+            self._dimmed_card_widgets = [w for card, w in self._card_widgets.items()
+                                         if card not in legal_cards and w not in self._played_card_widgets]
+            for w in self._dimmed_card_widgets:
+                w.opacity = 0.5
 
     def show_round_points(self, points):
         """
@@ -463,14 +542,22 @@ class CardGameView(PygameView):
             w.add_action(actions.FadeInAction(0.5))
 
         elif isinstance(event, events.SayCardEvent):
-            x = self.screen.get_width()/2 - 200 + len(self._played_card_widgets) * 60
-            y = 150 + len(self._played_card_widgets) * 10
-            w = self._card_widgets[event.card]
-            w.unhandle_clicked()
-            w.z_index = 20 + len(self._played_card_widgets)
-            self._played_card_widgets.append(w)
-            w.add_action(actions.MoveToAction((x, y), 1))
-            self.user_move = False
+            self._play_user_card(event.card)
+
+        elif isinstance(event, events.TurnTimedOutEvent):
+            # The server made the move for the user, so the question is removed.
+            if event.state == cmn.WAIT_FOR_SAY_TRUMP:
+                self._choose_trump_widget.opacity = 0
+            elif event.state == cmn.WAIT_FOR_SAY_TRICKS:
+                if self._ask_tricks_widget is not None:
+                    self._background_widget.remove_widget(self._ask_tricks_widget)
+                    self._ask_tricks_widget = None
+                self._warnings["invalid_num_tricks"].hide()
+            elif event.move in self._card_widgets:
+                self._play_user_card(event.move)
+
+        elif isinstance(event, events.SnapshotEvent):
+            self._restore(event.snapshot)
 
         elif isinstance(event, events.PlayerPlayedCardEvent):
             if event.player != self.username:
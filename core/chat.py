@@ -0,0 +1,124 @@
+import collections
+from twisted.internet import reactor
+import common as cmn
+
+
+class TokenBucket(object):
+    """
+    Rate limit: The bucket holds up to burst tokens and gains rate tokens per second. Each message takes one token.
+    """
+
+    def __init__(self, rate, burst, clock=reactor):
+        """
+        :param rate: tokens per second
+        :param burst: the maximum number of tokens
+        :param clock: provider of seconds
+        """
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._last = clock.seconds()
+
+    def _refill(self):
+        now = self._clock.seconds()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def consume(self):
+        """
+        Take a token.
+        :return: False if the bucket is empty, else True
+        """
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def wait_time(self):
+        """
+        Return the seconds until the next token is available.
+        :return: the seconds
+        """
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+
+class ChatChannel(object):
+    """
+    A chat channel, e. g. of a table or of the lobby.
+    The posted messages are collected for the coalescing interval and then sent to all members with a single
+    CHAT_MESSAGES message, which is encoded once per codec. So the writes per member are bounded by the number of
+    intervals, not by the number of posted messages. A batch that reaches the maximum batch size is sent right away,
+    no message is dropped. The last messages are kept in a bounded history that is sent to
+    late joiners in one batch.
+    """
+
+    def __init__(self, members, output, history_size=50, interval=0.1, call_later=reactor.callLater, name=None):
+        """
+        :param members: returns the current members
+        :param output: the output batcher
+        :param history_size: the number of messages in the history and the maximum number of messages per batch
+        :param interval: seconds a message is held back to be sent together with the following messages
+        :param call_later: the callLater function of the event loop
+        :param name: the table id or None for the lobby, only used for logging
+        """
+        self._members = members
+        self._output = output
+        self._interval = interval
+        self._call_later = call_later
+        self._name = name
+        self._history = collections.deque(maxlen=history_size)  # the sent messages as [username, text]
+        self._batch_size = history_size
+        self._pending = []  # the messages of the current batch
+        self._flush_call = None
+
+    @property
+    def history(self):
+        """
+        Return the sent messages of the history.
+        :return: list with [username, text], the oldest message first
+        """
+        return list(self._history)
+
+    def restore(self, history):
+        """
+        Add the messages of another process to the history, e. g. after the table was handed over.
+        :param history: list with [username, text]
+        """
+        self._history.extend(history)
+
+    def post(self, username, text):
+        """
+        Queue the message for the next batch.
+        :param username: the sender
+        :param text: the text
+        """
+        self._pending.append([username, text])
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+        elif self._flush_call is None:
+            self._flush_call = self._call_later(self._interval, self.flush)
+
+    def flush(self):
+        """
+        Send the queued messages to all members and move them to the history.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if len(self._pending) == 0:
+            return
+        batch, self._pending = self._pending, []
+        self._history.extend(batch)
+        self._output.broadcast(self._members(), cmn.CHAT_MESSAGES, (batch,), self._name)
+
+    def send_history(self, client):
+        """
+        Send the history to a new member. The queued messages follow with the next batch.
+        :param client: the client
+        """
+        if len(self._history) > 0:
+            client.send_message(cmn.CHAT_MESSAGES, list(self._history))
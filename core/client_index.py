@@ -0,0 +1,126 @@
+import random
+
+
+class IdAllocator(object):
+    """
+    Hands out the ids 0, ..., num_ids-1 in random order and takes freed ids back.
+    This is a lazy Fisher-Yates shuffle: only the positions that were swapped are stored, so the memory grows with the
+    number of allocated ids instead of num_ids and each operation takes constant time.
+    """
+
+    def __init__(self, num_ids):
+        self._num_free = num_ids  # the ids at the positions 0, ..., num_free-1 are free
+        self._swapped = {}  # position => id, for the positions whose id is not the position itself
+
+    @property
+    def num_free(self):
+        """
+        Return the number of free ids.
+        :return: the number of free ids
+        """
+        return self._num_free
+
+    def allocate(self):
+        """
+        Return a random free id.
+        :return: the id
+        """
+        if self._num_free == 0:
+            raise IndexError("There are no free ids left.")
+        i = random.randrange(self._num_free)
+        last = self._num_free - 1
+        allocated = self._swapped.get(i, i)
+        # Move the id from the last free position to the gap.
+        last_id = self._swapped.pop(last, last)
+        if i != last:
+            self._swapped[i] = last_id
+        self._num_free = last
+        return allocated
+
+    def free(self, allocated):
+        """
+        Give the id back, so it can be allocated again.
+        :param allocated: an id that was returned by allocate
+        """
+        if allocated != self._num_free:
+            self._swapped[self._num_free] = allocated
+        self._num_free += 1
+
+    def dump(self):
+        """
+        Return the state in a json serializable form, e. g. to send it to another process.
+        :return: the number of free ids and list with the swapped [position, id] pairs
+        """
+        return [self._num_free, self._swapped.items()]
+
+    def load(self, dumped):
+        """
+        Replace the state with the dumped state of another allocator, so the same ids are allocated.
+        :param dumped: the return value of dump
+        """
+        self._num_free = dumped[0]
+        self._swapped = dict((position, allocated) for position, allocated in dumped[1])
+
+
+class UsernameIndex(object):
+    """
+    The usernames of all connected clients (also of the clients that play in a worker process). Usernames are compared
+    case-insensitively.
+    """
+
+    def __init__(self):
+        self._ids = {}  # lowercase username => client id
+        self._usernames = {}  # client id => lowercase username
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, username):
+        return username.lower() in self._ids
+
+    def add(self, username, client_id):
+        """
+        Register the username for the client.
+        :param username: the username
+        :param client_id: the client id
+        :return: False if the username is already taken, else True
+        """
+        key = username.lower()
+        if key in self._ids:
+            return False
+        assert client_id not in self._usernames
+        self._ids[key] = client_id
+        self._usernames[client_id] = key
+        return True
+
+    def client_id(self, username):
+        """
+        Return the client with the username.
+        :param username: the username
+        :return: the client id, None if no client has the username
+        """
+        return self._ids.get(username.lower())
+
+    def remove(self, client_id):
+        """
+        Release the username of the client. Does nothing if the client has no username.
+        :param client_id: the client id
+        """
+        key = self._usernames.pop(client_id, None)
+        if key is not None:
+            del self._ids[key]
+
+    def dump(self):
+        """
+        Return the usernames in a json serializable form, e. g. to send them to another process.
+        :return: list with the [client id, lowercase username] pairs
+        """
+        return self._usernames.items()
+
+    def load(self, dumped):
+        """
+        Add the dumped usernames of another index.
+        :param dumped: the return value of dump
+        """
+        for client_id, username in dumped:
+            self.add(username, client_id)
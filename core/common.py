@@ -1,4 +1,5 @@
 import string
+import zlib
 import logging
 import colorama
 colorama.init()
@@ -11,6 +12,12 @@ BOLD = colorama.Style.BRIGHT
 RESET = colorama.Style.RESET_ALL
 
 
+# The maximum number of players at a table.
+MAX_NUM_PLAYERS = 6
+
+# The handshake option that asks for the binary protocol.
+BINARY_PROTOCOL = "B"
+
 # The client states:
 WAIT_FOR_HANDSHAKE = 0
 PENDING = 1
@@ -21,6 +28,8 @@ ACCEPTED = 3
 NEW_USER = 100
 USER_LEFT = 101
 CHAT = 102
+RESUME_TOKEN = 103
+CHAT_MESSAGES = 104
 
 # The game message ids
 START_GAME = 200
@@ -38,6 +47,10 @@ WINS_TRICK = 211
 MADE_POINTS = 212
 FINAL_POINTS = 213
 FINAL_WINNERS = 214
+TURN_TIMED_OUT = 215
+SNAPSHOT = 216
+RESYNC_HAND = 217
+HAND = 218
 
 # The server states.
 WAIT_FOR_SAY_TRUMP = 300
@@ -54,6 +67,39 @@ INVALID_TRUMP = 405
 INVALID_CARD = 406
 NOT_FOLLOWED_SUIT = 407
 INVALID_MOVE = 408
+UNKNOWN_TABLE = 409
+TABLE_FULL = 410
+INVALID_TABLE_SIZE = 411
+ALREADY_AT_TABLE = 412
+NOT_AT_TABLE = 413
+INVALID_SESSION = 414
+NO_STATISTICS = 415
+ALREADY_QUEUED = 416
+CHAT_RATE_LIMITED = 417
+
+# The lobby message ids.
+LIST_TABLES = 500
+TABLE_LIST = 501
+CREATE_TABLE = 502
+JOIN_TABLE = 503
+LEAVE_TABLE = 504
+JOINED_TABLE = 505
+TABLE_CLOSED = 506
+WATCH_TABLE = 507
+WATCHING_TABLE = 508
+GET_HISTORY = 509
+PLAYER_HISTORY = 510
+GET_TOP_PLAYERS = 511
+TOP_PLAYERS = 512
+ENQUEUE = 513
+QUEUED = 514
+LEFT_QUEUE = 515
+
+# The maximum length of a chat message, longer messages are cut.
+MAX_CHAT_LENGTH = 200
+
+# The number of skill bands in the matchmaking queue.
+NUM_SKILL_BANDS = 10
 
 # The names of the colors.
 COLOR_NAMES = {"D": "Diamonds",
@@ -108,6 +154,38 @@ def handshake_fun(x):
     return (x+17)*3-5
 
 
+def hand_checksum(cards):
+    """
+    Return the checksum of the hand cards. It does not depend on the order of the cards.
+    :param cards: the cards
+    :return: the checksum, a non-negative 31 bit integer
+    """
+    return zlib.crc32(",".join(sorted(cards))) & 0x7fffffff
+
+
+def trick_winner(cards, trump):
+    """
+    Return the index of the card that wins the trick.
+    :param cards: the cards of the trick in the order they were played
+    :param trump: the trump suit, "L" if there is no trump
+    :return: the index of the winning card
+    """
+    colors = [card[0] for card in cards]
+    if "W" in colors:
+        # Someone played a wizard => first wizard wins.
+        return colors.index("W")
+    if all(c == "L" for c in colors):
+        # Everyone played a jester => last player wins.
+        return len(cards) - 1
+    if trump != "L" and trump in colors:
+        # No wizards, but trump was played => the highest trump wins.
+        suit = trump
+    else:
+        # No wizards and no trump => the highest card that followed suit wins.
+        suit = (c for c in colors if c not in ["W", "L"]).next()
+    return max((NUMERIC_VALUES[card[1]], i) for i, card in enumerate(cards) if card[0] == suit)[1]
+
+
 class ColoredFormatter(logging.Formatter):
     """
     A logging formatter with colored output.
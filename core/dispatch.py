@@ -0,0 +1,108 @@
+import os
+import timeit
+import logging
+import messages
+
+
+def profiling_requested():
+    """
+    Return whether the message profile was requested with the environment variable WIZARD_PROFILE_MESSAGES.
+    :return: True if the variable is set to something else than "" or "0"
+    """
+    return os.environ.get("WIZARD_PROFILE_MESSAGES", "") not in ("", "0")
+
+
+class MessageRegistry(object):
+    """
+    Maps the message ids to their handlers. The fields of a message are decoded with the field types of the schema, so
+    each entry is a pair of decoder and handler, and dispatching a message is a single dict lookup.
+    Handlers are registered with the handles decorator in the class body of the receiving class and are called as
+    handler(receiver, msg_id, fields).
+    If profiling is enabled, the registry counts the calls and the cumulative handler time of each message id.
+    """
+
+    def __init__(self, name, schema, profile=None):
+        """
+        :param name: the name that is used in the profile
+        :param schema: dict with the field types of each message id
+        :param profile: whether to profile the handlers, defaults to the environment variable WIZARD_PROFILE_MESSAGES
+        """
+        self.name = name
+        self.schema = schema
+        self.profile = profiling_requested() if profile is None else profile
+        self.calls = dict.fromkeys(schema, 0)
+        self.seconds = dict.fromkeys(schema, 0.0)
+        self._handlers = {}
+
+    def handles(self, *msg_ids):
+        """
+        Return a decorator that registers the function as handler of the given messages.
+        :param msg_ids: the message ids
+        :return: the decorator
+        """
+        def register(handler):
+            for msg_id in msg_ids:
+                self.register(msg_id, handler)
+            return handler
+        return register
+
+    def register(self, msg_id, handler):
+        """
+        Register the handler of the message.
+        :param msg_id: the message id
+        :param handler: the handler
+        """
+        if msg_id not in self.schema:
+            raise ValueError("Message %d is not in the schema of %s." % (msg_id, self.name))
+        if msg_id in self._handlers:
+            raise ValueError("Message %d already has a handler in %s." % (msg_id, self.name))
+        self._handlers[msg_id] = handler
+
+    def decode_text(self, line):
+        """
+        Decode the text line.
+        :param line: the line
+        :return: msg_id, fields
+        """
+        return messages.decode_text(line, self.schema)
+
+    def decode_frame(self, data, offset):
+        """
+        Decode the binary frame that starts at the given offset.
+        :param data: the received data
+        :param offset: the start of the frame
+        :return: msg_id, fields and the offset after the frame or None if the frame is not complete
+        """
+        return messages.decode_frame(data, offset, self.schema)
+
+    def dispatch(self, receiver, msg_id, fields):
+        """
+        Call the handler of the message.
+        :param receiver: the object that received the message
+        :param msg_id: the message id
+        :param fields: the decoded message fields
+        :return: False if the message has no handler, else True
+        """
+        handler = self._handlers.get(msg_id)
+        if handler is None:
+            return False
+        if not self.profile:
+            handler(receiver, msg_id, fields)
+            return True
+        start = timeit.default_timer()
+        try:
+            handler(receiver, msg_id, fields)
+        finally:
+            self.calls[msg_id] += 1
+            self.seconds[msg_id] += timeit.default_timer() - start
+        return True
+
+    def log_profile(self):
+        """
+        Log the calls and the handler time of each message id, the most expensive messages first.
+        """
+        if not logging.getLogger().isEnabledFor(logging.INFO):
+            return
+        rows = sorted(((self.seconds[i], self.calls[i], i) for i in self.schema if self.calls[i] > 0), reverse=True)
+        lines = ["%6d %10d calls %10.3f ms %8.1f us/call" % (i, n, t*1000, t*1e6/n) for t, n, i in rows]
+        logging.info("Message profile of %s:\n%s", self.name, "\n".join(lines) if len(lines) > 0 else "(empty)")
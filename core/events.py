@@ -61,6 +61,12 @@ class LineReceivedEvent(Event):
         self.line = line
 
 
+class MessageReceivedEvent(Event):
+    def __init__(self, msg_id, fields):
+        self.msg_id = msg_id
+        self.fields = fields
+
+
 class InvalidUsernameEvent(Event):
     pass
 
@@ -137,6 +143,19 @@ class InvalidNumTricksEvent(Event):
 
 
 class AskCardEvent(Event):
+    def __init__(self, version, checksum, legal_cards):
+        self.version = version
+        self.checksum = checksum
+        self.legal_cards = legal_cards
+
+
+class HandEvent(Event):
+    def __init__(self, version, cards):
+        self.version = version
+        self.cards = cards
+
+
+class ResyncHandEvent(Event):
     pass
 
 
@@ -165,6 +184,17 @@ class PlayerPlayedCardEvent(Event):
         self.card = card
 
 
+class TurnTimedOutEvent(Event):
+    def __init__(self, state, move):
+        self.state = state
+        self.move = move
+
+
+class SnapshotEvent(Event):
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+
 class DelayedEvent(Event):
     def __init__(self, time, event):
         self.time = time
@@ -186,6 +216,22 @@ class FinalPointsEvent(Event):
         self.points = points
 
 
+class ChatEvent(Event):
+    def __init__(self, messages):
+        self.messages = messages
+
+
+class PlayerHistoryEvent(Event):
+    def __init__(self, username, games):
+        self.username = username
+        self.games = games
+
+
+class TopPlayersEvent(Event):
+    def __init__(self, players):
+        self.players = players
+
+
 class CallFunctionEvent(Event):
     """
     If a CallFunctionEvent is posted on the event manager, the event manager simply calls the function with the stored
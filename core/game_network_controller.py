@@ -1,13 +1,21 @@
 from network_controller import NetworkController
+from messages import InvalidMessageException
 import events
 import logging
+import time
+import log
 import common as cmn
-import json
-import numbers
+import messages
+from dispatch import MessageRegistry
 
 
-class InvalidMessageException(Exception):
-    pass
+# The handlers of the server messages, they are registered in GameNetworkController and below.
+HANDLERS = MessageRegistry("client", messages.SERVER_MESSAGES)
+
+# While the server is not reachable, e. g. because it restarts and recovers the games from its journal, the session is
+# resumed with a new connection every RESUME_RETRY_INTERVAL seconds for at most RESUME_RETRY_TIME seconds.
+RESUME_RETRY_INTERVAL = 2.0
+RESUME_RETRY_TIME = 120.0
 
 
 class GameNetworkController(NetworkController):
@@ -15,12 +23,17 @@ class GameNetworkController(NetworkController):
     A network controller that performs the handshake and translates the messages to events.
     """
 
-    def __init__(self, ev_manager, buffer_messages=False):
-        super(GameNetworkController, self).__init__(ev_manager)
+    def __init__(self, ev_manager, buffer_messages=False, binary_protocol=True):
+        super(GameNetworkController, self).__init__(ev_manager, binary_protocol)
         self.username = None
         self._state = cmn.WAIT_FOR_HANDSHAKE
         self._buffer_messages = buffer_messages  # if True, store the messages and handle them later
         self._buffer = []
+        self._binary_accepted = False
+        self._resume_token = None  # allows to resume the session after a connection loss
+        self._resuming = False
+        self._resume_deadline = None  # the time until the session is resumed
+        self._retry_at = None  # the time of the next attempt to resume the session
 
     @property
     def buffer_messages(self):
@@ -32,6 +45,7 @@ class GameNetworkController(NetworkController):
         if not b:
             for msg in self._buffer:
                 self._handle_valid_message(*msg)
+            self._buffer = []
 
     def update_username(self, username):
         """
@@ -41,23 +55,6 @@ class GameNetworkController(NetworkController):
         self.username = username
         self.send(self.username)
 
-    def _split(self, line):
-        """
-        Split the received line into msg_id and msg. The split occurs at the first "#".
-        :param line: the line
-        :return: msg_id, msg
-        """
-        if "#" not in line:
-            raise InvalidMessageException()
-        else:
-            i = line.index("#")
-            msg_id, msg = line[:i], line[i+1:]
-            try:
-                msg_id = int(msg_id)
-            except ValueError:
-                raise InvalidMessageException()
-            return msg_id, msg
-
     def notify(self, event):
         """
         Handle the given event.
@@ -66,18 +63,49 @@ class GameNetworkController(NetworkController):
         super(GameNetworkController, self).notify(event)
 
         if isinstance(event, events.ChooseTrumpEvent):
-            self.send("%d#%s" % (cmn.SAY_TRUMP, event.trump))
+            self.send_message(cmn.SAY_TRUMP, event.trump)
 
         elif isinstance(event, events.SayTricksEvent):
-            self.send("%d#%d" % (cmn.SAY_TRICKS, event.n))
+            self.send_message(cmn.SAY_TRICKS, event.n)
 
         elif isinstance(event, events.SayCardEvent):
-            self.send("%d#%s" % (cmn.SAY_CARD, event.card))
+            self.send_message(cmn.SAY_CARD, event.card)
+
+        elif isinstance(event, events.ResyncHandEvent):
+            self.send_message(cmn.RESYNC_HAND)
+
+        elif isinstance(event, events.ConnectionLostEvent):
+            # Reconnect and resume the session.
+            if self._state == cmn.ACCEPTED and self._resume_token is not None:
+                logging.info("Trying to resume the session.")
+                self._state = cmn.WAIT_FOR_HANDSHAKE
+                self._resuming = True
+                self._resume_deadline = time.time() + RESUME_RETRY_TIME
+                self.connect(self._host, self._port)
+
+        elif isinstance(event, events.ConnectionFailedEvent):
+            # Try again later if the server could not be reached.
+            if self._resuming and self._resume_token is not None and time.time() < self._resume_deadline:
+                self._retry_at = time.time() + RESUME_RETRY_INTERVAL
+
+        elif isinstance(event, events.TickEvent):
+            if self._retry_at is not None and time.time() >= self._retry_at:
+                logging.info("Trying again to resume the session.")
+                self._retry_at = None
+                self._state = cmn.WAIT_FOR_HANDSHAKE
+                self.connect(self._host, self._port)
+
+        elif isinstance(event, events.MessageReceivedEvent):
+            # Binary messages are already decoded by the connection.
+            if self._state == cmn.ACCEPTED:
+                self._handle_decoded_message(event.msg_id, event.fields)
+            else:
+                logging.warning("Got binary message %d before being accepted.", event.msg_id)
 
         elif isinstance(event, events.LineReceivedEvent):
             line = event.line
             line = line.translate(cmn.CHAR_TRANS_TABLE)
-            logging.debug("Received '%s' over network." % line)
+            log.debug("Received over network", line=line)
 
             if self._state == cmn.WAIT_FOR_HANDSHAKE:
                 # Apply the handshake function and send the result.
@@ -89,22 +117,30 @@ class GameNetworkController(NetworkController):
                     return
                 self._state = cmn.PENDING
                 answer = cmn.handshake_fun(val)
-                self.send(answer)
+                if self._binary_protocol:
+                    self.send("%d#%s" % (answer, cmn.BINARY_PROTOCOL))
+                else:
+                    self.send(answer)
 
             elif self._state == cmn.PENDING:
                 # Check if the handshake was accepted and send the username.
                 fail = False
                 val = cmn.WAIT_FOR_NAME-1
+                value, _, options = line.partition("#")
                 try:
-                    val = int(line)
+                    val = int(value)
                 except ValueError:
                     fail = True
+                self._binary_accepted = options == cmn.BINARY_PROTOCOL
                 if fail or val != cmn.WAIT_FOR_NAME:
                     logging.warning("Expected %d for handshake answer, received '%s'." % (cmn.WAIT_FOR_NAME, line))
                     self._ev_manager.post(events.ConnectionFailedEvent)
                     return
                 self._state = cmn.WAIT_FOR_NAME
-                self.send(self.username)
+                if self._resuming:
+                    self.send("%s#%s" % (self.username, self._resume_token))
+                else:
+                    self.send(self.username)
 
             elif self._state == cmn.WAIT_FOR_NAME:
                 if "#" not in line:
@@ -115,28 +151,37 @@ class GameNetworkController(NetworkController):
                         val = int(line)
                     except ValueError:
                         fail = True
-                    if fail or val != cmn.TAKEN_USERNAME:
+                    if not fail and val == cmn.INVALID_SESSION:
+                        logging.warning("The server refused to resume the session.")
+                        self._resume_token = None
+                        self._ev_manager.post(events.ConnectionFailedEvent())
+                    elif fail or val != cmn.TAKEN_USERNAME:
                         logging.warning("Expected error code %d, got '%s' instead." % (cmn.TAKEN_USERNAME, line))
                     else:
                         self._ev_manager.post(events.TakenUsernameEvent())
                 else:
                     # Check if the username was accepted.
                     try:
-                        msg_id, msg = self._split(line)
+                        msg_id, fields = HANDLERS.decode_text(line)
                     except InvalidMessageException:
                         logging.warning("Could not split message '%s'." % line)
                         return
-                    try:
-                        msg_id = int(msg_id)
-                    except ValueError:
-                        logging.warning("Could not convert msg id '%s' to int." % msg_id)
-                        return
-                    if msg_id != cmn.NEW_USER or msg != self.username:
+                    if msg_id != cmn.NEW_USER or fields[0] != self.username:
                         logging.warning("Expected the username acceptec message, got '%s' instead." % line)
                         return
                     self._state = cmn.ACCEPTED
+                    if self._binary_accepted:
+                        self.use_binary_protocol()
+                    if self._resuming:
+                        # The server sends the snapshot of the game.
+                        self._resuming = False
+                        logging.info("Resumed the session.")
+                        return
                     self._ev_manager.post(events.AcceptedUsernameEvent())
 
+                    # Take a seat at any open table.
+                    self.send_message(cmn.JOIN_TABLE, "")
+
             elif self._state == cmn.ACCEPTED:
                 self._handle_message(line)
 
@@ -145,87 +190,105 @@ class GameNetworkController(NetworkController):
 
     def _handle_message(self, line):
         """
-        Split the given line into message id and message and give them to _handle_valid_message.
+        Split the given line into message id and message fields and give them to _handle_decoded_message.
         :param line: the line
         """
-        if "#" not in line:
+        try:
+            msg_id, fields = HANDLERS.decode_text(line)
+        except InvalidMessageException:
             logging.warning("Got invalid message '%s' from server." % line)
-        else:
-            i = line.index("#")
-            msg_id, msg = line[:i], line[i+1:]
-            try:
-                msg_id = int(msg_id)
-            except ValueError:
-                logging.warning("Server used non-integer message id in message '%s'" % line)
-                return
-            if self._buffer_messages:
-                self._buffer.append((msg_id, msg))
-            else:
-                self._handle_valid_message(msg_id, msg)
+            return
+        self._handle_decoded_message(msg_id, fields)
 
-    def _handle_valid_message(self, msg_id, msg):
+    def _handle_decoded_message(self, msg_id, fields):
         """
-        Handle the message.
+        Handle the message or store it for later.
         :param msg_id: the message id
-        :param msg: the message
+        :param fields: the message fields
         """
-        if msg_id == cmn.NEW_USER:
-            self._ev_manager.post(events.PlayerJoinedEvent(msg))
-
-        elif msg_id == cmn.USER_LEFT:
-            self._ev_manager.post(events.PlayerLeftEvent(msg))
-
-        elif msg_id == cmn.START_GAME:
-            try:
-                l = json.loads(msg)
-            except ValueError:
-                logging.warning("Could not decrypt player order '%s'." % msg)
-                return
-            self._ev_manager.post(events.StartGameEvent(l))
-
-        elif msg_id == cmn.CARDS:
-            try:
-                l = json.loads(msg)
-            except ValueError:
-                logging.warning("Could not decrypt cards '%s'." % msg)
-                return
-            self._ev_manager.post(events.NewCardsEvent(l))
-
-        elif msg_id == cmn.ASK_TRUMP:
-            self._ev_manager.post(events.AskTrumpEvent())
-
-        elif msg_id == cmn.FOUND_TRUMP:
-            self._ev_manager.post(events.NewTrumpEvent(msg))
-
-        elif msg_id == cmn.ASK_TRICKS:
-            self._ev_manager.post(events.AskTricksEvent(int(msg)))
+        if msg_id == cmn.RESUME_TOKEN:
+            self._resume_token = fields[0]
+        elif self._buffer_messages:
+            self._buffer.append((msg_id, fields))
+        else:
+            self._handle_valid_message(msg_id, fields)
 
-        elif msg_id == cmn.PLAYER_SAID_TRICKS:
-            player, n = msg.split("#")
-            n = int(n)
-            self._ev_manager.post(events.PlayerSaidTricksEvent(player, n))
+    def _handle_valid_message(self, msg_id, fields):
+        """
+        Pass the message to its handler.
+        :param msg_id: the message id
+        :param fields: the decoded message fields
+        """
+        if not HANDLERS.dispatch(self, msg_id, fields):
+            logging.warning("TODO: Handle message (%d, %s)" % (msg_id, fields))
 
-        elif msg_id == cmn.ASK_CARD:
-            self._ev_manager.post(events.AskCardEvent())
+    def _shutdown(self):
+        """
+        Log the message profile and close all connections.
+        """
+        if HANDLERS.profile:
+            HANDLERS.log_profile()
+        super(GameNetworkController, self)._shutdown()
 
-        elif msg_id == cmn.PLAYER_PLAYED_CARD:
-            player, card = msg.split("#")
-            self._ev_manager.post(events.PlayerPlayedCardEvent(player, card))
+    @HANDLERS.handles(cmn.ASK_TRUMP)
+    def _ask_trump(self, msg_id, fields):
+        """
+        Ask the user for the trump.
+        """
+        self._ev_manager.post(events.AskTrumpEvent())
 
-        elif msg_id == cmn.WINS_TRICK:
-            self._ev_manager.post(events.WinTrickEvent(msg))
+    @HANDLERS.handles(cmn.CHAT_MESSAGES)
+    def _chat_messages(self, msg_id, fields):
+        """
+        Log the batch of chat messages and pass it on.
+        """
+        for username, text in fields[0]:
+            logging.info("%s: %s", username, text)
+        self._ev_manager.post(events.ChatEvent(fields[0]))
 
-        elif msg_id == cmn.MADE_POINTS:
-            points = json.loads(msg)
-            self._ev_manager.post(events.RoundPointsEvent(points))
+    @HANDLERS.handles(cmn.JOINED_TABLE)
+    def _joined_table(self, msg_id, fields):
+        """
+        Log the table that the user joined.
+        """
+        logging.info("Joined table %d.", fields[0])
 
-        elif msg_id == cmn.FINAL_WINNERS:
-            winners = json.loads(msg)
-            self._ev_manager.post(events.FinalWinnersEvent(winners))
+    @HANDLERS.handles(cmn.TABLE_CLOSED)
+    def _table_closed(self, msg_id, fields):
+        """
+        Log that the table was closed.
+        """
+        logging.info("Table %d was closed.", fields[0])
 
-        elif msg_id == cmn.FINAL_POINTS:
-            points = json.loads(msg)
-            self._ev_manager.post(events.FinalPointsEvent(points))
 
-        else:
-            logging.warning("TODO: Handle message (%d, %s)" % (msg_id, msg))
+def _post_event(event_type):
+    """
+    Return a message handler that posts the event with the message fields as arguments.
+    :param event_type: the event class
+    :return: the handler
+    """
+    def handler(controller, msg_id, fields):
+        controller._ev_manager.post(event_type(*fields))
+    return handler
+
+
+# The messages that are translated to events one to one.
+for _msg_id, _event_type in [(cmn.NEW_USER, events.PlayerJoinedEvent),
+                             (cmn.USER_LEFT, events.PlayerLeftEvent),
+                             (cmn.START_GAME, events.StartGameEvent),
+                             (cmn.CARDS, events.NewCardsEvent),
+                             (cmn.FOUND_TRUMP, events.NewTrumpEvent),
+                             (cmn.ASK_TRICKS, events.AskTricksEvent),
+                             (cmn.PLAYER_SAID_TRICKS, events.PlayerSaidTricksEvent),
+                             (cmn.ASK_CARD, events.AskCardEvent),
+                             (cmn.HAND, events.HandEvent),
+                             (cmn.PLAYER_PLAYED_CARD, events.PlayerPlayedCardEvent),
+                             (cmn.SNAPSHOT, events.SnapshotEvent),
+                             (cmn.TURN_TIMED_OUT, events.TurnTimedOutEvent),
+                             (cmn.WINS_TRICK, events.WinTrickEvent),
+                             (cmn.MADE_POINTS, events.RoundPointsEvent),
+                             (cmn.FINAL_WINNERS, events.FinalWinnersEvent),
+                             (cmn.FINAL_POINTS, events.FinalPointsEvent),
+                             (cmn.PLAYER_HISTORY, events.PlayerHistoryEvent),
+                             (cmn.TOP_PLAYERS, events.TopPlayersEvent)]:
+    HANDLERS.register(_msg_id, _post_event(_event_type))
@@ -0,0 +1,220 @@
+import os
+import json
+import Queue
+import struct
+import logging
+import threading
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+
+_LENGTH = struct.Struct(">I")
+
+# The kind of the first record of each segment.
+SNAPSHOT = "snapshot"
+
+
+def encode_record(table_id, kind, data):
+    """
+    Encode the record as json with a length prefix.
+    :param table_id: the table id, None for records that do not belong to a table
+    :param kind: the record kind
+    :param data: json serializable record data
+    :return: the encoded record
+    """
+    payload = json.dumps([table_id, kind, data], separators=(",", ":"))
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def decode_records(data):
+    """
+    Decode the records of a segment. A record that was torn by a crash ends the segment.
+    :param data: the content of the segment
+    :return: generator with (table_id, kind, data)
+    """
+    offset = 0
+    while offset + _LENGTH.size <= len(data):
+        length, = _LENGTH.unpack_from(data, offset)
+        start = offset + _LENGTH.size
+        if start + length > len(data):
+            return
+        try:
+            table_id, kind, record = json.loads(data[start:start+length])
+        except ValueError:
+            return
+        yield table_id, kind, record
+        offset = start + length
+
+
+class Journal(object):
+    """
+    Append-only journal of the state transitions of the running games.
+    The journal is a directory with numbered segment files. Each segment starts with a snapshot of all live tables and
+    is followed by the length-prefixed records of the transitions since the snapshot. A new segment is started
+    periodically, afterwards the older segments are deleted. The records are group-committed: all records that are
+    appended within the fsync interval are written with a single write and fsync.
+    The files are only touched by a dedicated writer thread, which writes the commits and the new segments in order, so
+    the reactor never waits for the disk. The records and snapshots are encoded in the reactor thread, because they
+    refer to the live game states; a snapshot of 1000 tables takes about 30 ms, once per snapshot interval.
+    """
+
+    _STOP = None
+
+    def __init__(self, directory, fsync_interval=0.1, snapshot_interval=60.0, clock=reactor):
+        """
+        :param directory: the journal directory, it is created if it does not exist
+        :param fsync_interval: seconds between the first append of a group and its commit, 0 commits once per turn
+        :param snapshot_interval: seconds between two snapshots
+        :param clock: provider of seconds and callLater
+        """
+        self._directory = directory
+        self._fsync_interval = fsync_interval
+        self._snapshot_interval = snapshot_interval
+        self._clock = clock
+        self._file = None  # the current segment, only used by the writer thread
+        self._segment = 0
+        self._pending = []
+        self._commit_call = None
+        self._snapshot_func = None
+        self._loop = None
+        self._queue = Queue.Queue()  # the writes for the writer thread
+        self._writer = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _segments(self):
+        """
+        Return the numbers of the existing segments.
+        :return: the sorted segment numbers
+        """
+        numbers = []
+        for name in os.listdir(self._directory):
+            number, ext = os.path.splitext(name)
+            if ext == ".journal" and number.isdigit():
+                numbers.append(int(number))
+        return sorted(numbers)
+
+    def _path(self, segment):
+        return os.path.join(self._directory, "%08d.journal" % segment)
+
+    def recover(self):
+        """
+        Return the records since the newest complete snapshot. Segments without a complete snapshot were torn while
+        they were started, so the snapshot of the segment before is used.
+        :return: list with (table_id, kind, data), the first record is the snapshot, empty if there is no snapshot
+        """
+        segments = self._segments()
+        if len(segments) > 0:
+            self._segment = segments[-1]
+        for segment in reversed(segments):
+            with open(self._path(segment), "rb") as f:
+                records = list(decode_records(f.read()))
+            if len(records) > 0 and records[0][1] == SNAPSHOT:
+                return records
+        return []
+
+    def start(self, snapshot_func):
+        """
+        Start the writer thread, start a new segment with a snapshot and take the following snapshots periodically.
+        :param snapshot_func: returns the json serializable snapshot of all live tables
+        """
+        self._snapshot_func = snapshot_func
+        self._writer = threading.Thread(target=self._run, name="journal writer")
+        self._writer.daemon = True
+        self._writer.start()
+        self.write_snapshot()
+        self._loop = LoopingCall(self.write_snapshot)
+        self._loop.clock = self._clock
+        self._loop.start(self._snapshot_interval, now=False)
+
+    def stop(self):
+        """
+        Commit the pending records, wait for the writer thread and close the journal.
+        """
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.commit()
+        if self._writer is not None:
+            self._queue.put(self._STOP)
+            self._writer.join()
+            self._writer = None
+
+    def append(self, table_id, kind, data):
+        """
+        Append the record. It is written with the next group commit.
+        :param table_id: the table id
+        :param kind: the record kind
+        :param data: json serializable record data
+        """
+        self._pending.append(encode_record(table_id, kind, data))
+        if self._commit_call is None:
+            self._commit_call = self._clock.callLater(self._fsync_interval, self.commit)
+
+    def commit(self):
+        """
+        Pass the pending records to the writer thread, which writes and fsyncs them.
+        """
+        if self._commit_call is not None:
+            if self._commit_call.active():
+                self._commit_call.cancel()
+            self._commit_call = None
+        if len(self._pending) == 0 or self._writer is None:
+            return
+        self._queue.put((self._write_records, "".join(self._pending)))
+        self._pending = []
+
+    def write_snapshot(self):
+        """
+        Pass the snapshot of all live tables to the writer thread, which starts a new segment with it and deletes the
+        older segments.
+        """
+        self.commit()
+        self._segment += 1
+        self._queue.put((self._start_segment, self._segment, encode_record(None, SNAPSHOT, self._snapshot_func())))
+
+    def _run(self):
+        """
+        Do the writes of the queue until the journal is stopped, then close the current segment. Runs in the writer
+        thread.
+        """
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            try:
+                item[0](*item[1:])
+            except (IOError, OSError) as ex:
+                logging.error("Could not write the journal: %s", ex)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_records(self, data):
+        """
+        Write and fsync the records. Runs in the writer thread.
+        :param data: the encoded records
+        """
+        if self._file is None:
+            return
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _start_segment(self, segment, snapshot):
+        """
+        Start the new segment with the snapshot and delete the older segments. Runs in the writer thread.
+        :param segment: the number of the new segment
+        :param snapshot: the encoded snapshot record
+        """
+        old_file = self._file
+        new_file = open(self._path(segment), "wb")
+        new_file.write(snapshot)
+        new_file.flush()
+        os.fsync(new_file.fileno())
+        self._file = new_file
+        if old_file is not None:
+            old_file.close()
+        for number in self._segments():
+            if number < segment:
+                os.remove(self._path(number))
+        logging.debug("Started journal segment %d.", segment)
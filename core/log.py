@@ -0,0 +1,146 @@
+import Queue
+import logging
+import threading
+
+
+_root = logging.getLogger()
+
+
+class Event(object):
+    """
+    A log message with named fields. The text is only built when a handler formats the record, so discarded messages
+    cost no string formatting.
+    """
+
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self):
+        if len(self.fields) == 0:
+            return self.name
+        return "%s: %s" % (self.name, " ".join("%s=%s" % (k, self.fields[k]) for k in sorted(self.fields)))
+
+
+def debug_enabled():
+    """
+    Return whether debug messages are logged.
+    :return: True if debug messages are logged
+    """
+    return _root.isEnabledFor(logging.DEBUG)
+
+
+def debug(name, **fields):
+    """
+    Log the event with level DEBUG. Does nothing but a level check if DEBUG is disabled. The keyword arguments are
+    evaluated by the caller in any case, so calls on hot paths with computed fields are guarded by debug_enabled.
+    :param name: the event name
+    :param fields: the event fields, a table_id field is used for sampling
+    """
+    if _root.isEnabledFor(logging.DEBUG):
+        _root.debug(Event(name, fields))
+
+
+class TableSampler(logging.Filter):
+    """
+    Only lets the debug events of every n-th table pass, so busy servers can trace some tables completely without
+    logging all of them. Events without table and records with level INFO or higher always pass.
+    """
+
+    def __init__(self, every_nth):
+        super(TableSampler, self).__init__()
+        assert every_nth > 0
+        self._every_nth = every_nth
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not isinstance(record.msg, Event):
+            return True
+        table_id = record.msg.fields.get("table_id")
+        return table_id is None or table_id % self._every_nth == 0
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts the log records into a queue instead of writing them. The message is formatted right away, so the records
+    do not hold references to mutable objects.
+    """
+
+    def __init__(self, queue):
+        super(QueueHandler, self).__init__()
+        self.queue = queue
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                self.format(record)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    Background thread that passes the records from the queue to the actual handlers.
+    """
+
+    _STOP = None
+
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        """
+        Start the background thread.
+        """
+        self._thread = threading.Thread(target=self._run, name="log writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write the remaining records and stop the background thread.
+        """
+        if self._thread is not None:
+            self.queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def configure(handler, level, sample_tables=1, threaded=False):
+    """
+    Set up the root logger.
+    :param handler: the handler that writes the log
+    :param level: the logging level
+    :param sample_tables: only log the debug events of every n-th table
+    :param threaded: if True, the handler is called from a background thread
+    :return: the started QueueListener if threaded is True, else None
+    """
+    listener = None
+    if threaded:
+        queue = Queue.Queue()
+        listener = QueueListener(queue, [handler])
+        listener.start()
+        handler = QueueHandler(queue)
+    if sample_tables > 1:
+        _root.addFilter(TableSampler(sample_tables))
+    _root.addHandler(handler)
+    _root.setLevel(level)
+    return listener
@@ -36,11 +36,12 @@ class LoginController(PygameController):
     The GUI controller.
     """
 
-    def __init__(self, ev_manager, model, view, login_file):
+    def __init__(self, ev_manager, model, view, login_file, binary_protocol=True):
         super(LoginController, self).__init__(ev_manager, view)
         assert isinstance(model, LoginModel)
         self._model = model
-        self._network_controller = GameNetworkController(self._ev_manager, buffer_messages=True)
+        self._network_controller = GameNetworkController(self._ev_manager, buffer_messages=True,
+                                                         binary_protocol=binary_protocol)
         self._network_running = False
         self._login_filename = login_file
 
@@ -105,12 +106,14 @@ class LoginController(PygameController):
                 return
             self._network_controller.username = self._model.username
 
-            # Check the port.
-            try:
-                port = int(self._model.port)
-            except ValueError:
-                logging.warning("Could not convert port %s to int." % self._model.port)
-                return
+            # Check the port. The port is not needed if the host is a UNIX socket or in-process address.
+            port = None
+            if not self._model.host.startswith(("unix:", "memory:")):
+                try:
+                    port = int(self._model.port)
+                except ValueError:
+                    logging.warning("Could not convert port %s to int." % self._model.port)
+                    return
 
             if self._network_running:
                 # Send the new username.
@@ -0,0 +1,112 @@
+import collections
+from twisted.internet import reactor
+
+
+class MatchmakingQueue(object):
+    """
+    The players that wait for a table, in buckets by table size and skill band. A band is an integer chosen by the
+    player, None means any skill. Players are only matched within their bucket.
+    Each bucket is an ordered dict, so enqueueing, cancelling and forming a table are O(1) per player and do not depend
+    on the number of waiting players. A table is formed as soon as a bucket has enough players for it, so a bucket never
+    holds a full table.
+    The expected wait is estimated from the smoothed interval between two arrivals in the bucket: a player waits for the
+    players that are still missing at the table.
+    """
+
+    def __init__(self, smoothing=0.2, clock=reactor):
+        """
+        :param smoothing: weight of the newest interval in the smoothed arrival interval
+        :param clock: provider of seconds
+        """
+        self._smoothing = smoothing
+        self._clock = clock
+        self._buckets = {}  # (num_players, band) => ordered dict client id => (client, enqueue time)
+        self._keys = {}  # client id => (num_players, band)
+        self._arrivals = {}  # (num_players, band) => [time of the last arrival, smoothed interval or None]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, client_id):
+        return client_id in self._keys
+
+    def key(self, client_id):
+        """
+        Return the bucket of the waiting player.
+        :param client_id: the client id
+        :return: the table size and the skill band, None if the player does not wait
+        """
+        return self._keys.get(client_id)
+
+    def enqueue(self, client_id, client, num_players, band=None):
+        """
+        Add the player to its bucket. If the bucket then has enough players, they are removed and returned.
+        :param client_id: the client id
+        :param client: the client
+        :param num_players: the table size
+        :param band: the skill band, None for any skill
+        :return: list with (client, waited seconds) of the players at the new table in arrival order, None if the
+                 player has to wait
+        """
+        assert client_id not in self._keys
+        key = (num_players, band)
+        now = self._clock.seconds()
+        arrival = self._arrivals.get(key)
+        if arrival is None:
+            self._arrivals[key] = [now, None]
+        else:
+            interval = now - arrival[0]
+            arrival[0] = now
+            arrival[1] = interval if arrival[1] is None else \
+                self._smoothing*interval + (1-self._smoothing)*arrival[1]
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = collections.OrderedDict()
+        bucket[client_id] = (client, now)
+        self._keys[client_id] = key
+        if len(bucket) < num_players:
+            return None
+
+        matched = []
+        for _ in xrange(num_players):
+            matched_id, (matched_client, enqueued) = bucket.popitem(last=False)
+            del self._keys[matched_id]
+            matched.append((matched_client, now - enqueued))
+        del self._buckets[key]
+        return matched
+
+    def remove(self, client_id):
+        """
+        Remove the player from the queue.
+        :param client_id: the client id
+        :return: the table size that the player waited for, None if the player did not wait
+        """
+        key = self._keys.pop(client_id, None)
+        if key is None:
+            return None
+        bucket = self._buckets[key]
+        del bucket[client_id]
+        if len(bucket) == 0:
+            del self._buckets[key]
+        return key[0]
+
+    def num_waiting(self, client_id):
+        """
+        Return the number of players in the bucket of the waiting player, including the player.
+        :param client_id: the client id
+        :return: the number of players
+        """
+        return len(self._buckets[self._keys[client_id]])
+
+    def expected_wait(self, client_id):
+        """
+        Return the expected seconds until the table of the waiting player is formed.
+        :param client_id: the client id
+        :return: the seconds, None if there were not enough arrivals for an estimate
+        """
+        key = self._keys[client_id]
+        interval = self._arrivals[key][1]
+        if interval is None:
+            return None
+        return (key[0] - len(self._buckets[key])) * interval
@@ -0,0 +1,392 @@
+import json
+import struct
+import common as cmn
+
+
+class InvalidMessageException(Exception):
+    pass
+
+
+# The field types of the messages.
+STR = 0  # arbitrary string
+INT = 1  # signed integer
+CARD = 2  # a single card, e.g. "H7" or "W2"
+SUIT = 3  # a single suit character, e.g. "H" or "W"
+CARDS = 4  # list of cards
+INTS = 5  # list of integers
+STRS = 6  # list of strings
+SCORES = 7  # list of [username, points] pairs
+JSON = 8  # anything else that can be json encoded
+
+# The fields of the messages that are sent from the server to the clients.
+SERVER_MESSAGES = {cmn.NEW_USER: (STR,),
+                   cmn.USER_LEFT: (STR,),
+                   cmn.CHAT_MESSAGES: (JSON,),
+                   cmn.RESUME_TOKEN: (STR,),
+                   cmn.START_GAME: (STRS,),
+                   cmn.CARDS: (CARDS,),
+                   cmn.ASK_TRICKS: (INT,),
+                   cmn.PLAYER_SAID_TRICKS: (STR, INT),
+                   cmn.ASK_CARD: (INT, INT, CARDS),
+                   cmn.ASK_TRUMP: (INT,),
+                   cmn.FOUND_TRUMP: (SUIT,),
+                   cmn.PLAYER_PLAYED_CARD: (STR, CARD),
+                   cmn.WINS_TRICK: (STR,),
+                   cmn.MADE_POINTS: (INTS,),
+                   cmn.FINAL_POINTS: (INTS,),
+                   cmn.FINAL_WINNERS: (SCORES,),
+                   cmn.TURN_TIMED_OUT: (INT, STR),
+                   cmn.SNAPSHOT: (JSON,),
+                   cmn.HAND: (INT, CARDS),
+                   cmn.UNKNOWN_MESSAGE: (STR,),
+                   cmn.NOT_YOUR_TURN: (STR,),
+                   cmn.INVALID_NUM_TRICKS: (INT,),
+                   cmn.INVALID_TRUMP: (STR,),
+                   cmn.INVALID_CARD: (STR,),
+                   cmn.NOT_FOLLOWED_SUIT: (STR, STR),
+                   cmn.INVALID_MOVE: (INT,),
+                   cmn.UNKNOWN_TABLE: (STR,),
+                   cmn.TABLE_FULL: (STR,),
+                   cmn.INVALID_TABLE_SIZE: (STR,),
+                   cmn.ALREADY_AT_TABLE: (INT,),
+                   cmn.NOT_AT_TABLE: (INT,),
+                   cmn.TABLE_LIST: (JSON,),
+                   cmn.JOINED_TABLE: (INT,),
+                   cmn.TABLE_CLOSED: (INT,),
+                   cmn.WATCHING_TABLE: (INT,),
+                   cmn.NO_STATISTICS: (INT,),
+                   cmn.PLAYER_HISTORY: (STR, JSON),
+                   cmn.TOP_PLAYERS: (JSON,),
+                   cmn.ALREADY_QUEUED: (INT,),
+                   cmn.QUEUED: (INT, INT, INT),
+                   cmn.LEFT_QUEUE: (INT,),
+                   cmn.CHAT_RATE_LIMITED: (INT,)}
+
+# The fields of the messages that are sent from the clients to the server.
+CLIENT_MESSAGES = {cmn.CHAT: (STR,),
+                   cmn.SAY_TRICKS: (INT,),
+                   cmn.SAY_CARD: (CARD,),
+                   cmn.SAY_TRUMP: (SUIT,),
+                   cmn.RESYNC_HAND: (),
+                   cmn.LIST_TABLES: (),
+                   cmn.CREATE_TABLE: (STR,),
+                   cmn.JOIN_TABLE: (STR,),
+                   cmn.LEAVE_TABLE: (),
+                   cmn.WATCH_TABLE: (INT,),
+                   cmn.GET_HISTORY: (STR,),
+                   cmn.GET_TOP_PLAYERS: (),
+                   cmn.ENQUEUE: (STR,)}
+
+# The one byte codes of the cards and suits in the binary protocol.
+CARD_CODES = [c+n for c in "CDHS" for n in "23456789TJQKA"] + [c+n for c in "WL" for n in "0123"]
+CARD_VALUES = dict((card, i) for i, card in enumerate(CARD_CODES))
+SUIT_CODES = "CDHSWL"
+SUIT_VALUES = dict((suit, i) for i, suit in enumerate(SUIT_CODES))
+
+_FRAME_HEADER = struct.Struct("!IH")  # payload length and message id
+_INT = struct.Struct("!i")
+_LENGTH = struct.Struct("!I")
+
+# The maximum payload size of a binary frame, larger frames are refused by both encoder and decoder.
+MAX_PAYLOAD_SIZE = 1 << 24
+
+# The maximum number of items in a list field, the count is a single byte.
+MAX_LIST_SIZE = 255
+
+
+def to_str(value):
+    """
+    Replace the unicode strings in the json decoded value by byte strings.
+    :param value: the json decoded value
+    :return: the value with byte strings
+    """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [to_str(x) for x in value]
+    elif isinstance(value, dict):
+        return dict((to_str(k), to_str(v)) for k, v in value.iteritems())
+    return value
+
+
+def _encode_text_field(field_type, value):
+    """
+    Return the text representation of the field.
+    :param field_type: the field type
+    :param value: the field value
+    :return: the text
+    """
+    if field_type == INT:
+        return "%d" % value
+    elif field_type in (STR, CARD, SUIT):
+        return value
+    else:
+        return json.dumps(value)
+
+
+def _decode_text_field(field_type, text):
+    """
+    Parse the text representation of the field.
+    :param field_type: the field type
+    :param text: the text
+    :return: the field value
+    """
+    try:
+        if field_type == INT:
+            return int(text)
+        elif field_type in (STR, CARD, SUIT):
+            return text
+        value = json.loads(text)
+    except ValueError:
+        raise InvalidMessageException()
+    if field_type in (CARDS, STRS):
+        return [str(x) for x in value]
+    elif field_type == SCORES:
+        return [[str(name), points] for name, points in value]
+    return to_str(value)
+
+
+def encode_text(msg_id, fields, schema):
+    """
+    Encode the message as text line "msgid#field1#field2...".
+    :param msg_id: the message id
+    :param fields: the field values
+    :param schema: dict with the field types of each message id
+    :return: the line without the delimiter
+    """
+    field_types = schema[msg_id]
+    if len(field_types) == 0:
+        return "%d#" % msg_id
+    return "#".join(["%d" % msg_id] + [_encode_text_field(t, v) for t, v in zip(field_types, fields)])
+
+
+def decode_text(line, schema):
+    """
+    Split the text line into message id and field values. The last field gets the rest of the line, so it may contain
+    the "#" separator.
+    :param line: the line
+    :param schema: dict with the field types of each message id
+    :return: msg_id, fields
+    """
+    if "#" not in line:
+        raise InvalidMessageException()
+    i = line.index("#")
+    try:
+        msg_id = int(line[:i])
+    except ValueError:
+        raise InvalidMessageException()
+    if msg_id not in schema:
+        raise InvalidMessageException()
+    field_types = schema[msg_id]
+    if len(field_types) == 0:
+        return msg_id, []
+    texts = line[i+1:].split("#", len(field_types)-1)
+    if len(texts) != len(field_types):
+        raise InvalidMessageException()
+    return msg_id, [_decode_text_field(t, x) for t, x in zip(field_types, texts)]
+
+
+def _encode_string(value):
+    """
+    Return the length prefixed string.
+    :param value: the string
+    :return: the encoded string
+    """
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    if len(value) > MAX_PAYLOAD_SIZE:
+        raise ValueError("The string has %d bytes, the limit is %d." % (len(value), MAX_PAYLOAD_SIZE))
+    return _LENGTH.pack(len(value)) + value
+
+
+def _encode_count(value):
+    """
+    Return the one byte item count of the list.
+    :param value: the list
+    :return: the encoded count
+    """
+    if len(value) > MAX_LIST_SIZE:
+        raise ValueError("The list has %d items, the limit is %d." % (len(value), MAX_LIST_SIZE))
+    return chr(len(value))
+
+
+def _encode_binary_field(field_type, value):
+    """
+    Return the binary representation of the field.
+    :param field_type: the field type
+    :param value: the field value
+    :return: the bytes
+    """
+    if field_type == INT:
+        return _INT.pack(value)
+    elif field_type == STR:
+        return _encode_string(value)
+    elif field_type == CARD:
+        return chr(CARD_VALUES[value])
+    elif field_type == SUIT:
+        return chr(SUIT_VALUES[value])
+    elif field_type == CARDS:
+        return _encode_count(value) + "".join(chr(CARD_VALUES[card]) for card in value)
+    elif field_type == INTS:
+        return _encode_count(value) + struct.pack("!%di" % len(value), *value)
+    elif field_type == STRS:
+        return _encode_count(value) + "".join(_encode_string(x) for x in value)
+    elif field_type == SCORES:
+        return _encode_count(value) + "".join(_encode_string(name) + _INT.pack(points) for name, points in value)
+    else:
+        return _encode_string(json.dumps(value))
+
+
+def _decode_string(data, offset):
+    """
+    Read a length prefixed string. Unwanted characters are replaced by spaces.
+    :param data: the data
+    :param offset: the start of the string
+    :return: the string and the offset after the string
+    """
+    n = _LENGTH.unpack_from(data, offset)[0]
+    offset += _LENGTH.size
+    if offset + n > len(data):
+        raise InvalidMessageException()
+    return data[offset:offset+n].translate(cmn.CHAR_TRANS_TABLE), offset + n
+
+
+def _decode_binary_field(field_type, data, offset):
+    """
+    Read a field from the binary data.
+    :param field_type: the field type
+    :param data: the data
+    :param offset: the start of the field
+    :return: the field value and the offset after the field
+    """
+    if field_type == INT:
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    elif field_type == STR:
+        return _decode_string(data, offset)
+    elif field_type == CARD:
+        return CARD_CODES[ord(data[offset])], offset + 1
+    elif field_type == SUIT:
+        return SUIT_CODES[ord(data[offset])], offset + 1
+    elif field_type == CARDS:
+        n = ord(data[offset])
+        codes = data[offset+1:offset+1+n]
+        if len(codes) != n:
+            raise InvalidMessageException()
+        return [CARD_CODES[ord(c)] for c in codes], offset + 1 + n
+    elif field_type == INTS:
+        n = ord(data[offset])
+        return list(struct.unpack_from("!%di" % n, data, offset+1)), offset + 1 + n * _INT.size
+    elif field_type == STRS:
+        n = ord(data[offset])
+        offset += 1
+        values = []
+        for _ in xrange(n):
+            value, offset = _decode_string(data, offset)
+            values.append(value)
+        return values, offset
+    elif field_type == SCORES:
+        n = ord(data[offset])
+        offset += 1
+        values = []
+        for _ in xrange(n):
+            name, offset = _decode_string(data, offset)
+            values.append([name, _INT.unpack_from(data, offset)[0]])
+            offset += _INT.size
+        return values, offset
+    else:
+        text, offset = _decode_string(data, offset)
+        try:
+            return to_str(json.loads(text)), offset
+        except ValueError:
+            raise InvalidMessageException()
+
+
+def encode_binary(msg_id, fields, schema):
+    """
+    Encode the message as binary frame: payload length (4 bytes), message id (2 bytes) and the payload. Cards and suits
+    are single bytes, integers have 4 bytes, strings have a 4 byte length prefix and lists a 1 byte item count.
+    :param msg_id: the message id
+    :param fields: the field values
+    :param schema: dict with the field types of each message id
+    :return: the frame
+    :raise ValueError: if the payload is larger than MAX_PAYLOAD_SIZE or a list has more than MAX_LIST_SIZE items
+    """
+    payload = "".join(_encode_binary_field(t, v) for t, v in zip(schema[msg_id], fields))
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ValueError("The payload of message %d has %d bytes, the limit is %d." %
+                         (msg_id, len(payload), MAX_PAYLOAD_SIZE))
+    return _FRAME_HEADER.pack(len(payload), msg_id) + payload
+
+
+def decode_frame(data, offset, schema):
+    """
+    Decode the binary frame that starts at the given offset. Frames that announce more than MAX_PAYLOAD_SIZE bytes are
+    invalid, so the receiver never buffers them.
+    :param data: the received data
+    :param offset: the start of the frame
+    :param schema: dict with the field types of each message id
+    :return: msg_id, fields and the offset after the frame or None if the frame is not complete
+    """
+    if len(data) - offset < _FRAME_HEADER.size:
+        return None
+    length, msg_id = _FRAME_HEADER.unpack_from(data, offset)
+    if length > MAX_PAYLOAD_SIZE:
+        raise InvalidMessageException()
+    end = offset + _FRAME_HEADER.size + length
+    if end > len(data):
+        return None
+    if msg_id not in schema:
+        raise InvalidMessageException()
+    payload = data[offset+_FRAME_HEADER.size:end]
+    fields = []
+    pos = 0
+    try:
+        for field_type in schema[msg_id]:
+            value, pos = _decode_binary_field(field_type, payload, pos)
+            fields.append(value)
+    except (IndexError, struct.error):
+        raise InvalidMessageException()
+    if pos != len(payload):
+        raise InvalidMessageException()
+    return msg_id, fields, end
+
+
+class TextCodec(object):
+    """
+    Encodes messages as "msgid#msg" lines.
+    """
+
+    binary = False
+
+    def __init__(self, schema, delimiter="\r\n"):
+        self._schema = schema
+        self._delimiter = delimiter
+
+    def encode(self, msg_id, fields):
+        """
+        Return the wire bytes of the message.
+        :param msg_id: the message id
+        :param fields: the field values
+        :return: the bytes
+        """
+        return encode_text(msg_id, fields, self._schema) + self._delimiter
+
+
+class BinaryCodec(object):
+    """
+    Encodes messages as length prefixed binary frames.
+    """
+
+    binary = True
+
+    def __init__(self, schema):
+        self._schema = schema
+
+    def encode(self, msg_id, fields):
+        """
+        Return the wire bytes of the message.
+        :param msg_id: the message id
+        :param fields: the field values
+        :return: the bytes
+        """
+        return encode_binary(msg_id, fields, self._schema)
@@ -0,0 +1,271 @@
+import bisect
+from twisted.web.resource import Resource
+
+
+class Counter(object):
+    """
+    A value that only goes up.
+    """
+
+    kind = "counter"
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        Increase the value.
+        :param amount: the amount
+        """
+        self.value += amount
+
+    def dump(self):
+        """
+        Return the value in a json serializable form.
+        :return: the value
+        """
+        return self.value
+
+    def merge(self, dumped):
+        """
+        Add the dumped value of another process.
+        :param dumped: the return value of dump
+        """
+        self.value += dumped
+
+    def samples(self, name, labels):
+        """
+        Yield the samples of the text exposition format.
+        :param name: the metric name
+        :param labels: list with the (name, value) pairs of the labels
+        :return: generator with (sample name, labels, value)
+        """
+        yield name, labels, self.value
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down.
+    """
+
+    kind = "gauge"
+
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        """
+        Decrease the value.
+        :param amount: the amount
+        """
+        self.value -= amount
+
+
+class Histogram(object):
+    """
+    Counts the observed values in buckets with fixed upper bounds. The buckets are stored without the cumulative sums,
+    so an observation only increments a single bucket.
+    """
+
+    kind = "histogram"
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Record the value.
+        :param value: the value
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def dump(self):
+        return [self.counts, self.sum]
+
+    def merge(self, dumped):
+        counts, total = dumped
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.sum += total
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(self.bounds, self.counts):
+            cumulative += n
+            yield name + "_bucket", labels + [("le", repr(float(bound)))], cumulative
+        cumulative += self.counts[-1]
+        yield name + "_bucket", labels + [("le", "+Inf")], cumulative
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, cumulative
+
+
+class Metric(object):
+    """
+    A named metric with an optional label. The children for all label values are created up front, so the hot paths
+    only look up the child and update a number: metric[label_value].inc().
+    """
+
+    def __init__(self, name, doc, create, label=None, values=()):
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self._create = create
+        if label is None:
+            self.child = create()
+            self._children = {None: self.child}
+        else:
+            self.child = None
+            self._children = dict((value, create()) for value in values)
+        self.kind = create().kind
+
+    def __getitem__(self, value):
+        return self._children[value]
+
+    def dump(self):
+        """
+        Return the values of all children in a json serializable form.
+        :return: list with [label value, dumped value]
+        """
+        return [[value, child.dump()] for value, child in self._children.iteritems()]
+
+    def merge(self, dumped):
+        """
+        Add the dumped values of the same metric from another process.
+        :param dumped: the return value of dump
+        """
+        for value, child_dump in dumped:
+            child = self._children.get(value)
+            if child is None:
+                child = self._children[value] = self._create()
+            child.merge(child_dump)
+
+    def render(self, lines):
+        """
+        Append the lines of the text exposition format.
+        :param lines: the list with the lines
+        """
+        lines.append("# HELP %s %s" % (self.name, self.doc))
+        lines.append("# TYPE %s %s" % (self.name, self.kind))
+        for value in sorted(self._children):
+            labels = [] if self.label is None else [(self.label, str(value))]
+            for name, sample_labels, sample in self._children[value].samples(self.name, labels):
+                if len(sample_labels) == 0:
+                    lines.append("%s %s" % (name, _format_value(sample)))
+                else:
+                    label_text = ",".join('%s="%s"' % (k, v) for k, v in sample_labels)
+                    lines.append("%s{%s} %s" % (name, label_text, _format_value(sample)))
+
+
+def _format_value(value):
+    """
+    Return the text of the sample value.
+    :param value: the value
+    :return: the text
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return "%d" % value
+
+
+class Registry(object):
+    """
+    Holds the metrics of a process. All updates happen in the reactor thread, so there are no locks.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, doc, label=None, values=()):
+        """
+        Create a counter.
+        :param name: the metric name
+        :param doc: the help text
+        :param label: the label name, None for a metric without label
+        :param values: all values of the label
+        :return: the metric
+        """
+        return self._add(Metric(name, doc, Counter, label, values))
+
+    def gauge(self, name, doc, label=None, values=()):
+        """
+        Create a gauge.
+        :param name: the metric name
+        :param doc: the help text
+        :param label: the label name, None for a metric without label
+        :param values: all values of the label
+        :return: the metric
+        """
+        return self._add(Metric(name, doc, Gauge, label, values))
+
+    def histogram(self, name, doc, bounds, label=None, values=()):
+        """
+        Create a histogram.
+        :param name: the metric name
+        :param doc: the help text
+        :param bounds: the sorted upper bounds of the buckets
+        :param label: the label name, None for a metric without label
+        :param values: all values of the label
+        :return: the metric
+        """
+        return self._add(Metric(name, doc, lambda: Histogram(bounds), label, values))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def dump(self):
+        """
+        Return the values of all metrics in a json serializable form, e. g. to send them to another process.
+        :return: dict with the dumped values of each metric
+        """
+        return dict((metric.name, metric.dump()) for metric in self._metrics)
+
+    def render(self, others=()):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        :param others: dumped registries of other processes, their values are added to the own values
+        :return: the text
+        """
+        if len(others) > 0:
+            merged = Registry()
+            for metric in self._metrics:
+                copy = merged._add(Metric(metric.name, metric.doc, metric._create, metric.label))
+                copy.merge(metric.dump())
+                for other in others:
+                    copy.merge(other.get(metric.name, []))
+            return merged.render()
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsResource(Resource):
+    """
+    Serves the metrics of the registry over http.
+    """
+
+    isLeaf = True
+
+    def __init__(self, registry, others=lambda: ()):
+        """
+        :param registry: the registry
+        :param others: returns the dumped registries of other processes that are added to the own values
+        """
+        Resource.__init__(self)
+        self._registry = registry
+        self._others = others
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "text/plain; version=0.0.4")
+        return self._registry.render(self._others())
+
+
+# The registry of this process.
+REGISTRY = Registry()
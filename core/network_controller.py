@@ -5,6 +5,10 @@ from twisted.internet import reactor
 from twisted.internet.threads import blockingCallFromThread
 import events
 import logging
+import log
+import common as cmn
+import messages
+import transports
 from multiprocessing import Queue
 import threading
 
@@ -14,24 +18,34 @@ class NetworkController(object):
     Controller for network events.
     """
 
-    def __init__(self, ev_manager):
+    def __init__(self, ev_manager, binary_protocol=False):
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
         self._ev_manager.register_listener(self)
         self._network_events = Queue()
         self._connector = None
         self._server_connector = None
+        self._host = None
+        self._port = None
+        self._binary_protocol = binary_protocol  # if True, ask the server for the binary protocol
+        self._codec = messages.TextCodec(messages.CLIENT_MESSAGES)
         self._thread = threading.Thread(target=reactor.run, args=(False,))
         self._thread.start()
         logging.debug("Started reactor.")
 
-    def connect(self, host, port):
+    def connect(self, host, port=None):
         """
-        Start the reactor.
+        Connect to the server.
+        :param host: the host, or the address (see transports.parse_address) if no port is given
+        :param port: the TCP port
         """
-        logging.info("Connecting host '%s' on port '%d'." % (host, port))
-        self._server_connector = ServerConnector(self._post_network_event)
-        self._connector = blockingCallFromThread(reactor, reactor.connectTCP, host, port, self._server_connector)
+        address = host if port is None else "tcp:%s:%d" % (host, port)
+        logging.info("Connecting to '%s'." % address)
+        self._host = host
+        self._port = port
+        self._server_connector = ServerConnector(self._post_network_event, self._binary_protocol)
+        self._codec = messages.TextCodec(messages.CLIENT_MESSAGES)
+        self._connector = blockingCallFromThread(reactor, transports.connect, address, self._server_connector)
 
     def _post_network_event(self, event):
         """
@@ -68,7 +82,25 @@ class NetworkController(object):
         else:
             line = str(line)
             self._server_connector.sendLine(line)
-            logging.debug("Sent '%s' over network." % line)
+            log.debug("Sent over network", line=line)
+
+    def send_message(self, msg_id, *fields):
+        """
+        Encode the message with the negotiated protocol and send it over network.
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        if self._server_connector is None:
+            logging.warning("Tried to send over network, but there are no connections.")
+        else:
+            self._server_connector.write(self._codec.encode(msg_id, fields))
+            log.debug("Sent message over network", msg_id=msg_id, fields=fields)
+
+    def use_binary_protocol(self):
+        """
+        Encode all further messages with the binary protocol.
+        """
+        self._codec = messages.BinaryCodec(messages.CLIENT_MESSAGES)
 
     def notify(self, event):
         """
@@ -98,11 +130,15 @@ class NetworkController(object):
 class ServerConnection(LineReceiver):
     """
     Protocol: See ClientConnection in server.py.
+    If the server accepts the binary protocol, the connection switches to binary frames after the accept message. The
+    frames are decoded here and posted as MessageReceivedEvent.
     """
 
     def __init__(self, factory):
         assert isinstance(factory, ServerConnector)
         self._factory = factory
+        self._binary_accepted = False
+        self._frame_buffer = ""
 
     def connectionMade(self):
         """
@@ -126,6 +162,31 @@ class ServerConnection(LineReceiver):
         :param line: the received line
         """
         self._factory.post_func(events.LineReceivedEvent(line))
+        if self._factory.binary_protocol:
+            if line == "%d#%s" % (cmn.WAIT_FOR_NAME, cmn.BINARY_PROTOCOL):
+                self._binary_accepted = True
+            elif self._binary_accepted and line.startswith("%d#" % cmn.NEW_USER):
+                self.setRawMode()
+
+    def rawDataReceived(self, data):
+        """
+        Decode the binary frames and post the messages.
+        :param data: the received data
+        """
+        data = self._frame_buffer + data
+        offset = 0
+        while True:
+            try:
+                msg = messages.decode_frame(data, offset, messages.SERVER_MESSAGES)
+            except messages.InvalidMessageException:
+                logging.warning("Received an invalid binary frame.")
+                self.transport.loseConnection()
+                return
+            if msg is None:
+                break
+            msg_id, fields, offset = msg
+            self._factory.post_func(events.MessageReceivedEvent(msg_id, fields))
+        self._frame_buffer = data[offset:]
 
 
 class ServerConnector(ClientFactory):
@@ -133,8 +194,9 @@ class ServerConnector(ClientFactory):
     Creates a ClientConnection for each incoming client.
     """
 
-    def __init__(self, post_func):
+    def __init__(self, post_func, binary_protocol=False):
         self.post_func = post_func
+        self.binary_protocol = binary_protocol
         self.connections = {}
 
     def buildProtocol(self, addr):
@@ -146,3 +208,7 @@ class ServerConnector(ClientFactory):
     def sendLine(self, line):
         for k in self.connections:
             k.sendLine(line)
+
+    def write(self, data):
+        for k in self.connections:
+            k.transport.write(data)
@@ -0,0 +1,159 @@
+import log
+import logging
+from zope.interface import implementer
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet import reactor
+
+
+class OutputBatcher(object):
+    """
+    Collects the output of the connections during the current reactor turn and writes it with a single writeSequence
+    call per transport at the beginning of the next turn (before the reactor does the actual socket writes).
+    Broadcasts are encoded only once per codec.
+    """
+
+    def __init__(self, call_later=reactor.callLater):
+        self._call_later = call_later
+        self._pending = {}  # connection => list with the encoded messages
+        self._flush_call = None
+
+    def write(self, connection, data):
+        """
+        Queue the encoded data for the connection.
+        :param connection: the connection, must have the method write_sequence
+        :param data: the encoded data
+        """
+        chunks = self._pending.get(connection)
+        if chunks is None:
+            self._pending[connection] = [data]
+            if self._flush_call is None:
+                self._flush_call = self._call_later(0, self.flush)
+        else:
+            chunks.append(data)
+
+    def broadcast(self, connections, msg_id, fields, table_id=None):
+        """
+        Encode the message once for each codec of the connections and queue it for all connections.
+        :param connections: the connections, must have the attribute codec and the method write_sequence
+        :param msg_id: the message id
+        :param fields: the message fields
+        :param table_id: the table the message belongs to, only used for logging
+        """
+        encoded = {}
+        for connection in connections:
+            codec = connection.codec
+            data = encoded.get(codec)
+            if data is None:
+                data = encoded[codec] = codec.encode(msg_id, fields)
+            self.write(connection, data)
+        if log.debug_enabled():
+            log.debug("Broadcast message", msg_id=msg_id, fields=fields, receivers=len(connections), table_id=table_id)
+
+    def pending_bytes(self, connection):
+        """
+        Return the number of queued bytes of the connection.
+        :param connection: the connection
+        :return: the number of bytes
+        """
+        return sum(len(chunk) for chunk in self._pending.get(connection, ()))
+
+    def flush_connection(self, connection):
+        """
+        Write the queued data of the given connection right away.
+        :param connection: the connection
+        """
+        chunks = self._pending.pop(connection, None)
+        if chunks is not None:
+            connection.write_sequence(chunks)
+
+    def discard(self, connection):
+        """
+        Drop the queued data of the given connection.
+        :param connection: the connection
+        """
+        self._pending.pop(connection, None)
+
+    def flush(self):
+        """
+        Write the queued data of all connections.
+        """
+        self._flush_call = None
+        pending, self._pending = self._pending, {}
+        for connection, chunks in pending.iteritems():
+            connection.write_sequence(chunks)
+
+
+@implementer(IPushProducer)
+class LagMonitor(object):
+    """
+    Watches the send buffer of a transport. The monitor is registered as streaming producer, so the transport pauses it
+    once more than high_water bytes are buffered and resumes it when the buffer is empty again. A connection that stays
+    paused for longer than the grace period, or that gets another high_water bytes queued while paused, is reported
+    with the slow callback. This keeps the memory of a stalled client bounded. The resume callback is called when a
+    lagging connection caught up again.
+    """
+
+    def __init__(self, transport, high_water, grace_period, slow_callback, resume_callback=None,
+                 call_later=reactor.callLater, name=None):
+        self._transport = transport
+        self._name = name  # the peer in the log messages, by default host:port of the transport
+        self._high_water = high_water
+        self._grace_period = grace_period
+        self._slow_callback = slow_callback
+        self._resume_callback = resume_callback
+        self._call_later = call_later
+        self._timeout = None
+        self.lagging = False
+        self.lag_bytes = 0  # bytes that were written while lagging
+        transport.bufferSize = high_water
+        transport.registerProducer(self, True)
+
+    def pauseProducing(self):
+        name = self._name
+        if name is None:
+            peer = self._transport.getPeer()
+            name = "%s:%d" % (peer.host, peer.port)
+        logging.info("Send buffer of %s is above the high-water mark.", name)
+        self.lagging = True
+        self.lag_bytes = 0
+        if self._timeout is None:
+            self._timeout = self._call_later(self._grace_period, self._expire)
+
+    def resumeProducing(self):
+        was_lagging = self.lagging
+        self.lagging = False
+        self._cancel_timeout()
+        if was_lagging and self._resume_callback is not None:
+            self._resume_callback()
+
+    def stopProducing(self):
+        self.lagging = False
+        self._cancel_timeout()
+
+    def written(self, num_bytes):
+        """
+        Count the bytes that were written while the connection is lagging.
+        :param num_bytes: the number of bytes
+        """
+        self.lag_bytes += num_bytes
+        if self.lag_bytes > self._high_water:
+            self._expire()
+
+    def detach(self):
+        """
+        Stop watching the transport, e. g. before the connection is closed or handed over.
+        """
+        self.stopProducing()
+        if self._transport.producer is self:
+            self._transport.unregisterProducer()
+
+    def _cancel_timeout(self):
+        if self._timeout is not None:
+            if self._timeout.active():
+                self._timeout.cancel()
+            self._timeout = None
+
+    def _expire(self):
+        self.lagging = False
+        self._cancel_timeout()
+        self._slow_callback()
@@ -0,0 +1,135 @@
+import logging
+import collections
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+
+class IdleReaper(object):
+    """
+    Periodically closes the connections that were idle for longer than the timeout of their state, e. g. clients that
+    never finish the handshake or accepted clients that went silent.
+    For each state, the connections are kept in an ordered dict sorted by their last recorded activity, so a sweep only
+    looks at the expired connections and the first one that is still alive. The activity is recorded with the given
+    resolution, so an active connection is moved in its index at most once per resolution interval.
+    The deadline states, e. g. the handshake states, share one index: Their timeout counts from the moment the
+    connection entered the first of them, neither activity nor a change between them extends it.
+    Idle connections for which the keep predicate returns True, e. g. players waiting at their table, count as active.
+    """
+
+    def __init__(self, timeouts, close_callback, interval=5.0, resolution=1.0, clock=reactor, deadline_states=(),
+                 keep=None):
+        """
+        :param timeouts: dict with the timeout in seconds of each state, states without timeout are not tracked
+        :param close_callback: called as close_callback(connection, state) for each idle connection
+        :param interval: seconds between two sweeps
+        :param resolution: seconds between two recorded activities of a connection
+        :param clock: provider of seconds and callLater
+        :param deadline_states: the states with a common deadline, they use the smallest of their timeouts
+        :param keep: called as keep(connection) for each idle connection, the connection is not closed if it returns
+                     True
+        """
+        timeouts = dict((state, t) for state, t in timeouts.iteritems() if t is not None and t > 0)
+        self._deadline_states = frozenset(state for state in deadline_states if state in timeouts)
+        self._keys = dict((state, self._deadline_states if state in self._deadline_states else state)
+                          for state in timeouts)  # state => key of its index
+        self._timeouts = {}  # index key => timeout
+        for state, t in timeouts.iteritems():
+            key = self._keys[state]
+            self._timeouts[key] = min(t, self._timeouts.get(key, t))
+        self._indexes = dict((key, collections.OrderedDict()) for key in self._timeouts)
+        self._states = {}  # connection => state of the connection, the index is the one of the state
+        self._close_callback = close_callback
+        self._keep = keep
+        self._resolution = resolution
+        self._clock = clock
+        self._loop = LoopingCall(self.sweep)
+        self._loop.clock = clock
+        self._interval = interval
+        self.num_reaped = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def start(self):
+        """
+        Start the periodic sweeps.
+        """
+        if len(self._timeouts) > 0 and not self._loop.running:
+            self._loop.start(self._interval, now=False)
+
+    def stop(self):
+        """
+        Stop the periodic sweeps.
+        """
+        if self._loop.running:
+            self._loop.stop()
+
+    def track(self, connection, state):
+        """
+        Record activity of the connection in the given state. Call this whenever the state of the connection changes.
+        A change between two deadline states keeps the deadline.
+        :param connection: the connection
+        :param state: the state
+        """
+        if state in self._deadline_states and self._states.get(connection) in self._deadline_states:
+            self._states[connection] = state
+            return
+        self.untrack(connection)
+        key = self._keys.get(state)
+        if key is not None:
+            index = self._indexes[key]
+            index[connection] = self._clock.seconds()
+            self._states[connection] = state
+
+    def untrack(self, connection):
+        """
+        Stop watching the connection, e. g. because it was closed or handed over.
+        :param connection: the connection
+        """
+        state = self._states.pop(connection, None)
+        if state is not None:
+            del self._indexes[self._keys[state]][connection]
+
+    def touch(self, connection):
+        """
+        Record activity of the connection. The activity in a deadline state is ignored.
+        :param connection: the connection
+        """
+        state = self._states.get(connection)
+        if state is None or state in self._deadline_states:
+            return
+        index = self._indexes[self._keys[state]]
+        now = self._clock.seconds()
+        if now - index[connection] >= self._resolution:
+            del index[connection]
+            index[connection] = now
+
+    def sweep(self):
+        """
+        Close all connections that were idle for too long.
+        :return: the number of closed connections
+        """
+        now = self._clock.seconds()
+        reaped = []
+        kept = []
+        for key, index in self._indexes.iteritems():
+            timeout = self._timeouts[key]
+            for connection, last_activity in index.iteritems():
+                if now - last_activity < timeout:
+                    break
+                if self._keep is not None and self._keep(connection):
+                    kept.append((index, connection))
+                else:
+                    reaped.append((connection, self._states[connection]))
+        for index, connection in kept:
+            del index[connection]
+            index[connection] = now
+        for connection, state in reaped:
+            self.untrack(connection)
+            self._close_callback(connection, state)
+        if len(reaped) > 0:
+            counts = collections.Counter(state for _, state in reaped)
+            logging.info("Reaped %d idle connections (%s).", len(reaped),
+                         ", ".join("%d in state %s" % (n, s) for s, n in sorted(counts.items())))
+        self.num_reaped += len(reaped)
+        return len(reaped)
@@ -0,0 +1,250 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+import collections
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThread
+from twisted.internet import defer
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (game_id INTEGER PRIMARY KEY, finished REAL, num_players INTEGER,
+                                  num_rounds INTEGER);
+CREATE TABLE IF NOT EXISTS results (game_id INTEGER, username TEXT, name TEXT, seat INTEGER, points INTEGER,
+                                    winner INTEGER, exact_bids INTEGER, round_points TEXT, said TEXT, made TEXT);
+CREATE INDEX IF NOT EXISTS results_by_username ON results (username, game_id);
+CREATE TABLE IF NOT EXISTS players (username TEXT PRIMARY KEY, name TEXT, games INTEGER, wins INTEGER, points INTEGER,
+                                    rounds INTEGER, exact_bids INTEGER);
+CREATE INDEX IF NOT EXISTS players_by_points ON players (points);
+"""
+
+_HISTORY_QUERY = """
+SELECT games.finished, games.num_players, games.num_rounds, results.points, results.winner, results.exact_bids,
+       results.round_points
+FROM results JOIN games ON results.game_id = games.game_id
+WHERE results.username = ? ORDER BY results.game_id DESC LIMIT ?
+"""
+
+_TOP_QUERY = """
+SELECT name, games, wins, points, rounds, exact_bids FROM players ORDER BY points DESC LIMIT ?
+"""
+
+
+def _connect(path):
+    """
+    Open the database in WAL mode, so the lookups are not blocked by a running write.
+    :param path: the path of the database file
+    :return: the connection
+    """
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class StatsStore(object):
+    """
+    Stores the results of the finished games in a SQLite database, keyed by the lowercase username because usernames
+    are case-insensitive. The username as the player spelled it in the last game is kept for display.
+    The reactor never touches the database: The results are queued and written in batches with deferToThread, one
+    transaction per batch and at most one batch at a time. The lookups also run in the thread pool, on a second
+    connection, and their results are kept in an LRU cache until a batch changes them. Concurrent lookups of the same
+    key share one query.
+    """
+
+    def __init__(self, path, batch_interval=1.0, cache_size=1000, clock=reactor):
+        """
+        :param path: the path of the database file, it is created if it does not exist
+        :param batch_interval: seconds between the first queued result of a batch and its write
+        :param cache_size: the number of cached lookups
+        :param clock: provider of callLater
+        """
+        self._batch_interval = batch_interval
+        self._cache_size = cache_size
+        self._clock = clock
+        self._writer = _connect(path)
+        self._writer.executescript(_SCHEMA)
+        self._writer_lock = threading.Lock()
+        self._reader = _connect(path)
+        self._reader_lock = threading.Lock()
+        self._queue = []
+        self._flush_call = None
+        self._writing = False
+        self._cache = collections.OrderedDict()  # (kind, args) => rows, the least recently used first
+        self._lookups = {}  # (kind, args) => the deferreds that wait for the running query
+        self._generation = 0  # incremented by each written batch, lookups of an older generation are not cached
+
+    def record(self, result):
+        """
+        Queue the result of a finished game. It is written with the next batch.
+        :param result: the result, see WizardGame.result
+        """
+        self._queue.append((time.time(), result))
+        if self._flush_call is None and not self._writing:
+            self._flush_call = self._clock.callLater(self._batch_interval, self._flush)
+
+    def _flush(self):
+        """
+        Write the queued results in the thread pool.
+        """
+        self._flush_call = None
+        if len(self._queue) == 0:
+            return
+        batch, self._queue = self._queue, []
+        self._writing = True
+        d = deferToThread(self._write, batch)
+        d.addCallbacks(self._written, self._write_failed, errbackArgs=(len(batch),))
+
+    def _written(self, usernames):
+        """
+        Drop the cached lookups that changed with the batch and write the results that were queued in the meantime.
+        :param usernames: the usernames of the written results
+        """
+        self._writing = False
+        self._generation += 1
+        for key in self._cache.keys():
+            if key[0] == "top" or key[1][0] in usernames:
+                del self._cache[key]
+        if len(self._queue) > 0 and self._flush_call is None:
+            self._flush_call = self._clock.callLater(self._batch_interval, self._flush)
+
+    def _write_failed(self, failure, num_results):
+        """
+        Log the error of a batch. The batch is lost, retrying would fail again for most errors.
+        :param failure: the failure
+        :param num_results: the number of results in the batch
+        """
+        logging.error("Could not store %d game results: %s", num_results, failure.getErrorMessage())
+        self._written(set())
+
+    def _write(self, batch):
+        """
+        Write the batch in one transaction. Runs in the thread pool.
+        :param batch: list with (time, result)
+        :return: the lowercase usernames of the written results
+        """
+        usernames = set()
+        with self._writer_lock:
+            with self._writer:
+                for finished, result in batch:
+                    usernames.update(self._insert(finished, result))
+        return usernames
+
+    def _insert(self, finished, result):
+        """
+        Insert the result of one game and update the totals of its players. The seats of bots are left out.
+        :param finished: the time when the game was finished
+        :param result: the result
+        :return: the lowercase usernames of the players
+        """
+        cursor = self._writer.execute("INSERT INTO games (finished, num_players, num_rounds) VALUES (?, ?, ?)",
+                                      (finished, result["num_players"], result["num_rounds"]))
+        game_id = cursor.lastrowid
+        totals = [sum(player["points"]) for player in result["players"]]
+        usernames = []
+        for seat, player in enumerate(result["players"]):
+            if player.get("bot"):
+                continue
+            name = player["username"]
+            username = name.lower()
+            winner = int(totals[seat] == max(totals))
+            exact_bids = sum(1 for said, made in zip(player["said"], player["made"]) if said == made)
+            self._writer.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (game_id, username, name, seat, totals[seat], winner, exact_bids,
+                                  json.dumps(player["points"]), json.dumps(player["said"]),
+                                  json.dumps(player["made"])))
+            self._writer.execute("INSERT OR IGNORE INTO players VALUES (?, ?, 0, 0, 0, 0, 0)", (username, name))
+            self._writer.execute("UPDATE players SET name = ?, games = games + 1, wins = wins + ?, "
+                                 "points = points + ?, rounds = rounds + ?, exact_bids = exact_bids + ? "
+                                 "WHERE username = ?",
+                                 (name, winner, totals[seat], len(player["points"]), exact_bids, username))
+            usernames.append(username)
+        return usernames
+
+    def history(self, username, limit=20):
+        """
+        Return the most recent games of the player.
+        :param username: the username, in any case
+        :param limit: the maximum number of games
+        :return: deferred list with [finished, number of players, number of rounds, points, winner, exact bids,
+                 round points], the newest game first
+        """
+        return self._lookup("history", (username.lower(), limit), _HISTORY_QUERY,
+                            lambda row: list(row[:6]) + [json.loads(row[6])])
+
+    def top(self, limit=100):
+        """
+        Return the players with the most points.
+        :param limit: the number of players
+        :return: deferred list with [username, games, wins, points, bid accuracy]
+        """
+        return self._lookup("top", (limit,), _TOP_QUERY,
+                            lambda row: [str(row[0])] + list(row[1:4]) + [float(row[5]) / max(row[4], 1)])
+
+    def _lookup(self, kind, args, query, convert):
+        """
+        Return the cached rows of the lookup or run the query in the thread pool.
+        :param kind: the kind of the lookup
+        :param args: the query arguments
+        :param query: the query
+        :param convert: converts a row
+        :return: deferred list with the converted rows
+        """
+        key = (kind, args)
+        rows = self._cache.pop(key, None)
+        if rows is not None:
+            self._cache[key] = rows
+            return defer.succeed(rows)
+        d = defer.Deferred()
+        if key in self._lookups:
+            self._lookups[key].append(d)
+            return d
+        self._lookups[key] = [d]
+        query_d = deferToThread(self._query, query, args)
+        query_d.addCallback(lambda result: [convert(row) for row in result])
+        query_d.addBoth(self._looked_up, key, self._generation)
+        return d
+
+    def _query(self, query, args):
+        """
+        Run the query. Runs in the thread pool.
+        :param query: the query
+        :param args: the query arguments
+        :return: the rows
+        """
+        with self._reader_lock:
+            return self._reader.execute(query, args).fetchall()
+
+    def _looked_up(self, result, key, generation):
+        """
+        Cache the rows unless a batch was written while the query ran, and pass them to the waiting deferreds.
+        :param result: the rows or the failure
+        :param key: the lookup key
+        :param generation: the generation when the query was started
+        """
+        if isinstance(result, list) and generation == self._generation:
+            self._cache[key] = result
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        for d in self._lookups.pop(key):
+            if isinstance(result, list):
+                d.callback(result)
+            else:
+                d.errback(result)
+
+    def close(self):
+        """
+        Write the queued results and close the database. Called after the reactor stopped.
+        """
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        if len(self._queue) > 0:
+            self._write(self._queue)
+            self._queue = []
+        with self._writer_lock:
+            self._writer.close()
+        with self._reader_lock:
+            self._reader.close()
@@ -0,0 +1,154 @@
+import logging
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+
+class Timer(object):
+    """
+    A timer of the timing wheel.
+    """
+
+    __slots__ = ("deadline", "callback", "args", "_wheel", "_slot")
+
+    def __init__(self, wheel, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self._wheel = wheel
+        self._slot = None
+
+    def active(self):
+        """
+        Return whether the timer is still waiting.
+        :return: True if the timer did neither expire nor was cancelled
+        """
+        return self._slot is not None
+
+    def cancel(self):
+        """
+        Cancel the timer. Does nothing if the timer is not active.
+        """
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+            self._wheel._num_timers -= 1
+
+
+class TimingWheel(object):
+    """
+    Hierarchical timing wheel: Level l has num_slots slots that cover num_slots**l ticks each. A timer is put into the
+    lowest level that reaches its deadline. Whenever a slot of a level comes up, its timers are moved to the lower
+    levels, until they expire from level 0. Scheduling, cancelling and expiring a timer take constant time, no matter
+    how many timers there are, and the whole wheel is driven by a single LoopingCall that only runs while timers are
+    active.
+    """
+
+    def __init__(self, resolution=0.1, slot_bits=6, num_levels=4, clock=reactor):
+        """
+        :param resolution: the seconds per tick
+        :param slot_bits: each level has 2**slot_bits slots
+        :param num_levels: the number of levels, longer delays are clamped to the range of the wheel
+        :param clock: provider of callLater, used for the LoopingCall
+        """
+        self.resolution = resolution
+        self._slot_bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._max_ticks = (1 << (slot_bits * num_levels)) - 1
+        self._levels = [[set() for _ in xrange(1 << slot_bits)] for _ in xrange(num_levels)]
+        self._now = 0  # the current tick
+        self._num_timers = 0
+        self._loop = LoopingCall.withCount(self._advance)
+        self._loop.clock = clock
+
+    def __len__(self):
+        return self._num_timers
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call callback(*args) after the given delay.
+        :param delay: the delay in seconds, it is rounded up to the next tick
+        :param callback: the callback
+        :param args: the callback arguments
+        :return: the timer
+        """
+        ticks = min(max(1, int(-(-delay // self.resolution))), self._max_ticks)
+        timer = Timer(self, self._now + ticks, callback, args)
+        self._insert(timer)
+        self._num_timers += 1
+        if not self._loop.running:
+            self._loop.start(self.resolution, now=False)
+        return timer
+
+    def stop(self):
+        """
+        Cancel all timers.
+        """
+        for level in self._levels:
+            for slot in level:
+                for timer in slot:
+                    timer._slot = None
+                slot.clear()
+        self._num_timers = 0
+        if self._loop.running:
+            self._loop.stop()
+
+    def _insert(self, timer):
+        """
+        Put the timer into the slot of the lowest level that reaches its deadline.
+        :param timer: the timer
+        """
+        diff = timer.deadline - self._now
+        level = 0
+        while diff >> (self._slot_bits * (level+1)) > 0:
+            level += 1
+        slot = self._levels[level][(timer.deadline >> (self._slot_bits * level)) & self._mask]
+        slot.add(timer)
+        timer._slot = slot
+
+    def _cascade(self, level):
+        """
+        Move the timers of the current slot of the given level to the lower levels.
+        :param level: the level
+        """
+        slot = self._levels[level][(self._now >> (self._slot_bits * level)) & self._mask]
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._insert(timer)
+
+    def _advance(self, num_ticks):
+        """
+        Advance the wheel by the number of ticks that passed since the last call and run the expired timers.
+        :param num_ticks: the number of ticks
+        """
+        for _ in xrange(num_ticks):
+            self._tick()
+        if self._num_timers == 0 and self._loop.running:
+            self._loop.stop()
+
+    def _tick(self):
+        """
+        Advance the wheel by one tick.
+        """
+        self._now += 1
+
+        # Cascade the higher levels whose slots begin with this tick, the highest level first.
+        level = 0
+        while level+1 < len(self._levels) and self._now & ((1 << (self._slot_bits * (level+1))) - 1) == 0:
+            level += 1
+        for l in xrange(level, 0, -1):
+            self._cascade(l)
+
+        # Run the expired timers.
+        slot = self._levels[0][self._now & self._mask]
+        if len(slot) == 0:
+            return
+        timers = list(slot)
+        slot.clear()
+        self._num_timers -= len(timers)
+        for timer in timers:
+            timer._slot = None
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                logging.exception("Timer callback failed.")
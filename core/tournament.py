@@ -0,0 +1,366 @@
+import os
+import json
+import math
+import random
+import logging
+from twisted.internet import reactor
+
+
+# The pairing systems.
+SWISS = "swiss"
+ROUND_ROBIN = "round_robin"
+
+
+def _circle_round(players, round_index):
+    """
+    Return the tables of a round of the circle method with two players per table: The first player stays in place, the
+    others are rotated, and the seat list is folded in the middle. A bye is added for an odd number of players.
+    :param players: the players in seed order
+    :param round_index: the index of the round
+    :return: list with the players of each table, the player with the bye gets no table
+    """
+    padded = list(players) + [None] * (len(players) % 2)
+    rest = padded[1:]
+    shift = round_index % len(rest)
+    order = padded[:1] + rest[shift:] + rest[:shift]
+    tables = [[order[j], order[-1-j]] for j in xrange(len(order) // 2)]
+    return [table for table in tables if None not in table]
+
+
+def _covering_schedule(players, table_size, rng):
+    """
+    Return rounds until every player met every other player. The players are spread evenly over the tables. The
+    tables of a round are filled one by one: first the player with the most players left to meet, then the players who
+    meet the most new players at the table. Each round covers at least one new pair, so the schedule is finite.
+    :param players: the players
+    :param table_size: the number of players per table
+    :param rng: the random generator that shuffles the players of each round, it breaks the ties
+    :return: list with the tables of each round
+    """
+    num_tables = -(-len(players) // table_size)
+    sizes = [len(players) // num_tables + (1 if j < len(players) % num_tables else 0) for j in xrange(num_tables)]
+    unmet = dict((player, set(players).difference([player])) for player in players)
+    rounds = []
+    while any(len(others) > 0 for others in unmet.itervalues()):
+        remaining = list(players)
+        rng.shuffle(remaining)
+        tables = []
+        for size in sizes:
+            table = [max(remaining, key=lambda p: len(unmet[p]))]
+            remaining.remove(table[0])
+            while len(table) < size:
+                best = max(remaining, key=lambda p: (sum(1 for q in table if q in unmet[p]), len(unmet[p])))
+                remaining.remove(best)
+                table.append(best)
+            tables.append(table)
+        for table in tables:
+            for player in table:
+                unmet[player].difference_update(table)
+        rounds.append([table for table in tables if len(table) > 1])
+    return rounds
+
+
+def round_robin_schedule(players, table_size, attempts=20):
+    """
+    Return the rounds of a round robin in which every player meets every other player at least once. With two players
+    per table, this is the circle method: Everyone meets everyone exactly once in n-1 rounds, n rounded up to an even
+    number. Larger tables get a greedy covering schedule, the shortest of some attempts. It usually needs more rounds
+    than the lower bound of (n-1)/(table_size-1), e. g. 28 instead of 21 for 64 players at tables of four.
+    :param players: the players in seed order
+    :param table_size: the number of players per table
+    :param attempts: the number of greedy schedules that are tried for larger tables
+    :return: list with the tables of each round, see round_robin_tables
+    """
+    if table_size == 2:
+        return [_circle_round(players, i) for i in xrange(len(players) + len(players) % 2 - 1)]
+    rng = random.Random(0)
+    return min((_covering_schedule(players, table_size, rng) for _ in xrange(attempts)), key=len)
+
+
+def round_robin_tables(schedule, round_index):
+    """
+    Return the tables of a round of the round robin. Rounds beyond the schedule start it over.
+    :param schedule: the schedule, see round_robin_schedule
+    :param round_index: the index of the round, starting with 0
+    :return: list with the players of each table, players without a table have a bye
+    """
+    return schedule[round_index % len(schedule)]
+
+
+def swiss_tables(ranked, table_size, met):
+    """
+    Return the tables of a Swiss round: Players with similar points sit together. Each table starts with the best
+    remaining player, the other seats go to the players among the next ones who met the seated players least often.
+    :param ranked: the players, the best first
+    :param table_size: the number of players per table
+    :param met: dict player => dict other player => number of games together
+    :return: list with the players of each table, a single remaining player gets no table
+    """
+    remaining = list(ranked)
+    tables = []
+    while len(remaining) > 1:
+        table = [remaining.pop(0)]
+        while len(table) < table_size and len(remaining) > 0:
+            window = remaining[:2*table_size]
+            best = min(window, key=lambda p: (sum(met[p].get(q, 0) for q in table), remaining.index(p)))
+            remaining.remove(best)
+            table.append(best)
+        tables.append(table)
+    return tables
+
+
+class Tournament(object):
+    """
+    A tournament of many rounds. In each round the players are paired at tables (Swiss or round robin) and play one
+    game per table. The round points of each game (MADE_POINTS) are added to the standings as they come in, a player
+    without a table in a round (bye) gets no points. The next round is paired once all tables of the round are closed.
+    The tournament is json serializable with dump and load, so it can be checkpointed.
+    """
+
+    def __init__(self, name, players, pairing=SWISS, num_rounds=None, table_size=4, game_rounds=None, schedule=None):
+        """
+        :param name: the name of the tournament
+        :param players: the usernames in seed order
+        :param pairing: SWISS or ROUND_ROBIN
+        :param num_rounds: the number of rounds, by default log2 of the number of players for Swiss and the length of
+                           the schedule for round robin; fewer rounds leave some pairs of players unmet
+        :param table_size: the number of players per table
+        :param game_rounds: the number of rounds per game, None for the default of the table size
+        :param schedule: the round robin schedule, by default round_robin_schedule
+        """
+        if pairing not in (SWISS, ROUND_ROBIN):
+            raise ValueError("Unknown pairing '%s', expected %s or %s." % (pairing, SWISS, ROUND_ROBIN))
+        if not 2 <= table_size <= 6:
+            raise ValueError("The table size must be between 2 and 6.")
+        if len(players) < 2 or len(set(p.lower() for p in players)) != len(players):
+            raise ValueError("A tournament needs at least two players with different usernames.")
+        self.name = name
+        self.players = list(players)
+        self.pairing = pairing
+        self.table_size = table_size
+        self.game_rounds = game_rounds
+        self.schedule = None
+        if pairing == ROUND_ROBIN:
+            self.schedule = schedule if schedule is not None else round_robin_schedule(self.players, table_size)
+        if num_rounds is None:
+            if pairing == ROUND_ROBIN:
+                num_rounds = len(self.schedule)
+            else:
+                num_rounds = int(math.ceil(math.log(len(players), 2)))
+        self.num_rounds = num_rounds
+        self.points = dict((player, 0) for player in players)  # the standings
+        self.rounds = []  # the tables of each round, see next_round
+        self._players = dict((player.lower(), player) for player in players)  # usernames are case-insensitive
+
+    def player(self, username):
+        """
+        Return the player with the username as it is written in the tournament.
+        :param username: the username
+        :return: the player, None if the user does not play in the tournament
+        """
+        return self._players.get(username.lower())
+
+    @property
+    def round(self):
+        """
+        Return the number of the current round.
+        :return: the round, 0 before the first round
+        """
+        return len(self.rounds)
+
+    @property
+    def tables(self):
+        """
+        Return the tables of the current round.
+        :return: list with the tables, see next_round
+        """
+        return self.rounds[-1] if len(self.rounds) > 0 else []
+
+    @property
+    def round_finished(self):
+        """
+        Return whether all tables of the current round are closed.
+        :return: True if the round is finished else False
+        """
+        return all(table["finished"] for table in self.tables)
+
+    @property
+    def finished(self):
+        """
+        Return whether the last round is finished.
+        :return: True if the tournament is over else False
+        """
+        return self.round >= self.num_rounds and self.round_finished
+
+    def _met(self):
+        """
+        Count how often each pair of players sat at the same table.
+        :return: dict player => dict other player => number of games together
+        """
+        met = dict((player, {}) for player in self.players)
+        for tables in self.rounds:
+            for table in tables:
+                for p in table["players"]:
+                    for q in table["players"]:
+                        if p != q:
+                            met[p][q] = met[p].get(q, 0) + 1
+        return met
+
+    def standings(self):
+        """
+        Return the players ordered by points, ties keep the seed order.
+        :return: list with (username, points)
+        """
+        ranked = sorted(self.players, key=lambda p: (-self.points[p], self.players.index(p)))
+        return [(player, self.points[player]) for player in ranked]
+
+    def next_round(self):
+        """
+        Pair the players of the next round.
+        :return: list with a dict per table: the players, the table id (set by the server), the players in seat order
+                 once the game started, the points of the players in this game and whether the table is closed
+        """
+        assert self.round_finished and self.round < self.num_rounds
+        if self.pairing == ROUND_ROBIN:
+            tables = round_robin_tables(self.schedule, self.round)
+        else:
+            tables = swiss_tables([player for player, _ in self.standings()], self.table_size, self._met())
+        self.rounds.append([{"players": players, "table_id": None, "seats": None,
+                             "points": dict((player, 0) for player in players), "finished": False}
+                            for players in tables])
+        return self.tables
+
+    def game_started(self, key, usernames):
+        """
+        Remember the seat order of the game at the table.
+        :param key: the index of the table in the current round
+        :param usernames: the usernames in seat order
+        """
+        self.tables[key]["seats"] = [self.player(username) for username in usernames]
+
+    def add_points(self, key, points):
+        """
+        Add the round points of the game at the table to the standings. Seats of users that do not play in the
+        tournament, e. g. bots that took the seat of an absent player, are left out.
+        :param key: the index of the table in the current round
+        :param points: the round points in seat order
+        """
+        table = self.tables[key]
+        for username, seat_points in zip(table["seats"] or [], points):
+            if username in table["points"]:
+                table["points"][username] += seat_points
+                self.points[username] += seat_points
+
+    def set_points(self, key, points):
+        """
+        Replace the points of the game at the table, e. g. with the points of a game that was recovered from the
+        journal.
+        :param key: the index of the table in the current round
+        :param points: dict username => points
+        """
+        points = dict((self.player(username), p) for username, p in points.iteritems())
+        table = self.tables[key]
+        for username in table["points"]:
+            self.points[username] += points.get(username, 0) - table["points"][username]
+            table["points"][username] = points.get(username, 0)
+
+    def close_table(self, key):
+        """
+        Mark the table as closed. The points of an unfinished game stay in the standings.
+        :param key: the index of the table in the current round
+        """
+        self.tables[key]["finished"] = True
+
+    def dump(self):
+        """
+        Return the tournament in a json serializable form.
+        :return: dict with the settings, the round robin schedule, the standings and the tables of all rounds
+        """
+        return {"name": self.name, "players": self.players, "pairing": self.pairing, "num_rounds": self.num_rounds,
+                "table_size": self.table_size, "game_rounds": self.game_rounds, "schedule": self.schedule,
+                "points": self.points, "rounds": self.rounds}
+
+    @classmethod
+    def load(cls, dumped):
+        """
+        Create the tournament from the return value of dump.
+        :param dumped: the dumped tournament
+        :return: the tournament
+        """
+        schedule = None if dumped.get("schedule") is None else \
+            [[[str(p) for p in table] for table in tables] for tables in dumped["schedule"]]
+        tournament = cls(str(dumped["name"]), [str(p) for p in dumped["players"]], str(dumped["pairing"]),
+                         dumped["num_rounds"], dumped["table_size"], dumped["game_rounds"], schedule)
+        tournament.points = dict((str(player), points) for player, points in dumped["points"].iteritems())
+        tournament.rounds = [[{"players": [str(p) for p in table["players"]], "table_id": table["table_id"],
+                               "seats": None if table["seats"] is None else
+                               [None if p is None else str(p) for p in table["seats"]],
+                               "points": dict((str(p), points) for p, points in table["points"].iteritems()),
+                               "finished": table["finished"]}
+                              for table in tables] for tables in dumped["rounds"]]
+        return tournament
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create the tournament from the settings in the config file.
+        :param config: dict with name, players, pairing, rounds, table_size and game_rounds, only players is required
+        :return: the tournament
+        """
+        return cls(str(config.get("name", "Tournament")), [str(p) for p in config["players"]],
+                   str(config.get("pairing", SWISS)), config.get("rounds"), config.get("table_size", 4),
+                   config.get("game_rounds"))
+
+
+class Checkpoint(object):
+    """
+    Writes the state of the tournament to a file. The changes of one interval are written at once, the file is
+    replaced atomically, so a crash leaves either the old or the new checkpoint.
+    """
+
+    def __init__(self, path, dump, interval=1.0, clock=reactor):
+        """
+        :param path: the path of the checkpoint file
+        :param dump: returns the json serializable state
+        :param interval: seconds between a change and its write
+        :param clock: provider of callLater
+        """
+        self._path = path
+        self._dump = dump
+        self._interval = interval
+        self._clock = clock
+        self._write_call = None
+
+    def changed(self):
+        """
+        Write the state once the interval is over.
+        """
+        if self._write_call is None:
+            self._write_call = self._clock.callLater(self._interval, self.write)
+
+    def write(self):
+        """
+        Write the state right away.
+        """
+        if self._write_call is not None:
+            if self._write_call.active():
+                self._write_call.cancel()
+            self._write_call = None
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._dump(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self._path)
+
+    def read(self):
+        """
+        Return the state of the last checkpoint.
+        :return: the state, None if there is no checkpoint
+        """
+        if not os.path.exists(self._path):
+            return None
+        with open(self._path) as f:
+            state = json.load(f)
+        logging.info("Read the tournament checkpoint %s.", self._path)
+        return state
@@ -0,0 +1,286 @@
+import os
+import itertools
+from twisted.internet import reactor
+from twisted.internet import defer
+from twisted.internet.address import IPv4Address, IPv6Address, UNIXAddress
+from twisted.internet.error import ConnectionRefusedError
+from twisted.internet.protocol import connectionDone
+from twisted.python.failure import Failure
+
+
+# The length of the accept queue of UNIX sockets.
+UNIX_BACKLOG = 1024
+
+# The listening in-process servers by name.
+_memory_servers = {}
+_memory_ports = itertools.count(1)
+# UNIX sockets of clients are unnamed, so their connections are numbered.
+_unix_peers = itertools.count(1)
+
+
+class MemoryAddress(object):
+    """
+    The address of one end of an in-process connection.
+    """
+
+    def __init__(self, name, port):
+        self.type = "MEMORY"
+        self.host = "memory:%s" % name
+        self.port = port
+
+    def __repr__(self):
+        return "MemoryAddress(%s, %d)" % (self.host, self.port)
+
+
+def parse_address(address):
+    """
+    Split the address into the transport and its arguments. The addresses are "tcp:PORT" (listen on all interfaces),
+    "tcp:HOST:PORT", "unix:PATH" and "memory:NAME".
+    :param address: the address
+    :return: the transport ("tcp", "unix" or "memory") and the host and port, the path or the name
+    """
+    kind, _, rest = address.partition(":")
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return kind, (host, int(port))
+    if kind in ("unix", "memory") and len(rest) > 0:
+        return kind, rest
+    raise ValueError("Invalid address '%s', expected tcp:[HOST:]PORT, unix:PATH or memory:NAME." % address)
+
+
+def address_family(addr):
+    """
+    Return the transport of a connection by the address of its peer.
+    :param addr: the address
+    :return: "tcp", "unix" or "memory"
+    """
+    if isinstance(addr, (IPv4Address, IPv6Address)):
+        return "tcp"
+    if isinstance(addr, UNIXAddress):
+        return "unix"
+    return "memory"
+
+
+def peer_name(addr):
+    """
+    Return host and port of the peer. Unnamed UNIX sockets get "unix" and a running number.
+    :param addr: the address
+    :return: host, port
+    """
+    if isinstance(addr, UNIXAddress):
+        return addr.name or "unix", next(_unix_peers)
+    return str(addr.host), addr.port
+
+
+def listen(address, factory, clock=reactor):
+    """
+    Accept the connections on the address with the factory.
+    :param address: the address, see parse_address
+    :param factory: the protocol factory
+    :param clock: the reactor, memory connections use its callLater
+    :return: the listening port, it has the method stopListening
+    """
+    kind, args = parse_address(address)
+    if kind == "tcp":
+        return clock.listenTCP(args[1], factory, interface=args[0])
+    if kind == "unix":
+        if os.path.exists(args):
+            os.remove(args)
+        # Connecting to a UNIX socket with a full backlog fails right away instead of being retried like with TCP.
+        return clock.listenUNIX(args, factory, backlog=UNIX_BACKLOG)
+    if args in _memory_servers:
+        raise ValueError("An in-process server already listens on '%s'." % address)
+    _memory_servers[args] = (factory, clock)
+    return MemoryPort(args)
+
+
+def connect(address, factory, clock=reactor):
+    """
+    Connect to the address with the client factory.
+    :param address: the address, see parse_address
+    :param factory: the client factory
+    :param clock: the reactor, memory connections use its callLater
+    :return: the connector, it has the method disconnect
+    """
+    kind, args = parse_address(address)
+    if kind == "tcp":
+        return clock.connectTCP(args[0] or "127.0.0.1", args[1], factory)
+    if kind == "unix":
+        return clock.connectUNIX(args, factory)
+    connector = MemoryConnector(args, factory, clock)
+    clock.callLater(0, connector.connect)
+    return connector
+
+
+class MemoryPort(object):
+    """
+    The listening port of an in-process server.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def stopListening(self):
+        _memory_servers.pop(self._name, None)
+        return defer.succeed(None)
+
+
+class MemoryTransport(object):
+    """
+    One end of an in-process connection. Written data is passed to the protocol at the other end in the next reactor
+    turn, all writes of a turn at once, so protocols are never called reentrantly and no socket is involved. Like the
+    TCP transport, the registered producer is paused once more than bufferSize bytes wait for delivery and resumed
+    when they were delivered.
+    """
+
+    def __init__(self, host, peer, clock):
+        self._host = host
+        self._peer = peer
+        self._clock = clock
+        self.other = None  # the transport at the other end
+        self.protocol = None
+        self.producer = None
+        self.bufferSize = 65536
+        self.disconnecting = False
+        self.disconnected = False
+        self._pending = []
+        self._pending_bytes = 0
+        self._producer_paused = False
+        self._deliver_call = None
+        self.close_callback = None  # called once the connection is closed
+
+    def getHost(self):
+        return self._host
+
+    def getPeer(self):
+        return self._peer
+
+    def write(self, data):
+        if self.disconnecting or len(data) == 0:
+            return
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        if self.producer is not None and not self._producer_paused and self._pending_bytes > self.bufferSize:
+            self._producer_paused = True
+            self.producer.pauseProducing()
+        if self._deliver_call is None:
+            self._deliver_call = self._clock.callLater(0, self._deliver)
+
+    def writeSequence(self, data):
+        for chunk in data:
+            self.write(chunk)
+
+    def _deliver(self):
+        self._deliver_call = None
+        data = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        if len(data) > 0 and not self.other.disconnected:
+            self.other.protocol.dataReceived(data)
+        if self.disconnecting:
+            self._close()
+        elif self._producer_paused:
+            self._producer_paused = False
+            if self.producer is not None:
+                self.producer.resumeProducing()
+
+    def loseConnection(self):
+        """
+        Close the connection once the written data was delivered.
+        """
+        if self.disconnecting:
+            return
+        self.disconnecting = True
+        if self._deliver_call is None:
+            self._deliver_call = self._clock.callLater(0, self._deliver)
+
+    def abortConnection(self):
+        """
+        Close the connection right away, the written data is dropped.
+        """
+        self._pending = []
+        self._pending_bytes = 0
+        self.disconnecting = True
+        if self._deliver_call is None:
+            self._deliver_call = self._clock.callLater(0, self._deliver)
+
+    def stopProducing(self):
+        """
+        Close the connection like loseConnection, which is what stopping a TCP transport does.
+        """
+        self.loseConnection()
+
+    def _close(self):
+        """
+        Tell both protocols that the connection is closed.
+        """
+        for transport in (self, self.other):
+            if not transport.disconnected:
+                transport.disconnected = True
+                transport.disconnecting = True
+                transport._pending = []
+                transport._pending_bytes = 0
+                if transport.producer is not None:
+                    transport.producer.stopProducing()
+                transport.protocol.connectionLost(Failure(connectionDone))
+                if transport.close_callback is not None:
+                    transport.close_callback()
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class MemoryConnector(object):
+    """
+    Connects a client factory to an in-process server.
+    """
+
+    def __init__(self, name, factory, clock):
+        self._name = name
+        self._factory = factory
+        self._clock = clock
+        self._transport = None
+
+    def connect(self):
+        """
+        Build the protocols of both ends and connect them.
+        """
+        self._factory.doStart()
+        server = _memory_servers.get(self._name)
+        port = next(_memory_ports)
+        server_address = MemoryAddress(self._name, 0)
+        client_address = MemoryAddress(self._name, port)
+        server_protocol = None if server is None else server[0].buildProtocol(client_address)
+        if server_protocol is None:
+            self._factory.clientConnectionFailed(self, Failure(ConnectionRefusedError("memory:%s" % self._name)))
+            self._factory.doStop()
+            return
+        client_protocol = self._factory.buildProtocol(server_address)
+        server_transport = MemoryTransport(server_address, client_address, self._clock)
+        client_transport = MemoryTransport(client_address, server_address, self._clock)
+        server_transport.other = client_transport
+        client_transport.other = server_transport
+        server_transport.protocol = server_protocol
+        client_transport.protocol = client_protocol
+        client_transport.close_callback = self._closed
+        self._transport = client_transport
+        server_protocol.makeConnection(server_transport)
+        client_protocol.makeConnection(client_transport)
+
+    def _closed(self):
+        self._transport = None
+        self._factory.clientConnectionLost(self, Failure(connectionDone))
+        self._factory.doStop()
+
+    def disconnect(self):
+        """
+        Close the connection.
+        """
+        if self._transport is not None:
+            self._transport.loseConnection()
+
+    def getDestination(self):
+        return MemoryAddress(self._name, 0)
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import fcntl
+import socket
+import logging
+import subprocess
+import collections
+from zope.interface import implementer
+from twisted.internet.interfaces import IFileDescriptorReceiver
+from twisted.internet.protocol import Factory
+from twisted.internet.protocol import connectionDone
+from twisted.protocols.basic import LineReceiver
+from twisted.internet import reactor
+from twisted.internet import defer
+
+
+# The commands that are sent between the server process and its workers.
+HAND_OVER = "HAND_OVER"  # server -> worker: seat the handed over clients at a new table, the fds are attached
+START_TABLE = "START_TABLE"  # server -> worker: all handed over clients are ready, start the game
+RETURN_CLIENTS = "RETURN_CLIENTS"  # worker -> server: the table is closed, take back the clients, fds are attached
+CLIENT_LEFT = "CLIENT_LEFT"  # worker -> server: a client of the worker disconnected
+RESUME_CLIENT = "RESUME_CLIENT"  # server -> worker: give the seat of a client to its new connection, the fd is attached
+WATCH_TABLE = "WATCH_TABLE"  # server -> worker: send a snapshot of the table and forward its public messages
+UNWATCH_TABLE = "UNWATCH_TABLE"  # server -> worker: stop forwarding the public messages of the table
+PUBLIC_MESSAGE = "PUBLIC_MESSAGE"  # worker -> server: a public message (or snapshot) of a watched table
+METRICS = "METRICS"  # worker -> server: the current values of the metrics of the worker
+GAME_RESULT = "GAME_RESULT"  # worker -> server: the result of a finished game for the statistics
+ADMIN = "ADMIN"  # both: a console command for a table of the worker and its reply
+RELEASE_FDS = "RELEASE_FDS"  # both: the receiver took the oldest n file descriptors, the sender may close them
+TAKE_OVER = "TAKE_OVER"  # new server -> old server: hand over the listening socket and the lobby
+SERVER_STATE = "SERVER_STATE"  # old server -> new server: ids, usernames and tables, the listening socket and the
+                               # sockets of the lobby clients are attached
+
+# During an upgrade, the old server process is a worker of the new one. This is the worker id of its channel.
+UPGRADE_CHANNEL = -1
+
+
+@implementer(IFileDescriptorReceiver)
+class WorkerChannel(LineReceiver):
+    """
+    Protocol for the UNIX socket between the server process and a worker process.
+    Each line has the format "command#json". Client sockets are passed as file descriptors (SCM_RIGHTS) together with
+    the HAND_OVER and RETURN_CLIENTS commands. The descriptors arrive no later than the line they belong to, so they are
+    kept in a queue until the line is handled. The sender keeps its copies open until the receiver releases them.
+    """
+
+    MAX_LENGTH = 1 << 20
+
+    def __init__(self, handler, worker_id):
+        self._handler = handler
+        self.worker_id = worker_id
+        self.num_tables = 0
+        self._fds = collections.deque()
+        self._sent_fds = collections.deque()
+
+    def connectionMade(self):
+        self._handler.channel_made(self)
+
+    def connectionLost(self, reason=connectionDone):
+        for fds in (self._fds, self._sent_fds):
+            while len(fds) > 0:
+                os.close(fds.popleft())
+        self._handler.channel_lost(self)
+
+    def fileDescriptorReceived(self, fd):
+        """
+        Store the received file descriptor until the according command arrives.
+        :param fd: the file descriptor
+        """
+        self._fds.append(fd)
+
+    def send_command(self, command, data, fds=()):
+        """
+        Send the command with the json encoded data and the given file descriptors.
+        :param command: the command
+        :param data: json serializable data
+        :param fds: the file descriptors
+        """
+        for fd in fds:
+            self.transport.sendFileDescriptor(fd)
+            self._sent_fds.append(fd)
+        self.sendLine("%s#%s" % (command, json.dumps(data)))
+
+    def pop_fds(self, n):
+        """
+        Return the next n received file descriptors and tell the sender that it can close its copies.
+        :param n: the number of file descriptors
+        :return: the file descriptors
+        """
+        if len(self._fds) < n:
+            raise ValueError("Expected %d file descriptors, but only %d were received." % (n, len(self._fds)))
+        self.sendLine("%s#%d" % (RELEASE_FDS, n))
+        return [self._fds.popleft() for _ in xrange(n)]
+
+    def lineReceived(self, line):
+        """
+        Split the line into command and data and pass it to the handler.
+        :param line: the received line
+        """
+        i = line.index("#")
+        command, data = line[:i], json.loads(line[i+1:])
+        if command == RELEASE_FDS:
+            for _ in xrange(data):
+                os.close(self._sent_fds.popleft())
+        else:
+            self._handler.channel_command(self, command, data)
+
+
+class _WorkerChannelFactory(Factory):
+    """
+    Creates the WorkerChannel for an adopted UNIX socket.
+    """
+
+    def __init__(self, handler, worker_id):
+        self._handler = handler
+        self._worker_id = worker_id
+
+    def buildProtocol(self, addr):
+        return WorkerChannel(self._handler, self._worker_id)
+
+
+def adopt_channel(fd, handler, worker_id=0):
+    """
+    Wrap the connected UNIX socket with the given file descriptor in a WorkerChannel. The descriptor is closed, the
+    reactor uses a duplicate.
+    :param fd: the file descriptor
+    :param handler: object with the methods channel_made, channel_lost and channel_command
+    :param worker_id: the id of the worker at the other end
+    :return: the channel
+    """
+    transport = reactor.adoptStreamConnection(fd, socket.AF_UNIX, _WorkerChannelFactory(handler, worker_id))
+    os.close(fd)
+    return transport.protocol
+
+
+def spawn_workers(num_workers, argv):
+    """
+    Start the worker processes. Each worker gets one end of a UNIX socket pair with the command line option
+    "--worker_fd".
+    :param num_workers: the number of workers
+    :param argv: the command line of the worker processes, without the --worker_fd option
+    :return: list with (process, file descriptor of the server end)
+    """
+    workers = []
+    for _ in xrange(num_workers):
+        server_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_end.setblocking(False)
+        worker_end.setblocking(False)
+
+        # Keep the server ends out of the other workers.
+        fd = os.dup(server_end.fileno())
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        server_end.close()
+
+        process = subprocess.Popen([sys.executable] + argv + ["--worker_fd", str(worker_end.fileno())])
+        worker_end.close()
+        workers.append((process, fd))
+        logging.info("Started worker process %d.", process.pid)
+    return workers
+
+
+def connect_upgrade_socket(path):
+    """
+    Connect to the upgrade socket of a running server.
+    :param path: the path of the UNIX socket
+    :return: the file descriptor of the connected socket or None if no server listens on the path
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    sock.setblocking(False)
+    fd = os.dup(sock.fileno())
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    sock.close()
+    return fd
+
+
+def listen_upgrade_socket(path, handler):
+    """
+    Listen on the upgrade socket, so a new server process can take over. A stale socket file is removed.
+    :param path: the path of the UNIX socket
+    :param handler: object with the methods channel_made, channel_lost and channel_command
+    :return: the listening port
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    return reactor.listenUNIX(path, _WorkerChannelFactory(handler, UPGRADE_CHANNEL))
+
+
+def _keep_socket_open(transport):
+    """
+    Let Twisted close the socket of the transport or port without shutting the connection down first.
+    :param transport: the TCP transport or listening port
+    """
+    # _shouldShutdown is private to twisted.internet.tcp._SocketCloser, checked against Twisted 20.3.
+    assert hasattr(transport, "_shouldShutdown"), "This Twisted version always shuts the socket down."
+    transport._shouldShutdown = False
+
+
+def release_port(port):
+    """
+    Return a duplicate of the socket of the given listening port and stop listening on the port. The socket is not
+    shut down, so the process that receives the duplicate keeps accepting the connections of the backlog.
+    :param port: the listening TCP port
+    :return: the duplicated file descriptor and the deferred of stopListening
+    """
+    fd = os.dup(port.fileno())
+    _keep_socket_open(port)
+    return fd, defer.maybeDeferred(port.stopListening)
+
+
+def release_connection(transport):
+    """
+    Return a duplicate of the socket of the given TCP transport and close the transport once its buffered output was
+    sent. The socket is not shut down, so the connection survives in the process that receives the duplicate.
+    :param transport: the transport
+    :return: the duplicated file descriptor
+    """
+    fd = os.dup(transport.fileno())
+    _keep_socket_open(transport)
+    transport.loseConnection()
+    return fd
@@ -1,13 +1,76 @@
+import os
 import sys
 import argparse
 import logging
 import random
+import base64
+import socket
+import collections
+import functools
+import itertools
+import timeit
+import math
 import json
+import cProfile
+import pstats
+import StringIO
 from twisted.internet.protocol import Factory
 from twisted.internet.protocol import connectionDone
 from twisted.protocols.basic import LineReceiver
 from twisted.internet import reactor
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.internet.address import IPv4Address
+from twisted.web.server import Site
 import core.common as cmn
+import core.log as log
+import core.worker_pool as worker_pool
+import core.messages as messages
+import core.metrics as metrics
+import core.journal as journal
+import core.stats as stats
+import core.asyncio_backend as asyncio_backend
+import core.admin as admin
+import core.transports as transports
+import core.bots as bots
+import core.tournament as tournament
+from core.dispatch import MessageRegistry
+from core.output_batcher import OutputBatcher, LagMonitor
+from core.client_index import IdAllocator, UsernameIndex
+from core.timing_wheel import TimingWheel
+from core.reaper import IdleReaper
+from core.matchmaking import MatchmakingQueue
+from core.chat import ChatChannel, TokenBucket
+
+
+# The encoders for the messages to the clients.
+TEXT_CODEC = messages.TextCodec(messages.SERVER_MESSAGES)
+BINARY_CODEC = messages.BinaryCodec(messages.SERVER_MESSAGES)
+
+# The handlers of the client messages, they are registered in ClientConnection.
+HANDLERS = MessageRegistry("server", messages.CLIENT_MESSAGES)
+
+
+# The metrics. Workers report their values to the server process, which adds them up.
+CONNECTION_STATES = {cmn.PENDING: "PENDING", cmn.WAIT_FOR_NAME: "WAIT_FOR_NAME", cmn.ACCEPTED: "ACCEPTED"}
+MOVE_STATES = {cmn.WAIT_FOR_SAY_TRUMP: "WAIT_FOR_SAY_TRUMP", cmn.WAIT_FOR_SAY_TRICKS: "WAIT_FOR_SAY_TRICKS",
+               cmn.WAIT_FOR_SAY_CARD: "WAIT_FOR_SAY_CARD"}
+CONNECTIONS = metrics.REGISTRY.gauge("wizard_connections", "Open client connections by state.",
+                                     "state", CONNECTION_STATES.values())
+MESSAGES = metrics.REGISTRY.counter("wizard_messages_received_total", "Received client messages by message id.",
+                                    "msg_id", messages.CLIENT_MESSAGES.keys())
+ERRORS = metrics.REGISTRY.counter("wizard_errors_sent_total", "Error messages sent to the clients by error code.",
+                                  "code", [i for i in messages.SERVER_MESSAGES if 400 <= i < 500])
+MESSAGE_SECONDS = metrics.REGISTRY.histogram("wizard_message_seconds",
+                                             "Server-side processing time of the client messages by message id.",
+                                             [0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                                              0.1], "msg_id", messages.CLIENT_MESSAGES.keys())
+THINK_SECONDS = metrics.REGISTRY.histogram("wizard_think_seconds", "Time the players take for a move by game state.",
+                                           [0.5, 1, 2, 5, 10, 20, 30, 60, 120], "state", MOVE_STATES.values())
+SENT_BYTES = metrics.REGISTRY.counter("wizard_sent_bytes_total", "Bytes sent to the clients.")
+MATCHMAKING_SECONDS = metrics.REGISTRY.histogram("wizard_matchmaking_wait_seconds",
+                                                 "Time the players wait in the matchmaking queue for a table.",
+                                                 [1, 5, 10, 30, 60, 120, 300, 600])
 
 
 class ClientConnection(LineReceiver):
@@ -15,21 +78,69 @@ class ClientConnection(LineReceiver):
     Protocol:
     - Initial handshake:
       Server sends client id (random integer n in [0, 99999]), client responds with handshake function.
-      Server sends WAIT_FOR_NAME, client responds with the username (must be alpha numeric).
-      Once the username is valid, the client is accepted.
-    - After being accepted, all messages have the format "msgid#msg".
+      The client may append "#B" to the handshake answer to ask for the binary protocol.
+      Server sends WAIT_FOR_NAME (followed by "#B" if the binary protocol was accepted), client responds with the
+      username (must be alpha numeric).
+      Once the username is valid, the client is accepted and gets a resume token.
+      A client that lost its connection may send "username#token" instead of the username. It then gets its old
+      session back: the seat at its table and a snapshot of the running game.
+    - After being accepted, all messages have the format "msgid#msg". If the binary protocol was negotiated, all
+      messages after the accept message are binary frames instead (see core/messages.py).
+    - Accepted clients are in the lobby. They can list, create and join tables. Once a table is full, its game
+      starts. When the game is over, the players return to the lobby.
+    - The hand is sent with CARDS once per round. ASK_CARD only carries the version of the hand (the number of cards
+      played in the round), its checksum (see cmn.hand_checksum) and the cards that the player may play. A client whose
+      copy differs asks for the full hand with RESYNC_HAND and gets it with HAND.
+    - CHAT goes to the table of the client or, in the lobby, to all clients in the lobby. The messages are sent in
+      batches with CHAT_MESSAGES, a new member of the channel first gets the last messages. Clients that chat faster
+      than the rate limit get CHAT_RATE_LIMITED.
+    - Instead of choosing a table, a client in the lobby can enqueue for a table size, optionally with a skill band
+      ("size#band"). The server forms the table once enough players with the same size and band wait, and sends the
+      number of waiting players and the expected wait in seconds (-1 if unknown) with QUEUED. LEAVE_TABLE leaves the
+      queue.
+    - Instead of joining a table, a client in the lobby can watch it. Spectators get the public messages of the game
+      (the player order, the trump, the said tricks, the played cards, the trick winners and the points) and a
+      snapshot without cards if the game is already running. LEAVE_TABLE stops watching.
+    - With worker processes, the connection is handed over to a worker while the client plays at a table. The worker
+      adopts the already accepted connection without a handshake.
+    - During an upgrade, the new server process adopts the connections of the lobby in whatever state they are, also
+      in the middle of the handshake.
+    - The clients connect over TCP, a UNIX socket or the in-process memory transport (see core/transports.py).
+      In-process connections have no socket, so their tables run in the server process and they are closed on upgrades.
     """
 
-    def __init__(self, factory, host, port):
+    def __init__(self, factory, host, port, session=None, family="tcp"):
         assert isinstance(factory, ClientConnector)
         assert isinstance(host, str)
         assert isinstance(port, int)
         self._factory = factory
         self._host = host
         self._port = port
-        self._id = factory.rand_ids.pop()
-        self._state = cmn.PENDING
-        self.username = "Unknown%d" % self._id
+        self.family = family  # the transport: "tcp", "unix" or "memory", bots (see core/bots.py) have "bot"
+        self._hostname = "%s:%d" % (host, port)
+        self._adopted = session is not None  # True if the connection was handed over by another process
+        if session is None:
+            self._id = factory.client_ids.allocate()
+            self._state = cmn.PENDING
+            self.username = "Unknown%d" % self._id
+        else:
+            self._id = session["id"]
+            self._state = session["state"]
+            self.username = str(session["username"])
+        self.table = None
+        self.watching = None  # the table that the client watches as spectator
+        self.handed_over = False
+        self.replaced = False  # True if the session was resumed by another connection
+        self._codec = TEXT_CODEC
+        self._binary_requested = session is not None and session["binary_requested"]
+        self._frame_buffer = ""
+        self._lag_monitor = None
+        self._chat_bucket = TokenBucket(factory.chat_rate, factory.chat_burst, factory.clock)
+        self.connected_at = None
+        self.num_received = 0  # received messages, for the admin console
+        self.num_sent = 0  # sent messages, for the admin console
+        if session is not None and session["binary"]:
+            self._use_binary_protocol()
 
     @property
     def hostname(self):
@@ -37,7 +148,45 @@ class ClientConnection(LineReceiver):
         Return the hostname in the format ip:port.
         :return: the hostname
         """
-        return "%s:%d" % (self._host, self._port)
+        return self._hostname
+
+    @property
+    def client_id(self):
+        """
+        Return the client id.
+        :return: the client id
+        """
+        return self._id
+
+    @property
+    def table_id(self):
+        """
+        Return the id of the table the client sits at.
+        :return: the table id or None if the client does not sit at a table
+        """
+        if self.table is None:
+            return None
+        return self.table.table_id
+
+    @property
+    def state_name(self):
+        """
+        Return the name of the connection state.
+        :return: the name
+        """
+        return CONNECTION_STATES[self._state]
+
+    @property
+    def session(self):
+        """
+        Return the data that is needed to adopt the accepted connection in another process.
+        :return: dict with client id, username, handshake state and the received but unhandled data
+        """
+        return {"id": self._id, "username": self.username, "state": self._state, "binary": self._codec.binary,
+                "binary_requested": self._binary_requested, "table_id": self.table_id,
+                "watching": None if self.watching is None else self.watching.table_id,
+                "queue": self._factory.matchmaking.key(self._id), "family": self.family,
+                "buffer": base64.b64encode(self._buffer + self._frame_buffer)}
 
     @property
     def clients(self):
@@ -50,44 +199,129 @@ class ClientConnection(LineReceiver):
     @property
     def game(self):
         """
-        Return the game.
-        :return: the game
+        Return the game of the table the client sits at.
+        :return: the game or None if the client does not sit at a table
         """
-        return self._factory.game
+        if self.table is None:
+            return None
+        return self.table.game
 
     def send(self, line):
         """
-        Convert line to a string and send it.
+        Convert line to a string and send it. This is only used during the handshake, afterwards use send_message.
         :param line: something to be sent
         """
         line = str(line)
-        logging.debug("Send '%s' to %s" % (line, self.hostname))
+        log.debug("Send", line=line, client=self._hostname)
+        SENT_BYTES.child.inc(len(line) + len(self.delimiter))
         self.sendLine(line)
 
-    def send_all(self, line):
+    def send_message(self, msg_id, *fields):
         """
-        Convert line to a string and send it to all clients.
-        :param line: something to be sent
+        Encode the message with the protocol of the client and send it.
+        :param msg_id: the message id
+        :param fields: the message fields
         """
-        for client_id in self.clients:
-            client = self.clients[client_id]
-            client.send(line)
+        if log.debug_enabled():
+            log.debug("Send message", msg_id=msg_id, fields=fields, client=self._hostname, table_id=self.table_id)
+        if 400 <= msg_id < 500:
+            ERRORS[msg_id].inc()
+        self._factory.output.write(self, self._codec.encode(msg_id, fields))
 
-    def send_all_others(self, line):
+    def write_sequence(self, chunks):
         """
-        Convert line to a string and send it to all clients except the current.
-        :param line: something to be sent
+        Write the encoded messages to the transport. Called by the output batcher.
+        :param chunks: list with the encoded messages
+        """
+        self.transport.writeSequence(chunks)
+        num_bytes = 0
+        for chunk in chunks:
+            num_bytes += len(chunk)
+        SENT_BYTES.child.inc(num_bytes)
+        self.num_sent += len(chunks)
+        if self._lag_monitor.lagging:
+            self._lag_monitor.written(num_bytes)
+
+    @property
+    def lagging(self):
+        """
+        Return whether the send buffer of the client is above the high-water mark.
+        :return: True if the client is lagging
+        """
+        return self._lag_monitor.lagging
+
+    def _caught_up(self):
+        """
+        Send a fresh snapshot to a spectator that skipped messages while it was lagging.
+        """
+        if self.watching is not None:
+            self.watching.catch_up(self)
+
+    def release(self):
+        """
+        Write the pending output and stop the flow control, so the connection can be closed or handed over.
+        """
+        self._factory.output.flush_connection(self)
+        self._lag_monitor.detach()
+        self._factory.reaper.untrack(self)
+
+    def _drop_slow_consumer(self):
         """
-        for client_id in self.clients:
-            if client_id != self._id:
-                client = self.clients[client_id]
-                client.send(line)
+        Disconnect the client because it does not read its messages fast enough. The buffered output is discarded.
+        """
+        if self.handed_over:
+            return
+        logging.warning("Disconnecting %s (%s), the client does not keep up with its messages.",
+                        self.username, self.hostname)
+        self._factory.output.discard(self)
+        self.transport.abortConnection()
+
+    @property
+    def codec(self):
+        """
+        Return the codec that encodes the messages for this client.
+        :return: the codec
+        """
+        return self._codec
+
+    def send_all(self, msg_id, *fields):
+        """
+        Send the message to all clients at the current table.
+        If the client does not sit at a table, the message is only sent to the client itself.
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        if self.table is None:
+            self.send_message(msg_id, *fields)
+        else:
+            self.table.send_all(msg_id, *fields)
+
+    def _use_binary_protocol(self):
+        """
+        Encode and decode all further messages with the binary protocol.
+        """
+        self._codec = BINARY_CODEC
+        self.setRawMode()
 
     def connectionMade(self):
         """
         Do the initial handshake (send the client id).
         """
-        logging.info("New connection: %s" % self.hostname)
+        self._lag_monitor = LagMonitor(self.transport, self._factory.high_water, self._factory.lag_grace_period,
+                                       self._drop_slow_consumer, self._caught_up, self._factory.clock.callLater,
+                                       self._hostname)
+        self.connected_at = self._factory.clock.seconds()
+        # The moves are small messages that wait for an answer, Nagle's algorithm would hold them back for the ACK.
+        if self.family == "tcp":
+            self.transport.setTcpNoDelay(True)
+        CONNECTIONS[CONNECTION_STATES[self._state]].inc()
+        self._factory.reaper.track(self, self._state)
+        if self._state != cmn.ACCEPTED:
+            self._factory.handshakes.add(self)
+        if self._adopted:
+            logging.info("Adopted connection of %s: %s", self.username, self.hostname)
+            return
+        logging.info("New connection: %s", self.hostname)
         self.send(self._id)
 
     def connectionLost(self, reason=connectionDone):
@@ -95,10 +329,47 @@ class ClientConnection(LineReceiver):
         Remove the client from the client list.
         :param reason:
         """
-        logging.info("Lost connection: %s" % self.hostname)
-        if self._id in self.clients:
-            del self.clients[self._id]
-            self.send_all_others("%d#%s" % (cmn.USER_LEFT, self.username))
+        CONNECTIONS[CONNECTION_STATES[self._state]].dec()
+        self._factory.handshakes.discard(self)
+        if self.handed_over:
+            log.debug("Handed over connection", username=self.username, client=self._hostname)
+            self._factory.handed_over(self)
+            return
+        if self.replaced:
+            logging.info("Closed the replaced connection of %s: %s", self.username, self.hostname)
+            return
+        logging.info("Lost connection: %s", self.hostname)
+        self._factory.reaper.untrack(self)
+        self._factory.matchmaking.remove(self._id)
+        if self.watching is not None:
+            self._factory.unwatch_table(self)
+        if self.table is not None:
+            # Keep the seat of a running game, so the client can resume its session.
+            if self.table.started and self._factory.suspend_client(self):
+                return
+            self._factory.leave_table(self)
+        self._factory.remove_client(self)
+
+    def dataReceived(self, data):
+        """
+        Record the activity of the client and pass the data to the line or frame parser.
+        :param data: the received data
+        """
+        self._factory.reaper.touch(self)
+        LineReceiver.dataReceived(self, data)
+
+    def reap(self, state):
+        """
+        Close the connection because the client was idle for too long.
+        :param state: the state in which the client was idle
+        """
+        if state == cmn.ACCEPTED:
+            logging.info("Closing the connection of %s (%s), the client was idle for too long.",
+                         self.username, self.hostname)
+        else:
+            logging.info("Closing the connection to %s, the client did not finish the handshake.", self.hostname)
+        self._factory.output.discard(self)
+        self.transport.abortConnection()
 
     def lineReceived(self, line):
         """
@@ -108,168 +379,562 @@ class ClientConnection(LineReceiver):
         # Remove unwanted characters from the input.
         assert isinstance(line, str)
         line = line.translate(cmn.CHAR_TRANS_TABLE)
-        logging.debug("Received '%s' from %s" % (line, self.hostname))
-
-        if self._state != cmn.ACCEPTED:
-            # Check if the server is full.
-            if len(self.clients) == self.game.num_players:
-                logging.info("Refused connection from %s because the server is full." % self.hostname)
-                self.send("Sorry, the server is full.")
-                self.stopProducing()
-                return
+        if log.debug_enabled():
+            log.debug("Received", line=line, client=self._hostname, table_id=self.table_id)
 
         if self._state == cmn.PENDING:
-            # Check if the handshake number is correct.
+            # Check if the handshake number is correct. The client may ask for the binary protocol.
             non_wizard = False
+            value, _, options = line.partition("#")
             try:
-                line = int(line)
+                value = int(value)
             except ValueError:
                 non_wizard = True
-            if not non_wizard and line == cmn.handshake_fun(self._id):
-                self._state = cmn.WAIT_FOR_NAME
-                self.send(self._state)
+            if not non_wizard and value == cmn.handshake_fun(self._id):
+                self._set_state(cmn.WAIT_FOR_NAME)
+                if options == cmn.BINARY_PROTOCOL:
+                    self._binary_requested = True
+                    self.send("%d#%s" % (self._state, cmn.BINARY_PROTOCOL))
+                else:
+                    self.send(self._state)
             else:
-                logging.warning("Non-wizard connection from %s" % self.hostname)
+                logging.warning("Non-wizard connection from %s", self.hostname)
                 self.send("Your are not a wizard cardgame client.")
                 self.stopProducing()
 
         elif self._state == cmn.WAIT_FOR_NAME:
             # Check if the name is valid.
-            if not line.isalnum():
-                logging.info("Refused username '%s' from %s" % (line, self.hostname))
+            username, _, token = line.partition("#")
+            if not username.isalnum():
+                logging.info("Refused username '%s' from %s", username, self.hostname)
                 self.send(cmn.FORBIDDEN_USERNAME)
                 return
 
-            # Check if the name is already taken.
-            for client_id in self.clients:
-                client = self.clients[client_id]
-                if client.username.lower() == line.lower():
-                    logging.info("Refused already taken username '%s' from %s" % (line, self.hostname))
-                    self.send(cmn.TAKEN_USERNAME)
-                    return
+            # Resume the session of a client that lost its connection.
+            if len(token) > 0:
+                if not self._factory.resume_session(self, username, token):
+                    logging.info("Refused invalid resume token of '%s' from %s", username, self.hostname)
+                    self.send(cmn.INVALID_SESSION)
+                return
+
+            # Check if the name is already taken (also by the clients that play in a worker process).
+            if not self._factory.usernames.add(username, self._id):
+                logging.info("Refused already taken username '%s' from %s", username, self.hostname)
+                self.send(cmn.TAKEN_USERNAME)
+                return
 
             # Accept the user.
-            self._accept_user(line)
+            self._accept_user(username)
+            self._factory.issue_resume_token(self)
+            self._factory.seat_tournament_player(self)
 
         elif self._state == cmn.ACCEPTED:
             # Handle the message.
             self._handle_message(line)
 
         else:
-            logging.warning("Unknown state: %d" % self._state)
+            logging.warning("Unknown state: %d", self._state)
 
     def _accept_user(self, username):
         """
-        Accept the current client and start the game if there are enough players.
+        Accept the current client and put it into the lobby.
         :param username: the username
         """
-        # Accept the player.
         self.username = username
-        self._state = cmn.ACCEPTED
+        self._set_state(cmn.ACCEPTED)
+        self._factory.handshakes.discard(self)
         self.clients[self._id] = self
-        logging.info("%s chooses username '%s'" % (self.hostname, self.username))
-        self.send_all("%d#%s" % (cmn.NEW_USER, self.username))
+        logging.info("%s chooses username '%s'", self.hostname, self.username)
+        self.send_message(cmn.NEW_USER, self.username)
+
+        # The accept message is the last text message if the binary protocol was negotiated.
+        if self._binary_requested:
+            self._use_binary_protocol()
+        self._factory.lobby_chat.send_history(self)
 
-        if len(self.clients) == self.game.num_players:
-            self._start_game()
+    def _set_state(self, state):
+        """
+        Change the state of the connection.
+        :param state: the new state
+        """
+        CONNECTIONS[CONNECTION_STATES[self._state]].dec()
+        CONNECTIONS[CONNECTION_STATES[state]].inc()
+        self._state = state
+        self._factory.reaper.track(self, state)
 
-    def _start_game(self):
+    def resume_session(self, client_id, username):
         """
-        Start the game.
+        Accept the client with the id and the username of the session that it resumes.
+        :param client_id: the client id of the session
+        :param username: the username of the session
         """
-        logging.info("Starting the game.")
-        self.game.start(self.clients)
+        self._factory.client_ids.free(self._id)
+        self._id = client_id
+        logging.info("%s resumes the session of '%s'", self.hostname, username)
+        self._accept_user(username)
 
     def _handle_message(self, line):
         """
-        Split the given line into message id and message and give them to _handle_valid_message.
+        Split the given line into message id and message fields and give them to _process_message.
         :param line: the line
         """
-        if "#" not in line:
-            logging.warning("%s sent invalid message '%s'" % (self.username, line))
-            self.send("%d#%s" % (cmn.UNKNOWN_MESSAGE, line))
-        else:
-            i = line.index("#")
-            msg_id, msg = line[:i], line[i+1:]
+        try:
+            msg_id, fields = HANDLERS.decode_text(line)
+        except messages.InvalidMessageException:
+            logging.warning("%s sent invalid message '%s'", self.username, line)
+            self.send_message(cmn.UNKNOWN_MESSAGE, line)
+            return
+        self._process_message(msg_id, fields)
+
+    def rawDataReceived(self, data):
+        """
+        Decode the binary frames and handle the messages.
+        :param data: the received data
+        """
+        data = self._frame_buffer + data
+        offset = 0
+        # After a hand over, the remaining frames are handled by the process that adopts the connection.
+        while not self.handed_over:
             try:
-                msg_id = int(msg_id)
-            except ValueError:
-                logging.warning("%s used non-integer message id in message '%s'" % (self.username, line))
-                self.send("%d#%s" % (cmn.UNKNOWN_MESSAGE, line))
+                msg = HANDLERS.decode_frame(data, offset)
+            except messages.InvalidMessageException:
+                # There is no way to find the next frame, so the connection is closed.
+                logging.warning("%s sent an invalid binary frame.", self.username)
+                self.send_message(cmn.UNKNOWN_MESSAGE, "")
+                self.release()
+                self.transport.loseConnection()
                 return
-            self._handle_valid_message(msg_id, msg)
-
-    def _handle_valid_message(self, msg_id, msg):
+            if msg is None:
+                break
+            msg_id, fields, offset = msg
+            if log.debug_enabled():
+                log.debug("Received message", msg_id=msg_id, fields=fields, client=self._hostname,
+                          table_id=self.table_id)
+            self._process_message(msg_id, fields)
+        self._frame_buffer = data[offset:]
+
+    def _process_message(self, msg_id, fields):
         """
-        Handle the message.
+        Pass the message to its handler and record the processing time. If the table of the client is profiled, the
+        handler runs in the profiler.
         :param msg_id: the message id
-        :param msg: the message
+        :param fields: the decoded message fields
+        """
+        start = timeit.default_timer()
+        self.num_received += 1
+        if self.table is None or self.table.profiler is None:
+            handled = HANDLERS.dispatch(self, msg_id, fields)
+        else:
+            handled = self.table.profiler.runcall(HANDLERS.dispatch, self, msg_id, fields)
+        if not handled:
+            logging.warning("Unhandled msg id '%d' with fields %s from %s", msg_id, fields, self.hostname)
+        MESSAGES[msg_id].inc()
+        MESSAGE_SECONDS[msg_id].observe(timeit.default_timer() - start)
+
+    @HANDLERS.handles(cmn.CHAT)
+    def _chat(self, msg_id, fields):
+        """
+        Post the chat message to the channel of the table or, if the client does not sit at a table, of the lobby. A
+        client that exceeds its rate limit gets the milliseconds until it may chat again.
         """
-        if msg_id == cmn.CHAT:
-            # Attach the username and send the message to the other players. Since the username is alpha numeric, it
-            # cannot contain "#", so we can use that to separate the username from the message.
-            self.send_all("%d#%s#%s" % (cmn.CHAT, self.username, msg))
+        if not self._chat_bucket.consume():
+            self.send_message(cmn.CHAT_RATE_LIMITED, int(math.ceil(self._chat_bucket.wait_time() * 1000)))
             return
+        channel = self._factory.lobby_chat if self.table is None else self.table.chat
+        channel.post(self.username, fields[0][:cmn.MAX_CHAT_LENGTH])
 
-        if msg_id in [cmn.SAY_TRUMP, cmn.SAY_TRICKS, cmn.SAY_CARD]:
-            # Make sure that the game started and it is the client's turn.
-            if not self.game.started:
-                logging.warning("%s tried to play, but the game did not start." % self.username)
-                self.send("%d#>noone<" % cmn.NOT_YOUR_TURN)
-                return
-            elif self.game.current_client != self:
-                logging.warning("%s tried to play, but it is not his turn." % self.username)
-                self.send("%d#%s" % (cmn.NOT_YOUR_TURN, self.game.current_player_username))
-                return
+    @HANDLERS.handles(cmn.LIST_TABLES)
+    def _list_tables(self, msg_id, fields):
+        """
+        Send the table list.
+        """
+        self.send_message(cmn.TABLE_LIST, self._factory.table_list())
+
+    @HANDLERS.handles(cmn.LEAVE_TABLE)
+    def _leave_table(self, msg_id, fields):
+        """
+        Leave the table that did not start yet, stop watching a table or leave the matchmaking queue.
+        """
+        if self._id in self._factory.matchmaking:
+            self._factory.leave_queue(self)
+        elif self.watching is not None:
+            self._factory.unwatch_table(self)
+            self._factory.reaper.track(self, self._state)
+        elif self.table is None:
+            self.send_message(cmn.NOT_AT_TABLE, msg_id)
+        elif self.game.started:
+            logging.warning("%s tried to leave a running game.", self.username)
+            self.send_message(cmn.INVALID_MOVE, msg_id)
+        else:
+            self._factory.leave_table(self)
 
-        if msg_id == cmn.SAY_TRUMP and self.game.state != cmn.WAIT_FOR_SAY_TRUMP \
-                or msg_id == cmn.SAY_TRICKS and self.game.state != cmn.WAIT_FOR_SAY_TRICKS \
-                or msg_id == cmn.SAY_CARD and self.game.state != cmn.WAIT_FOR_SAY_CARD:
-            logging.warning("%s tried to make a move that is not possible right now." % self.username)
-            self.send("%d#%d" % (cmn.INVALID_MOVE, msg_id))
+    def _check_move(self, msg_id, state):
+        """
+        Check that the game started, that it is the client's turn and that the game waits for this kind of move. If
+        not, the according error is sent.
+        :param msg_id: the message id of the move
+        :param state: the game state in which the move is possible
+        :return: True if the move is possible
+        """
+        if self.game is None or not self.game.started:
+            logging.warning("%s tried to play, but the game did not start.", self.username)
+            self.send_message(cmn.NOT_YOUR_TURN, ">noone<")
+            return False
+        if self.game.current_client != self:
+            logging.warning("%s tried to play, but it is not his turn.", self.username)
+            self.send_message(cmn.NOT_YOUR_TURN, self.game.current_player_username)
+            return False
+        if self.game.state != state:
+            logging.warning("%s tried to make a move that is not possible right now.", self.username)
+            self.send_message(cmn.INVALID_MOVE, msg_id)
+            return False
+        return True
+
+    @HANDLERS.handles(cmn.SAY_TRUMP)
+    def _say_trump(self, msg_id, fields):
+        """
+        Check the trump and pass it to the game.
+        """
+        if not self._check_move(msg_id, cmn.WAIT_FOR_SAY_TRUMP):
             return
+        trump = fields[0]
+        if self.game.trump != "W" or trump not in ["C", "S", "H", "D"]:
+            logging.warning("%s tried to say the invalid trump '%s'.", self.username, trump)
+            self.send_message(cmn.INVALID_TRUMP, trump)
+            return
+        self.game.say_trump(trump)
 
-        if msg_id == cmn.SAY_TRUMP:
-            # Parse the trump.
-            if self.game.trump != "W" or msg not in ["C", "S", "H", "D"]:
-                logging.warning("%s tried to say the invalid trump '%s'." % (self.username, msg))
-                self.send("%d#%s" % (cmn.INVALID_TRUMP, msg))
-                return
-            self.game.say_trump(msg)
+    @HANDLERS.handles(cmn.SAY_TRICKS)
+    def _say_tricks(self, msg_id, fields):
+        """
+        Pass the number of tricks to the game. The number was already parsed by the decoder.
+        """
+        if self._check_move(msg_id, cmn.WAIT_FOR_SAY_TRICKS):
+            self.game.say_tricks(fields[0])
+
+    @HANDLERS.handles(cmn.SAY_CARD)
+    def _say_card(self, msg_id, fields):
+        """
+        Pass the card to the game, which checks it against the legal cards of the turn.
+        """
+        if self._check_move(msg_id, cmn.WAIT_FOR_SAY_CARD):
+            self.game.say_card(fields[0])
+
+    @HANDLERS.handles(cmn.RESYNC_HAND)
+    def _resync_hand(self, msg_id, fields):
+        """
+        Send the full hand, the copy of the client does not match the version or the checksum of ASK_CARD.
+        """
+        if self.table is None:
+            self.send_message(cmn.NOT_AT_TABLE, msg_id)
+        elif not self.game.started:
+            self.send_message(cmn.INVALID_MOVE, msg_id)
+        else:
+            logging.info("%s asked for the full hand.", self.username)
+            self.send_message(cmn.HAND, *self.game.hand(self._id))
+
+    def _check_in_lobby(self):
+        """
+        Check that the client neither sits at a table nor watches one, else send the ALREADY_AT_TABLE error. A client in
+        the matchmaking queue gets the ALREADY_QUEUED error.
+        :return: True if the client is in the lobby
+        """
+        table = self.table if self.table is not None else self.watching
+        if table is not None:
+            self.send_message(cmn.ALREADY_AT_TABLE, table.table_id)
+            return False
+        if self._id in self._factory.matchmaking:
+            self.send_message(cmn.ALREADY_QUEUED, self._factory.matchmaking.key(self._id)[0])
+            return False
+        return True
+
+    @HANDLERS.handles(cmn.CREATE_TABLE)
+    def _create_table(self, msg_id, fields):
+        """
+        Create a new table and join it. The message is the table size, optionally followed by "#" and the number of
+        rounds.
+        """
+        if not self._check_in_lobby():
+            return
+        msg = fields[0]
+        try:
+            values = [int(x) for x in msg.split("#")]
+        except ValueError:
+            logging.warning("%s sent invalid table parameters '%s'.", self.username, msg)
+            self.send_message(cmn.INVALID_TABLE_SIZE, msg)
+            return
+        num_players = values[0]
+        num_rounds = values[1] if len(values) > 1 else None
+        if not 0 < num_players <= cmn.MAX_NUM_PLAYERS or len(values) > 2 or num_rounds is not None and num_rounds <= 0:
+            logging.warning("%s tried to create a table with invalid parameters '%s'.", self.username, msg)
+            self.send_message(cmn.INVALID_TABLE_SIZE, msg)
+            return
+        table = self._factory.create_table(num_players, num_rounds)
+        self._factory.join_table(self, table)
+
+    @HANDLERS.handles(cmn.ENQUEUE)
+    def _enqueue(self, msg_id, fields):
+        """
+        Wait in the matchmaking queue. The message is the table size, optionally followed by "#" and the skill band.
+        """
+        if not self._check_in_lobby():
+            return
+        msg = fields[0]
+        try:
+            values = [int(x) for x in msg.split("#")]
+        except ValueError:
+            values = []
+        if not 0 < len(values) <= 2 or not 0 < values[0] <= cmn.MAX_NUM_PLAYERS or \
+                (len(values) == 2 and not 0 <= values[1] < cmn.NUM_SKILL_BANDS):
+            logging.warning("%s tried to enqueue with invalid parameters '%s'.", self.username, msg)
+            self.send_message(cmn.INVALID_TABLE_SIZE, msg)
+            return
+        self._factory.enqueue(self, values[0], values[1] if len(values) == 2 else None)
 
-        elif msg_id == cmn.SAY_TRICKS:
-            # Parse the number of tricks.
+    @HANDLERS.handles(cmn.JOIN_TABLE)
+    def _join_table(self, msg_id, fields):
+        """
+        Join the table with the given id. If the message is empty, join any open table with the default size.
+        """
+        if not self._check_in_lobby():
+            return
+        msg = fields[0]
+        if len(msg) == 0:
+            table = self._factory.find_open_table()
+        else:
             try:
-                num_tricks = int(msg)
+                table_id = int(msg)
             except ValueError:
-                logging.warning("%s used non-integer for number of tricks in message '%s'" % (self.username, msg))
-                self.send("%d#%s" % (cmn.UNKNOWN_MESSAGE, msg))
+                self.send_message(cmn.UNKNOWN_TABLE, msg)
                 return
-            self.game.say_tricks(num_tricks)
-
-        elif msg_id == cmn.SAY_CARD:
-            # Parse the played card.
-            if msg not in self.game.current_player_cards:
-                logging.warning("%s tried to play the card '%s' without having this card." % (self.username, msg))
-                self.send("%d#%s" % (cmn.INVALID_CARD, msg))
+            table = self._factory.tables.get(table_id)
+            if table is None:
+                self.send_message(cmn.UNKNOWN_TABLE, msg)
+                return
+            if table.is_full or (table.reserved is not None and self.username.lower() not in table.reserved):
+                self.send_message(cmn.TABLE_FULL, msg)
                 return
-            self.game.say_card(msg)
+        self._factory.join_table(self, table)
+
+    @HANDLERS.handles(cmn.WATCH_TABLE)
+    def _watch_table(self, msg_id, fields):
+        """
+        Watch the table with the given id as spectator.
+        """
+        if not self._check_in_lobby():
+            return
+        table_id = fields[0]
+        table = self._factory.tables.get(table_id)
+        if table is None:
+            self.send_message(cmn.UNKNOWN_TABLE, str(table_id))
+            return
+        self._factory.watch_table(self, table)
+
+    @HANDLERS.handles(cmn.GET_HISTORY)
+    def _get_history(self, msg_id, fields):
+        """
+        Send the recent games of the given user, of the client itself if the username is empty.
+        """
+        username = fields[0] if len(fields[0]) > 0 else self.username
+        self._factory.send_history(self, username)
 
+    @HANDLERS.handles(cmn.GET_TOP_PLAYERS)
+    def _get_top_players(self, msg_id, fields):
+        """
+        Send the players with the most points.
+        """
+        self._factory.send_top_players(self)
+
+
+class DetachedTransport(object):
+    """
+    Stands in for the lost connection of a player whose table was recovered from the journal. Everything that is
+    written is dropped, the player gets a snapshot when it resumes its session with a new connection.
+    """
+
+    disconnecting = True
+
+    def __init__(self):
+        self.producer = None
+        self.bufferSize = 0
+
+    def getPeer(self):
+        return IPv4Address("TCP", "0.0.0.0", 0)
+
+    def setTcpNoDelay(self, enabled):
+        pass
+
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+    def loseConnection(self):
+        pass
+
+    def abortConnection(self):
+        pass
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class Table(object):
+    """
+    A table in the lobby that holds the seated clients, the spectators and their game. The seated clients share the
+    chat channel of the table.
+    """
+
+    def __init__(self, table_id, game, output, call_later=reactor.callLater):
+        assert isinstance(game, WizardGame)
+        assert isinstance(output, OutputBatcher)
+        self.table_id = table_id
+        self.game = game
+        self._output = output
+        self.clients = {}
+        self.chat = ChatChannel(lambda: self.clients.values(), output, call_later=call_later, name=table_id)
+        self.worker = None  # the worker channel, if the game runs in a worker process
+        self.remote_ids = []  # the ids of the clients that were handed over to the worker
+        self.spectators = {}  # client id => client, the spectators are always in the server process
+        self.watched = False  # in a worker: whether the server process wants the public messages of the game
+        self._stale = set()  # the spectators that skipped messages and wait for a snapshot
+        self._snapshot_requested = False
+        self.profiler = None  # profiles the message handling of the table, started from the admin console
+        self.bot_fill_timer = None  # gives the empty seats to bots if no more players come
+        self.tournament_key = None  # the index of the table in the current tournament round
+        self.reserved = None  # the lowercase usernames of the players who may join, None if anyone may join
+
+    @property
+    def num_seated(self):
+        """
+        Return the number of seated clients.
+        :return: the number of seated clients
+        """
+        return len(self.clients) + len(self.remote_ids)
+
+    @property
+    def is_full(self):
+        """
+        Return whether all seats are taken.
+        :return: True if the table is full else False
+        """
+        return self.num_seated >= self.game.num_players
+
+    @property
+    def started(self):
+        """
+        Return whether the game of the table has started.
+        :return: True if the game has started else False
+        """
+        return self.worker is not None or self.game.started
+
+    def send_all(self, msg_id, *fields):
+        """
+        Send the message to all clients at the table.
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        self._output.broadcast(self.clients.values(), msg_id, fields, self.table_id)
+
+    def send_public(self, msg_id, fields):
+        """
+        Send the public message of the game to the spectators. The message is encoded only once per codec, no matter
+        how many spectators there are. Lagging spectators skip the messages instead of buffering them and get a
+        snapshot once they caught up. A snapshot is only sent to the spectators that wait for one.
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        if len(self.spectators) == 0:
+            return
+        if msg_id == cmn.SNAPSHOT:
+            self._snapshot_requested = False
+            receivers = [client for client in self._stale if not client.lagging]
+            self._stale.difference_update(receivers)
         else:
-            logging.warning("Unhandled msg id '%d' with msg '%s' from %s" % (msg_id, msg, self.hostname))
+            if msg_id == cmn.START_GAME:
+                # Nothing happened before the start, so there is nothing to catch up.
+                self._stale.clear()
+                self._snapshot_requested = False
+            receivers = []
+            for client in self.spectators.itervalues():
+                if client in self._stale:
+                    continue
+                if client.lagging:
+                    self._stale.add(client)
+                else:
+                    receivers.append(client)
+        if len(receivers) > 0:
+            self._output.broadcast(receivers, msg_id, fields, self.table_id)
+
+    def add_spectator(self, client):
+        """
+        Add the spectator. If the game is running, the spectator gets a snapshot.
+        :param client: the client
+        """
+        self.spectators[client.client_id] = client
+        if self.started:
+            self._stale.add(client)
+            self.catch_up(client)
+
+    def remove_spectator(self, client):
+        """
+        Remove the spectator.
+        :param client: the client
+        """
+        del self.spectators[client.client_id]
+        self._stale.discard(client)
+        if self.worker is not None and len(self.spectators) == 0:
+            self._snapshot_requested = False
+            self.worker.send_command(worker_pool.UNWATCH_TABLE, self.table_id)
+
+    def remove_spectators(self):
+        """
+        Tell all spectators that the table is closed and remove them.
+        :return: the removed spectators
+        """
+        spectators = self.spectators.values()
+        self._output.broadcast(spectators, cmn.TABLE_CLOSED, (self.table_id,), self.table_id)
+        for client in spectators:
+            client.watching = None
+        self.spectators = {}
+        self._stale.clear()
+        return spectators
+
+    def catch_up(self, client):
+        """
+        Send a snapshot to the spectator if it skipped messages. If the game runs in a worker, the snapshot is requested
+        from the worker.
+        :param client: the spectator
+        """
+        if client not in self._stale:
+            return
+        if self.worker is None:
+            self._stale.discard(client)
+            client.send_message(cmn.SNAPSHOT, self.game.snapshot())
+        elif not self._snapshot_requested:
+            self._snapshot_requested = True
+            self.worker.send_command(worker_pool.WATCH_TABLE, self.table_id)
 
 
 class WizardGame(object):
     """
     Holds and manages the game states.
+    All changes of the game state go through the transitions (see TRANSITIONS), which are passed to the journal
+    callback before they are applied. Replaying the journaled transitions with apply rebuilds the game.
     """
 
-    def __init__(self, num_players, num_rounds=None):
+    def __init__(self, num_players, num_rounds=None, finished_callback=None, output=None, table_id=None,
+                 turn_clock=None, turn_time=None, public_callback=None, clock=reactor, journal_callback=None):
         self.num_players = num_players
         self._num_rounds = 60 / self.num_players  # integer division will floor this
         if num_rounds is not None:
             if num_rounds > self._num_rounds:
-                logging.warning("Tried to set number of rounds to %d, but the maximum is %d." % (num_rounds, self._num_rounds))
+                logging.warning("Tried to set number of rounds to %d, but the maximum is %d.",
+                                num_rounds, self._num_rounds)
             else:
                 self._num_rounds = num_rounds
         self._clients = None
@@ -280,10 +945,40 @@ class WizardGame(object):
         self._made_tricks = None
         self._player_cards = None
         self._trick_cards = None
+        self._suit_counts = None  # the number of cards of each suit in the hand of each seat
+        self._follow_suit = None  # the suit that must be followed in the current trick, None if there is none yet
+        self._legal_cards = None  # the cards that the current player may play, computed once per turn
         self.current_player = 0
         self.trump = None
         self._points = []
+        self._tricks = []  # the said and made tricks of each finished round
         self.state = None
+        self._finished_callback = finished_callback
+        self._output = output  # if given, broadcasts are encoded once and coalesced
+        self._table_id = table_id  # only used for logging
+        self._turn_clock = turn_clock  # timing wheel for the turn timeouts
+        self._turn_time = turn_time  # seconds per move, None means no limit
+        self._turn_timer = None
+        self._asked_at = None  # the time when the current player was asked for the move
+        self._public_callback = public_callback  # called with the messages that are sent to all players
+        self._clock = clock  # provider of seconds
+        self._journal_callback = journal_callback  # called with the kind and the data of each transition
+
+    @property
+    def num_rounds(self):
+        """
+        Return the number of rounds.
+        :return: the number of rounds
+        """
+        return self._num_rounds
+
+    @property
+    def round(self):
+        """
+        Return the number of the current round.
+        :return: the round, 0 before the first round
+        """
+        return self._round
 
     @staticmethod
     def _create_cards():
@@ -302,156 +997,499 @@ class WizardGame(object):
         """
         # Find a random player order.
         self._clients = clients
-        self._player_ids = self._clients.keys()
-        random.shuffle(self._player_ids)
-        logging.info("The seat order is %s." % ", ".join(self._clients[p].username for p in self._player_ids))
+        player_ids = self._clients.keys()
+        random.shuffle(player_ids)
+        self._transition("start", player_ids)
+        logging.info("The seat order is %s.", ", ".join(self._clients[p].username for p in self._player_ids))
 
         # Send the player order to all clients.
-        msg = json.dumps([self._clients[i].username for i in self._player_ids])
-        for client_id in clients:
-            client = clients[client_id]
-            client.send("%d#%s" % (cmn.START_GAME, msg))
+        self._send_all(cmn.START_GAME, [self._clients[i].username for i in self._player_ids])
 
         # Start the first round.
         self._next_round()
 
-    @property
-    def current_player_id(self):
+    def stop(self):
         """
-        Return the player id of the current player.
-        :return: the player id
+        Stop the turn clock of the game, e. g. because the table is closed.
         """
-        return self._player_ids[self.current_player]
+        if self._turn_timer is not None:
+            self._turn_timer.cancel()
+            self._turn_timer = None
 
-    @property
-    def current_client(self):
+    def dump(self):
         """
-        Return the client of the current player.
-        :return: the client
+        Return the complete state of the running game in a json serializable form, e. g. for the journal.
+        :return: dict with the game state
         """
-        return self._clients[self.current_player_id]
+        return {"player_ids": self._player_ids, "round": self._round, "current_player": self.current_player,
+                "said_tricks": self._said_tricks, "made_tricks": self._made_tricks, "cards": self._player_cards,
+                "trick": self._trick_cards, "trump": self.trump, "points": self._points, "tricks": self._tricks,
+                "state": self.state}
 
-    @property
-    def current_player_username(self):
+    def load(self, dumped, clients):
         """
-        Return the username of the current player.
-        :return: the username
+        Restore the state of the running game.
+        :param dumped: the return value of dump, with the client ids of the given clients
+        :param clients: the clients
         """
-        return self.current_client.username
-
-    @property
-    def current_player_cards(self):
+        self._clients = clients
+        self._player_ids = dumped["player_ids"]
+        self._round = dumped["round"]
+        self.current_player = dumped["current_player"]
+        self._said_tricks = dumped["said_tricks"]
+        self._made_tricks = dumped["made_tricks"]
+        self._player_cards = [[str(card) for card in cards] for cards in dumped["cards"]]
+        self._trick_cards = [str(card) for card in dumped["trick"]]
+        self._count_suits()
+        self.trump = None if dumped["trump"] is None else str(dumped["trump"])
+        self._points = dumped["points"]
+        self._tricks = dumped.get("tricks", [])  # not in the journals of older versions
+        self.state = dumped["state"]
+
+    def apply(self, kind, data):
         """
-        Return the cards of the current player.
-        :return: the cards
+        Apply the journaled transition without sending any messages.
+        :param kind: the kind of the transition
+        :param data: the transition data
         """
-        return self._player_cards[self.current_player]
+        self.TRANSITIONS[kind](self, data)
 
-    @property
-    def started(self):
+    def _transition(self, kind, data):
         """
-        Return whether the game has started or not.
-        :return: True if the game has started else False
+        Pass the transition to the journal callback and apply it.
+        :param kind: the kind of the transition
+        :param data: the transition data
         """
-        return self._round > 0
+        if self._journal_callback is not None:
+            self._journal_callback(kind, data)
+        self.TRANSITIONS[kind](self, data)
 
-    @property
-    def is_first_player(self):
+    def _apply_start(self, player_ids):
         """
-        Return True if the current player is the first player.
-        :return: whether the current player is the first player
+        Set the seat order.
+        :param player_ids: the client ids in seat order
         """
-        return self.current_player == self._round % self.num_players
+        self._player_ids = player_ids
 
-    @property
-    def is_last_player(self):
+    def _apply_replace(self, data):
         """
-        Return True if the current player is the last player.
-        :return: whether the current player is the last player
+        Give the seat to another client.
+        :param data: the seat and the client id
         """
-        return (self.current_player+1) % self.num_players == self._round % self.num_players
+        seat, client_id = data
+        # The list of the start transition may still wait for the journal, so it is not changed in place.
+        self._player_ids = list(self._player_ids)
+        self._player_ids[seat] = client_id
 
-    def _next_round(self):
+    def _apply_round(self, data):
         """
-        Increase the round number, get a new deck and shuffle it and send the cards to each player.
+        Start the next round with the dealt cards and the trump.
+        :param data: the cards of each seat and the trump
         """
+        cards, trump = data
         self._round += 1
         self.current_player = self._round % self.num_players
         self._said_tricks = [0] * self.num_players
         self._made_tricks = [0] * self.num_players
         self._trick_cards = []
-        logging.info("Playing round %d of %d." % (self._round, self._num_rounds))
-        logging.info("%s starts." % self.current_player_username)
-
-        # Shuffle the cards.
-        self._deck = self._create_cards()
-        random.shuffle(self._deck)
-
-        # Find the trump card.
-        r = random.randint(0, 59)
-        self.trump = self._deck[r][0]
-
-        # Send the cards to the players.
-        self._player_cards = [None] * self.num_players
-        for i, player_id in enumerate(self._player_ids):
-            client = self._clients[player_id]
-            self._player_cards[i], self._deck = self._deck[:self._round], self._deck[self._round:]
-            msg = json.dumps(self._player_cards[i])
-            client.send("%d#%s" % (cmn.CARDS, msg))
+        self._player_cards = [[str(card) for card in seat_cards] for seat_cards in cards]
+        self._count_suits()
+        self.trump = str(trump)
+        self.state = cmn.WAIT_FOR_SAY_TRUMP if self.trump == "W" else cmn.WAIT_FOR_SAY_TRICKS
 
-        # Send the trump to all players.
-        logging.info("The trump suit is %s." % cmn.COLOR_NAMES[self.trump])
-        self.current_client.send_all("%d#%s" % (cmn.FOUND_TRUMP, self.trump))
-
-        if self.trump == "W":
-            # Ask the first player for the trump.
-            self.state = cmn.WAIT_FOR_SAY_TRUMP
-            self.current_client.send("%d#0" % cmn.ASK_TRUMP)
-        else:
-            # Ask the first player how many tricks he makes.
-            self.state = cmn.WAIT_FOR_SAY_TRICKS
-            self.current_client.send("%d#%d" % (cmn.ASK_TRICKS, self._round))
+    def _count_suits(self):
+        """
+        Count the suits of each hand and find the suit of the current trick. The counts are then updated with each
+        played card.
+        """
+        self._suit_counts = [collections.Counter(card[0] for card in cards) for cards in self._player_cards]
+        self._follow_suit = next((card[0] for card in self._trick_cards if card[0] not in ["W", "L"]), None)
+        self._legal_cards = None
 
-    def say_trump(self, trump):
+    def _apply_trump(self, trump):
         """
-        Save the trump and ask the first player to say the number of tricks.
+        Set the trump that the first player chose.
         :param trump: the trump
         """
-        self.trump = trump
-        logging.info("%s chose the trump suit %s." % (self.current_player_username, trump))
-        self.current_client.send_all("%d#%s" % (cmn.FOUND_TRUMP, self.trump))
+        self.trump = str(trump)
         self.state = cmn.WAIT_FOR_SAY_TRICKS
-        self.current_client.send("%d#%d" % (cmn.ASK_TRICKS, self._round))
 
-    def say_tricks(self, num_tricks):
+    def _apply_tricks(self, num_tricks):
         """
-        Save the number of tricks that the current player said and ask the next player.
-        If all players said, ask the next player to play his card.
+        Save the number of tricks that the current player said and move on to the next player.
         :param num_tricks: the number of tricks
         """
-        # Check if the number of tricks is valid.
+        self._said_tricks[self.current_player] = num_tricks
+        self.current_player = (self.current_player+1) % self.num_players
+        self.state = cmn.WAIT_FOR_SAY_CARD if self.is_first_player else cmn.WAIT_FOR_SAY_TRICKS
+
+    def _apply_card(self, card):
+        """
+        Move the card that the current player played to the trick and move on to the next player.
+        :param card: the card
+        """
+        card = str(card)
+        self._trick_cards.append(card)
+        self.current_player_cards.remove(card)
+        self._suit_counts[self.current_player][card[0]] -= 1
+        if self._follow_suit is None and card[0] not in ["W", "L"]:
+            self._follow_suit = card[0]
+        self._legal_cards = None
+        self.current_player = (self.current_player+1) % self.num_players
+
+    def _apply_trick_winner(self, winner):
+        """
+        Give the trick to the winner, who starts the next trick. After the last trick, the points of the round are
+        saved.
+        :param winner: the seat of the winner
+        """
+        self.current_player = winner
+        self._trick_cards = []
+        self._follow_suit = None
+        self._legal_cards = None
+        self._made_tricks[winner] += 1
+        if sum(self._made_tricks) == self._round:
+            points = []
+            for i in xrange(self.num_players):
+                diff = abs(self._said_tricks[i] - self._made_tricks[i])
+                if diff == 0:
+                    points.append(20 + 10*self._made_tricks[i])
+                else:
+                    points.append(-10*diff)
+            self._points.append(points)
+            self._tricks.append([self._said_tricks, self._made_tricks])
+
+    def snapshot(self, client_id=None):
+        """
+        Return the state of the running game as seen by the given player.
+        :param client_id: the client id of the player, None for a spectator (no cards)
+        :return: dict with the seat order, the cards of the player, the trump, the said and made tricks, the cards of
+                 the current trick, the points of the finished rounds and the player whose turn it is
+        """
+        usernames = [self._clients[i].username for i in self._player_ids]
+        first_player = self._round % self.num_players
+        if self.state == cmn.WAIT_FOR_SAY_TRUMP:
+            num_said = 0
+        elif self.state == cmn.WAIT_FOR_SAY_TRICKS:
+            num_said = (self.current_player - first_player) % self.num_players
+        else:
+            num_said = self.num_players
+        said_tricks = [None] * self.num_players
+        for k in xrange(num_said):
+            i = (first_player + k) % self.num_players
+            said_tricks[i] = self._said_tricks[i]
+        trick_start = self.current_player - len(self._trick_cards)
+        trick = [[usernames[(trick_start + k) % self.num_players], card] for k, card in enumerate(self._trick_cards)]
+        return {"players": usernames,
+                "round": self._round,
+                "num_rounds": self._num_rounds,
+                "cards": [] if client_id is None else self._player_cards[self._player_ids.index(client_id)],
+                "hand_version": 0 if client_id is None else self.hand(client_id)[0],
+                "trump": self.trump,
+                "said_tricks": said_tricks,
+                "made_tricks": self._made_tricks,
+                "trick": trick,
+                "points": self._points,
+                "current_player": usernames[self.current_player],
+                "state": self.state}
+
+    def resume(self, client_id):
+        """
+        Send the snapshot of the game to the player who resumed the session and repeat the question if it is the
+        player's turn. The turn clock keeps running.
+        :param client_id: the client id of the player
+        """
+        client = self._clients[client_id]
+        client.send_message(cmn.SNAPSHOT, self.snapshot(client_id))
+        if self.current_player_id == client_id:
+            if self.state == cmn.WAIT_FOR_SAY_TRUMP:
+                client.send_message(cmn.ASK_TRUMP, 0)
+            elif self.state == cmn.WAIT_FOR_SAY_TRICKS:
+                client.send_message(cmn.ASK_TRICKS, self._round)
+            elif self.state == cmn.WAIT_FOR_SAY_CARD:
+                client.send_message(cmn.ASK_CARD, *self._ask_card_fields())
+
+    def replace_player(self, client_id, new_id):
+        """
+        Give the seat of the player who left to another client, e. g. a bot, and ask it for the move if it is the
+        player's turn. The turn clock keeps running.
+        :param client_id: the client id of the player who left
+        :param new_id: the client id of the new player, the client must already be in the clients of the game
+        """
+        self._transition("replace", [self._player_ids.index(client_id), new_id])
+        logging.info("%s takes over the seat.", self._clients[new_id].username)
+        self.resume(new_id)
+
+    def continue_game(self):
+        """
+        Continue the game after it was recovered from the journal: Ask the current player for the move and start the
+        turn clock. If the journal ended between two rounds, the next round is started.
+        """
+        if sum(self._made_tricks) == self._round:
+            if self._round < self._num_rounds:
+                self._next_round()
+            else:
+                self._compute_final_result()
+        elif self.state == cmn.WAIT_FOR_SAY_TRUMP:
+            self._ask_current_player(cmn.ASK_TRUMP, 0)
+        elif self.state == cmn.WAIT_FOR_SAY_TRICKS:
+            self._ask_current_player(cmn.ASK_TRICKS, self._round)
+        else:
+            self._ask_current_player(cmn.ASK_CARD, *self._ask_card_fields())
+
+    def _ask_current_player(self, msg_id, *fields):
+        """
+        Ask the current player for the next move and start the turn clock.
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        self.current_client.send_message(msg_id, *fields)
+        self._asked_at = self._clock.seconds()
+        self.stop()
+        if self._turn_clock is not None and self._turn_time is not None:
+            self._turn_timer = self._turn_clock.schedule(self._turn_time, self._turn_timed_out)
+
+    def _record_think_time(self):
+        """
+        Record the time that the current player took for the move.
+        """
+        if self._asked_at is not None:
+            THINK_SECONDS[MOVE_STATES[self.state]].observe(self._clock.seconds() - self._asked_at)
+            self._asked_at = None
+
+    def _turn_timed_out(self):
+        """
+        Make a move for the current player, because the player did not move in time.
+        """
+        self._turn_timer = None
+        if self.state == cmn.WAIT_FOR_SAY_TRUMP:
+            move, say = self._auto_trump(), self.say_trump
+        elif self.state == cmn.WAIT_FOR_SAY_TRICKS:
+            move, say = self._auto_num_tricks(), self.say_tricks
+        else:
+            move, say = random.choice(sorted(self.legal_cards())), self.say_card
+        logging.info("%s did not move in time.", self.current_player_username)
+        self.current_client.send_message(cmn.TURN_TIMED_OUT, self.state, str(move))
+        say(move)
+
+    def _auto_trump(self):
+        """
+        Return the suit that the current player holds most often.
+        :return: the suit
+        """
+        suits = [card[0] for card in self.current_player_cards if card[0] not in ["W", "L"]]
+        if len(suits) == 0:
+            return random.choice("CDHS")
+        return max("CDHS", key=suits.count)
+
+    def _auto_num_tricks(self):
+        """
+        Return the valid number of tricks that is closest to the number of wizards of the current player.
+        :return: the number of tricks
+        """
+        num_wizards = sum(1 for card in self.current_player_cards if card[0] == "W")
+        valid = [n for n in xrange(self._round+1) if self.is_valid_num_tricks(n)]
+        return min(valid, key=lambda n: abs(n - num_wizards))
+
+    def _send_all(self, msg_id, *fields):
+        """
+        Send the message to all players of the game and pass it to the public callback.
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        if self._output is not None:
+            self._output.broadcast([self._clients[client_id] for client_id in self._player_ids], msg_id, fields,
+                                   self._table_id)
+        else:
+            for client_id in self._player_ids:
+                self._clients[client_id].send_message(msg_id, *fields)
+        if self._public_callback is not None:
+            self._public_callback(msg_id, fields)
+
+    @property
+    def current_player_id(self):
+        """
+        Return the player id of the current player.
+        :return: the player id
+        """
+        return self._player_ids[self.current_player]
+
+    @property
+    def current_client(self):
+        """
+        Return the client of the current player.
+        :return: the client
+        """
+        return self._clients[self.current_player_id]
+
+    @property
+    def current_player_username(self):
+        """
+        Return the username of the current player.
+        :return: the username
+        """
+        return self.current_client.username
+
+    def hand_state(self, seat):
+        """
+        Return the version and the checksum of the hand at the seat. The full hand is only sent once per round with
+        CARDS, each played card increments the version. ASK_CARD carries version and checksum instead of the hand, so
+        the client can check its own copy and ask for the full hand with RESYNC_HAND if it differs.
+        :param seat: the seat
+        :return: version, checksum
+        """
+        cards = self._player_cards[seat]
+        return self._round - len(cards), cmn.hand_checksum(cards)
+
+    def hand(self, client_id):
+        """
+        Return the version and the cards of the hand of the player.
+        :param client_id: the client id of the player
+        :return: version, cards
+        """
+        cards = self._player_cards[self._player_ids.index(client_id)]
+        return self._round - len(cards), list(cards)
+
+    @property
+    def current_player_cards(self):
+        """
+        Return the cards of the current player.
+        :return: the cards
+        """
+        return self._player_cards[self.current_player]
+
+    @property
+    def started(self):
+        """
+        Return whether the game has started or not.
+        :return: True if the game has started else False
+        """
+        return self._round > 0
+
+    @property
+    def is_first_player(self):
+        """
+        Return True if the current player is the first player.
+        :return: whether the current player is the first player
+        """
+        return self.current_player == self._round % self.num_players
+
+    @property
+    def is_last_player(self):
+        """
+        Return True if the current player is the last player.
+        :return: whether the current player is the last player
+        """
+        return (self.current_player+1) % self.num_players == self._round % self.num_players
+
+    def _next_round(self):
+        """
+        Increase the round number, get a new deck and shuffle it and send the cards to each player.
+        """
+        # Shuffle the cards.
+        num_cards = self._round + 1
+        self._deck = self._create_cards()
+        random.shuffle(self._deck)
+
+        # Find the trump card.
+        r = random.randint(0, 59)
+        trump = self._deck[r][0]
+
+        # Deal the cards.
+        cards = []
+        for _ in xrange(self.num_players):
+            seat_cards, self._deck = self._deck[:num_cards], self._deck[num_cards:]
+            cards.append(seat_cards)
+        self._transition("round", [cards, trump])
+        logging.info("Playing round %d of %d.", self._round, self._num_rounds)
+        logging.info("%s starts.", self.current_player_username)
+
+        # Send the cards to the players.
+        for i, player_id in enumerate(self._player_ids):
+            self._clients[player_id].send_message(cmn.CARDS, self._player_cards[i])
+
+        # Send the trump to all players.
+        logging.info("The trump suit is %s.", cmn.COLOR_NAMES[self.trump])
+        self._send_all(cmn.FOUND_TRUMP, self.trump)
+
+        if self.state == cmn.WAIT_FOR_SAY_TRUMP:
+            # Ask the first player for the trump.
+            self._ask_current_player(cmn.ASK_TRUMP, 0)
+        else:
+            # Ask the first player how many tricks he makes.
+            self._ask_current_player(cmn.ASK_TRICKS, self._round)
+
+    def say_trump(self, trump):
+        """
+        Save the trump and ask the first player to say the number of tricks.
+        :param trump: the trump
+        """
+        self._record_think_time()
+        self._transition("trump", trump)
+        logging.info("%s chose the trump suit %s.", self.current_player_username, trump)
+        self._send_all(cmn.FOUND_TRUMP, self.trump)
+        self._ask_current_player(cmn.ASK_TRICKS, self._round)
+
+    def is_valid_num_tricks(self, num_tricks):
+        """
+        Return whether the current player may say the number of tricks. The last player must not say the number that
+        makes the sum of all said tricks equal to the number of cards.
+        :param num_tricks: the number of tricks
+        :return: True if the number is valid else False
+        """
         num_tricks_in_range = 0 <= num_tricks <= self._round
         num_tricks_equals_round = sum(self._said_tricks) + num_tricks == self._round
-        if (not num_tricks_in_range) or (self.is_last_player and num_tricks_equals_round):
-            logging.warning("%s said invalid number of tricks: %d" % (self.current_player_username, num_tricks))
-            self.current_client.send("%d#%d" % (cmn.INVALID_NUM_TRICKS, num_tricks))
+        return num_tricks_in_range and not (self.is_last_player and num_tricks_equals_round)
+
+    def say_tricks(self, num_tricks):
+        """
+        Save the number of tricks that the current player said and ask the next player.
+        If all players said, ask the next player to play his card.
+        :param num_tricks: the number of tricks
+        """
+        # Check if the number of tricks is valid.
+        if not self.is_valid_num_tricks(num_tricks):
+            logging.warning("%s said invalid number of tricks: %d", self.current_player_username, num_tricks)
+            self.current_client.send_message(cmn.INVALID_NUM_TRICKS, num_tricks)
             return
 
         # Tell all players what was played.
-        logging.info("%s said %d tricks." % (self.current_player_username, num_tricks))
-        self.current_client.send_all("%d#%s#%d" % (cmn.PLAYER_SAID_TRICKS, self.current_player_username, num_tricks))
+        self._record_think_time()
+        logging.info("%s said %d tricks.", self.current_player_username, num_tricks)
+        self._send_all(cmn.PLAYER_SAID_TRICKS, self.current_player_username, num_tricks)
 
         # Save the said number.
-        self._said_tricks[self.current_player] = num_tricks
-        self.current_player = (self.current_player+1) % self.num_players
+        self._transition("tricks", num_tricks)
 
         # Ask the next player to say the tricks or to play the card.
-        if not self.is_first_player:
-            self.state = cmn.WAIT_FOR_SAY_TRICKS
-            self.current_client.send("%d#%d" % (cmn.ASK_TRICKS, self._round))
+        if self.state == cmn.WAIT_FOR_SAY_TRICKS:
+            self._ask_current_player(cmn.ASK_TRICKS, self._round)
         else:
-            self.state = cmn.WAIT_FOR_SAY_CARD
-            self.current_client.send("%d#%s" % (cmn.ASK_CARD, json.dumps(self.current_player_cards)))
+            self._ask_current_player(cmn.ASK_CARD, *self._ask_card_fields())
+
+    def legal_cards(self):
+        """
+        Return the cards that the current player may play: If a suit was played in the current trick and the player has
+        cards of that suit, only these cards and the wizards and losers are allowed. The set is computed once per turn
+        from the suit counts of the hand.
+        :return: frozenset with the cards
+        """
+        if self._legal_cards is None:
+            follow_suit = self._follow_suit
+            if follow_suit is not None and self._suit_counts[self.current_player][follow_suit] > 0:
+                self._legal_cards = frozenset(card for card in self.current_player_cards
+                                              if card[0] in ["W", "L", follow_suit])
+            else:
+                self._legal_cards = frozenset(self.current_player_cards)
+        return self._legal_cards
+
+    def _ask_card_fields(self):
+        """
+        Return the fields of the ASK_CARD message for the current player: the version and the checksum of the hand and
+        the cards that the player may play.
+        :return: version, checksum, sorted legal cards
+        """
+        return self.hand_state(self.current_player) + (sorted(self.legal_cards()),)
 
     def say_card(self, played_card):
         """
@@ -459,33 +1497,28 @@ class WizardGame(object):
         If all players played, find out who won.
         :param played_card: the played card
         """
-        # Check if the player followed suit.
-        played_colors = [card[0] for card in self._trick_cards if card[0] not in ["W", "L"]]
-        if len(played_colors) > 0:
-            # Someone has played a suit already. This is not always the case:
-            # There is no suit if the first cards where wizards / losers and when the first card has not been played at
-            # all.
-            follow_suit = played_colors[0][0]
-            if played_card[0] not in ["W", "L", follow_suit]:
-                # The player did not follow suit. This is only okay, if none of the hand cards are of the suit.
-                player_colors = [card[0] for card in self.current_player_cards]
-                if follow_suit in player_colors:
-                    logging.warning("%s did not follow suit." % self.current_player_username)
-                    self.current_client.send("%d#%s#%s" % (cmn.NOT_FOLLOWED_SUIT, follow_suit, played_card))
-                    return
+        # Check that the player has the card and followed suit.
+        if played_card not in self.legal_cards():
+            if played_card in self.current_player_cards:
+                logging.warning("%s did not follow suit.", self.current_player_username)
+                self.current_client.send_message(cmn.NOT_FOLLOWED_SUIT, self._follow_suit, played_card)
+            else:
+                logging.warning("%s tried to play the card '%s' without having this card.",
+                                self.current_player_username, played_card)
+                self.current_client.send_message(cmn.INVALID_CARD, played_card)
+            return
 
         # Tell all players what was played.
-        logging.info("%s played %s." % (self.current_player_username, played_card))
-        self.current_client.send_all("%d#%s#%s" % (cmn.PLAYER_PLAYED_CARD, self.current_player_username, played_card))
+        self._record_think_time()
+        logging.info("%s played %s.", self.current_player_username, played_card)
+        self._send_all(cmn.PLAYER_PLAYED_CARD, self.current_player_username, played_card)
 
         # Save the played card.
-        self._trick_cards.append(played_card)
-        self.current_player_cards.remove(played_card)
-        self.current_player = (self.current_player+1) % self.num_players
+        self._transition("card", played_card)
 
         # Ask the next player to play the card or find the winner.
         if len(self._trick_cards) < self.num_players:
-            self.current_client.send("%d#%s" % (cmn.ASK_CARD, json.dumps(self.current_player_cards)))
+            self._ask_current_player(cmn.ASK_CARD, *self._ask_card_fields())
         else:
             self._find_trick_winner()
 
@@ -493,58 +1526,26 @@ class WizardGame(object):
         """
         Find the winner of the current trick.
         """
-        played_colors = [card[0] for card in self._trick_cards]
-        if "W" in played_colors:
-            # Someone played a wizard => first wizard wins.
-            winner_index = played_colors.index("W")
-            winner = (self.current_player + winner_index) % self.num_players
-        elif all(c == "L" for c in played_colors):
-            # Everyone played a jester => last player wins.
-            winner = (self.current_player - 1) % self.num_players
-        elif self.trump != "L" and any(card[0] == self.trump for card in self._trick_cards):
-            # No wizards, but trump was played => the highest trump wins.
-            trump_values = [(card[1], i) for i, card in enumerate(self._trick_cards) if card[0] == self.trump]
-            trump_values = [(cmn.NUMERIC_VALUES[x[0]], x[1]) for x in trump_values]
-            winner_index = max(trump_values)[1]
-            winner = (self.current_player+winner_index) % self.num_players
-        else:
-            # No wizards and no trump => the highest card that followed suit wins.
-            follow_suit = (c for c in played_colors if c not in ["W", "L"]).next()
-            suit_values = [(card[1], i) for i, card in enumerate(self._trick_cards) if card[0] == follow_suit]
-            suit_values = [(cmn.NUMERIC_VALUES[x[0]], x[1]) for x in suit_values]
-            winner_index = max(suit_values)[1]
-            winner = (self.current_player+winner_index) % self.num_players
-
-        # The next trick starts with the winner.
-        self.current_player = winner
-        self._trick_cards = []
+        winner = (self.current_player + cmn.trick_winner(self._trick_cards, self.trump)) % self.num_players
 
-        # Save the winner.
-        self._made_tricks[winner] += 1
-        logging.info("%s wins the trick." % self.current_player_username)
-        self.current_client.send_all("%d#%s" % (cmn.WINS_TRICK, self.current_player_username))
+        # Save the winner, the next trick starts with the winner.
+        self._transition("trick_winner", winner)
+        logging.info("%s wins the trick.", self.current_player_username)
+        self._send_all(cmn.WINS_TRICK, self.current_player_username)
 
         # Ask the next player to play the card or compute the result of this round.
         if sum(self._made_tricks) < self._round:
-            self.current_client.send("%d#%s" % (cmn.ASK_CARD, json.dumps(self.current_player_cards)))
+            self._ask_current_player(cmn.ASK_CARD, *self._ask_card_fields())
         else:
             self._compute_round_result()
 
     def _compute_round_result(self):
         """
-        Compute the result of the current round.
+        Send the result of the current round, the points were saved with the last trick.
         """
-        points = []
-        for i in xrange(self.num_players):
-            diff = abs(self._said_tricks[i] - self._made_tricks[i])
-            if diff == 0:
-                points.append(20 + 10*self._made_tricks[i])
-            else:
-                points.append(-10*diff)
-
-        logging.info("Round ended. The round points in seat order: %s." % ", ".join(str(x) for x in points))
-        self.current_client.send_all("%d#%s" % (cmn.MADE_POINTS, json.dumps(points)))
-        self._points.append(points)
+        points = self._points[-1]
+        logging.info("Round ended. The round points in seat order: %s.", ", ".join(str(x) for x in points))
+        self._send_all(cmn.MADE_POINTS, points)
 
         # Start the next round or compute the final results.
         if self._round < self._num_rounds:
@@ -557,8 +1558,8 @@ class WizardGame(object):
         Compute the final result of the game.
         """
         points = [sum(x) for x in zip(*self._points)]
-        logging.info("The final points in seat order: %s." % ", ".join(str(x) for x in points))
-        self.current_client.send_all("%d#%s" % (cmn.FINAL_POINTS, json.dumps(points)))
+        logging.info("The final points in seat order: %s.", ", ".join(str(x) for x in points))
+        self._send_all(cmn.FINAL_POINTS, points)
 
         # Find the winners.
         max_points = max(points)
@@ -571,46 +1572,1436 @@ class WizardGame(object):
             winners.append((winner_client.username, max_points))
 
         # Announce the winners.
-        self.current_client.send_all("%d#%s" % (cmn.FINAL_WINNERS, json.dumps(winners)))
+        self._send_all(cmn.FINAL_WINNERS, winners)
         if len(winners) == 1:
-            logging.info("The winners: %s." % ", ".join(w[0] for w in winners))
+            logging.info("The winners: %s.", ", ".join(w[0] for w in winners))
+
+        # Tell the owner that the game is over, so the table can be closed.
+        if self._finished_callback is not None:
+            self._finished_callback()
+
+    def result(self):
+        """
+        Return the result of the finished game for the statistics.
+        :return: dict with the number of players and rounds and, in seat order, the username, the round points, the
+                 said and made tricks of each player and whether a bot played the seat at the end
+        """
+        players = []
+        for i, player_id in enumerate(self._player_ids):
+            players.append({"username": self._clients[player_id].username,
+                            "bot": self._clients[player_id].family == "bot",
+                            "points": [points[i] for points in self._points],
+                            "said": [said[i] for said, made in self._tricks],
+                            "made": [made[i] for said, made in self._tricks]})
+        return {"num_players": self.num_players, "num_rounds": self._num_rounds, "players": players}
 
-        # Wait a few seconds, so that the network messages can be sent, then exit the game.
-        reactor.callLater(5, reactor.stop)
+    # The transitions of the game state by kind.
+    TRANSITIONS = {"start": _apply_start, "round": _apply_round, "trump": _apply_trump, "tricks": _apply_tricks,
+                   "card": _apply_card, "trick_winner": _apply_trick_winner, "replace": _apply_replace}
 
 
 class ClientConnector(Factory):
     """
-    Creates a ClientConnection for each incoming client.
+    Creates a ClientConnection for each incoming client and manages the lobby with its tables.
+
+    With worker processes, the lobby stays in the server process. Once a table is full, the sockets of its clients are
+    handed over to the worker with the fewest tables, which runs the game. When the table is closed, the worker returns
+    the remaining sockets to the lobby.
+
+    For an upgrade, a new server process connects to the upgrade socket of the old one. The old process stops listening
+    and hands over the listening socket, the lobby with its connections and open tables, and the ids and usernames of
+    all clients. It then runs its started tables as a worker of the new process and exits once they are finished.
+
+    Bots (see core/bots.py) sit at the tables without a connection. They take the empty seats of an open table that
+    waited bot_fill_time seconds for players, and with bot_replace they take the seat of a player who leaves a running
+    game, so the others can play on. Bots have negative ids and no username in the index, their tables always run in
+    the process that created the bots.
+
+    A tournament (see core/tournament.py) runs in the server process: All tables of a round are opened at once and
+    reserved for their players, who are seated as soon as they are in the lobby. Full tables are handed over to the
+    workers like any other table, so the tables of a round run concurrently. The round points are taken from the public
+    messages of the games, also from the workers, and the next round is paired once all tables of the round are closed.
     """
 
-    def __init__(self, game):
-        assert isinstance(game, WizardGame)
-        self.rand_ids = range(100000)
-        random.shuffle(self.rand_ids)
+    def __init__(self, num_players, num_rounds=None, high_water=64*1024, lag_grace_period=10.0, turn_time=None,
+                 handshake_timeout=None, idle_timeout=None, resume_timeout=None, clock=reactor, game_journal=None,
+                 stats_store=None, chat_rate=1.0, chat_burst=5, bot_pool=None, bot_fill_time=None, bot_replace=False):
+        self.clock = clock  # provider of seconds and callLater, the reactor or the clock of another event loop
+        self.journal = game_journal  # the journal of the started games, None for no journal
+        self.stats = stats_store  # the store of the game results, None for no statistics
+        self.chat_rate = chat_rate  # chat messages per second and client
+        self.chat_burst = chat_burst  # chat messages a client may send at once
+        self.bot_pool = bot_pool  # decides the moves of the bots, None for no bots
+        self.bot_fill_time = bot_fill_time  # seconds an open table waits before bots take the empty seats, None: never
+        self.bot_replace = bot_replace  # whether a bot takes the seat of a player who leaves a running game
+        self._bot_ids = itertools.count(-1, -1)
+        self.tournament = None  # the running tournament, only in the server process
+        self._tournament_checkpoint = None
+        self.client_ids = IdAllocator(100000)
+        self.matchmaking = MatchmakingQueue(clock=clock)  # the clients that wait for a table
+        self.usernames = UsernameIndex()  # the usernames of all clients, also of those that play in a worker process
         self.clients = {}
-        self.game = game
+        self.handshakes = set()  # the connections that did not finish the handshake
+        self.output = OutputBatcher(clock.callLater)
+        self.lobby_chat = ChatChannel(self._lobby_members, self.output, call_later=clock.callLater)
+        self.high_water = high_water  # buffered bytes per connection before the client is considered lagging
+        self.lag_grace_period = lag_grace_period  # seconds a client may lag before it is disconnected
+        self.timers = TimingWheel(clock=clock)  # drives the turn and resume timeouts
+        self.turn_time = turn_time  # seconds per move, None means no limit
+        self.resume_timeout = resume_timeout  # seconds a seat is kept for a disconnected player, None means no resume
+        self._suspended = {}  # client id => (client, timer), the disconnected clients whose seats are kept
+        self._resume_tokens = {}  # resume token => (client id, username)
+        self._resume_token_ids = {}  # client id => resume token
+        self._pending_resumes = {}  # client id => worker, table id, session and fd of a resumed client
+        self.reaper = IdleReaper({cmn.PENDING: handshake_timeout, cmn.WAIT_FOR_NAME: handshake_timeout,
+                                  cmn.ACCEPTED: idle_timeout}, lambda client, state: client.reap(state),
+                                  clock=clock, deadline_states=(cmn.PENDING, cmn.WAIT_FOR_NAME),
+                                  keep=lambda client: client.table is not None)
+        self.reaper.start()
+        self._remote_clients = {}  # client id => table, for the clients that play in a worker process
+        self.tables = {}
+        self._open_tables = collections.OrderedDict()  # the tables that did not start yet, in creation order
+        self._next_table_id = 1
+        self._num_players = num_players
+        self._num_rounds = num_rounds
+        self._workers = []
+        self._parent = None  # the channel to the server process, if this is a worker
+        self._is_worker = False
+        self._adopted_session = None
+        self._pending_hand_overs = {}  # table id => ids of the clients whose output was not yet flushed
+        self._num_unflushed = 0  # handed over connections whose output was not yet flushed
+        self._port = None  # the listening port for the clients
+        self._metrics_port = None
+        self._upgrade_port = None
+        self._admin_port = None
+        self._listeners = []  # the ports of the additional client addresses
+        self._admin_requests = {}  # request id => worker channel and deferred of the console commands in workers
+        self._next_admin_request = 1
+        self._take_over_args = None  # the arguments of listen while this process takes over
+        self._predecessor = None  # the channel to the old server process that finishes its tables after an upgrade
+        self._upgraded = False  # True once this process handed the server over to a new process
+        self.worker_metrics = {}  # worker id => the last reported metrics of the worker
+        self._metrics_loop = None
+        self._shutting_down = False
+        clock.addSystemEventTrigger("before", "shutdown", self._shutdown)
+
+    def _shutdown(self):
+        """
+        Remember that the reactor shuts down, so closing channels are expected.
+        """
+        self._shutting_down = True
 
     def buildProtocol(self, addr):
-        return ClientConnection(self, addr.host, addr.port)
+        session, self._adopted_session = self._adopted_session, None
+        host, port = transports.peer_name(addr)
+        if session is None and self.client_ids.num_free == 0:
+            logging.warning("Refused connection from %s:%d, the server is full.", host, port)
+            return None
+        return ClientConnection(self, host, port, session, transports.address_family(addr))
+
+    def report_metrics(self, interval=5.0):
+        """
+        Periodically send the metrics of this worker to the server process.
+        :param interval: seconds between two reports
+        """
+        self._metrics_loop = LoopingCall(self._report_metrics)
+        self._metrics_loop.start(interval, now=False)
+
+    def _report_metrics(self):
+        """
+        Send the metrics of this worker to the server process.
+        """
+        if self._parent is not None:
+            self._parent.send_command(worker_pool.METRICS, metrics.REGISTRY.dump())
+
+    def add_worker(self, fd):
+        """
+        Use the worker process at the other end of the given UNIX socket to run games.
+        :param fd: the file descriptor of the UNIX socket
+        """
+        worker_pool.adopt_channel(fd, self, len(self._workers))
+
+    def connect_parent(self, fd):
+        """
+        Run as worker of the server process at the other end of the given UNIX socket.
+        :param fd: the file descriptor of the UNIX socket
+        """
+        self._is_worker = True
+        worker_pool.adopt_channel(fd, self)
+
+    def listen(self, port, metrics_port=None, upgrade_socket=None, admin_socket=None, addresses=()):
+        """
+        Accept the clients on the listening port and open the metrics endpoint, the upgrade socket and the admin socket.
+        :param port: the listening TCP port
+        :param metrics_port: serve the metrics on http://127.0.0.1:metrics_port/metrics, None for no metrics endpoint
+        :param upgrade_socket: path of the UNIX socket where a new server process can take over, None for no upgrades
+        :param admin_socket: path of the UNIX socket of the admin console, None for no console
+        :param addresses: additional addresses for the clients, see transports.parse_address
+        """
+        self._port = port
+        for address in addresses:
+            self._listeners.append(transports.listen(address, self))
+            logging.info("Accepting clients on %s.", address)
+        if metrics_port is not None:
+            resource = metrics.MetricsResource(metrics.REGISTRY, self.worker_metrics.values)
+            self._metrics_port = reactor.listenTCP(metrics_port, Site(resource), interface="127.0.0.1")
+        if upgrade_socket is not None:
+            self._upgrade_port = worker_pool.listen_upgrade_socket(upgrade_socket, self)
+        if admin_socket is not None:
+            self._admin_port = admin.listen_admin_socket(admin_socket, self)
+
+    def take_over(self, port, metrics_port, upgrade_socket, admin_socket=None, addresses=()):
+        """
+        Take over from the server process that listens on the upgrade socket. Once the old process sent its state, this
+        process listens on the socket of the old process instead of the given port.
+        :param port: the port that is used if the old process exits before it sent its state
+        :param metrics_port: serve the metrics on http://127.0.0.1:metrics_port/metrics, None for no metrics endpoint
+        :param upgrade_socket: path of the UNIX socket
+        :param admin_socket: path of the UNIX socket of the admin console, None for no console
+        :param addresses: additional addresses for the clients, see transports.parse_address
+        :return: False if no server process listens on the upgrade socket, else True
+        """
+        fd = worker_pool.connect_upgrade_socket(upgrade_socket)
+        if fd is None:
+            return False
+        logging.info("Taking over from the server process at %s.", upgrade_socket)
+        self._take_over_args = (port, metrics_port, upgrade_socket, admin_socket, addresses)
+        channel = worker_pool.adopt_channel(fd, self, worker_pool.UPGRADE_CHANNEL)
+        channel.send_command(worker_pool.TAKE_OVER, os.getpid())
+        return True
+
+    def _hand_over_server(self, channel, pid):
+        """
+        Stop listening and send the state to the new server process once the ports are closed.
+        :param channel: the channel to the new server process
+        :param pid: the process id of the new server process
+        """
+        if self._upgraded or self._port is None:
+            logging.warning("Refused the take over by process %d, the server was already handed over.", pid)
+            return
+        logging.info("Handing the server over to process %d.", pid)
+        self._upgraded = True
+        fd, stopped = worker_pool.release_port(self._port)
+        ports_closed = [stopped, defer.maybeDeferred(self._upgrade_port.stopListening)]
+        for port in [self._metrics_port, self._admin_port] + self._listeners:
+            if port is not None:
+                ports_closed.append(defer.maybeDeferred(port.stopListening))
+        defer.gatherResults(ports_closed).addCallback(lambda _: self._send_server_state(channel, fd))
+
+    def _send_server_state(self, channel, listen_fd):
+        """
+        Hand the listening socket, the lobby and the open tables over to the new server process. The started tables
+        keep running in this process, which from now on is a worker of the new process.
+        :param channel: the channel to the new server process
+        :param listen_fd: the file descriptor of the listening socket
+        """
+        self._is_worker = True
+        self._parent = channel
+        tables = []
+        for table in self.tables.values():
+            tables.append({"table_id": table.table_id, "num_players": table.game.num_players,
+                           "num_rounds": table.game.num_rounds, "started": table.started,
+                           "clients": [client_id for client_id, client in table.clients.iteritems()
+                                       if client.family != "bot"] if table.started else []})
+            if not table.started:
+                del self.tables[table.table_id]
+                del self._open_tables[table.table_id]
+        lobby = [client for client in self.clients.itervalues() if client.table is None or not client.table.started]
+        lobby.extend(self.handshakes)
+        for client in [c for c in lobby if c.family == "memory"]:
+            # In-process connections have no socket that could be handed over.
+            lobby.remove(client)
+            client.transport.loseConnection()
+        sessions, fds = self._release_clients(lobby)
+        for client in lobby:
+            if client.watching is not None:
+                client.watching.remove_spectator(client)
+            self.matchmaking.remove(client.client_id)
+        data = {"client_ids": self.client_ids.dump(), "usernames": self.usernames.dump(),
+                "resume_tokens": [[token, client_id, username]
+                                  for token, (client_id, username) in self._resume_tokens.iteritems()],
+                "next_table_id": self._next_table_id, "tables": tables, "clients": sessions}
+        channel.send_command(worker_pool.SERVER_STATE, data, [listen_fd] + fds)
+        logging.info("Handed %d connections over, %d tables are still running.", len(lobby), len(self.tables))
+        if self._metrics_port is not None:
+            self.report_metrics()
+        self._check_drained()
+
+    def _adopt_server(self, channel, data):
+        """
+        Take over the listening socket, the lobby and the open tables of the old server process. Its started tables
+        keep running there, the old process is a worker until they are finished.
+        :param channel: the channel to the old server process
+        :param data: the state of the old server process
+        """
+        fds = channel.pop_fds(1 + len(data["clients"]))
+        port = reactor.adoptStreamPort(fds[0], socket.AF_INET, self)
+        os.close(fds[0])
+        self.client_ids.load(data["client_ids"])
+        self.usernames.load(data["usernames"])
+        for token, client_id, username in data["resume_tokens"]:
+            self._resume_tokens[str(token)] = (client_id, str(username))
+            self._resume_token_ids[client_id] = str(token)
+        self._next_table_id = data["next_table_id"]
+        for entry in data["tables"]:
+            table = self._new_table(entry["table_id"], entry["num_players"], entry["num_rounds"])
+            if entry["started"]:
+                table.worker = channel
+                table.remote_ids = entry["clients"]
+                for client_id in table.remote_ids:
+                    self._remote_clients[client_id] = table
+                channel.num_tables += 1
+            else:
+                self._open_tables[table.table_id] = table
+        for session, fd in zip(data["clients"], fds[1:]):
+            client = self._adopt_client(fd, session)
+            if session["table_id"] is not None:
+                client.table = self.tables[session["table_id"]]
+                client.table.clients[client.client_id] = client
+            elif session["watching"] in self.tables:
+                client.watching = self.tables[session["watching"]]
+                self.reaper.untrack(client)
+                client.watching.add_spectator(client)
+            elif session.get("queue") is not None:
+                self.enqueue(client, *session["queue"])
+        for table in self._open_tables.itervalues():
+            if len(table.clients) > 0:
+                self._schedule_bot_fill(table)
+        logging.info("Took over %d connections and %d tables, %d tables are still running in the old process.",
+                     len(data["clients"]), len(data["tables"]), channel.num_tables)
+        args = self._take_over_args
+        self._take_over_args = None
+        self.listen(port, *args[1:])
+
+    def _check_drained(self):
+        """
+        After an upgrade, close the channel to the new server process once the last table is closed and the output of
+        all handed over connections was flushed. The process exits when the channel is closed.
+        """
+        if self._upgraded and len(self.tables) == 0 and self._num_unflushed == 0:
+            logging.info("All tables are finished, the old server process exits.")
+            self._parent.transport.loseConnection()
+
+    def channel_made(self, channel):
+        """
+        Store the new channel to the server process or to a worker.
+        :param channel: the channel
+        """
+        if channel.worker_id == worker_pool.UPGRADE_CHANNEL:
+            # The old process waits for the TAKE_OVER command of the new one.
+            if self._take_over_args is not None:
+                self._predecessor = channel
+            return
+        if self._is_worker:
+            self._parent = channel
+        else:
+            self._workers.append(channel)
+
+    def channel_lost(self, channel):
+        """
+        Clean up after the server process or a worker died.
+        :param channel: the channel
+        """
+        if self._is_worker:
+            logging.info("Lost the connection to the server process.")
+            if not self._shutting_down:
+                reactor.stop()
+            return
+        if channel is self._predecessor:
+            self._predecessor = None
+            if self._take_over_args is not None:
+                args = self._take_over_args
+                self._take_over_args = None
+                logging.warning("The old server process exited before the take over, listening on port %d.", args[0])
+                self.listen(reactor.listenTCP(args[0], self), *args[1:])
+                return
+            logging.info("The old server process finished its tables.")
+        elif channel.worker_id == worker_pool.UPGRADE_CHANNEL:
+            # A new server process that did not take over.
+            return
+        else:
+            if not self._shutting_down:
+                logging.error("Lost worker %d.", channel.worker_id)
+            self._workers.remove(channel)
+        self.worker_metrics.pop(channel.worker_id, None)
+        for request_id, (worker, d) in self._admin_requests.items():
+            if worker is channel:
+                del self._admin_requests[request_id]
+                d.errback(RuntimeError("The worker process exited."))
+        for table in self.tables.values():
+            if table.worker is channel:
+                for client_id in table.remote_ids:
+                    self._release_remote_client(client_id)
+                self._close_spectators(table)
+                del self.tables[table.table_id]
+                self._tournament_table_closed(table)
+
+    def channel_command(self, channel, command, data):
+        """
+        Handle a command from the server process or from a worker.
+        :param channel: the channel
+        :param command: the command
+        :param data: the command data
+        """
+        if command == worker_pool.HAND_OVER:
+            table = self._new_table(data["table_id"], data["num_players"], data["num_rounds"])
+            table.chat.restore(messages.to_str(data["chat"]))
+            table.tournament_key = data.get("tournament_key")
+            for session, fd in zip(data["clients"], channel.pop_fds(len(data["clients"]))):
+                client = self._adopt_client(fd, session)
+                client.table = table
+                table.clients[client.client_id] = client
+
+        elif command == worker_pool.START_TABLE:
+            self._start_game(self.tables[data])
+
+        elif command == worker_pool.RETURN_CLIENTS:
+            clients = []
+            for session, fd in zip(data["clients"], channel.pop_fds(len(data["clients"]))):
+                del self._remote_clients[session["id"]]
+                clients.append(self._adopt_client(fd, session))
+            table = self.tables.pop(data["table_id"])
+            channel.num_tables -= 1
+            for client_id in table.remote_ids:
+                self._release_remote_client(client_id)
+            self._close_spectators(table)
+            logging.info("Closed table %d.", table.table_id)
+            self._tournament_table_closed(table)
+            for client in clients:
+                self.seat_tournament_player(client)
+
+        elif command == worker_pool.CLIENT_LEFT:
+            self._release_remote_client(data)
+
+        elif command == worker_pool.RESUME_CLIENT:
+            fd = channel.pop_fds(1)[0]
+            table = self.tables.get(data["table_id"])
+            if table is None or data["client"]["id"] not in table.clients:
+                # The seat was given up in the meantime, the server process already got the CLIENT_LEFT command.
+                logging.info("Could not resume the session of client %d, the seat is gone.", data["client"]["id"])
+                os.close(fd)
+                return
+            self._resume_seat(self._adopt_client(fd, data["client"]), table)
+
+        elif command == worker_pool.WATCH_TABLE:
+            table = self.tables.get(data)
+            if table is not None:
+                table.watched = True
+                if table.game.started:
+                    self._public_message(table.table_id, cmn.SNAPSHOT, (table.game.snapshot(),))
+
+        elif command == worker_pool.UNWATCH_TABLE:
+            table = self.tables.get(data)
+            if table is not None:
+                table.watched = False
+
+        elif command == worker_pool.METRICS:
+            self.worker_metrics[channel.worker_id] = data
+
+        elif command == worker_pool.GAME_RESULT:
+            self._record_result(data)
+
+        elif command == worker_pool.ADMIN:
+            if self._is_worker:
+                table = self.tables.get(data["table_id"])
+                reply = "Table %d is closed." % data["table_id"] if table is None else \
+                    self._run_admin_command(table, data["command"], data["args"])
+                channel.send_command(worker_pool.ADMIN, {"id": data["id"], "reply": reply})
+            else:
+                request = self._admin_requests.pop(data["id"], None)
+                if request is not None:
+                    request[1].callback(str(data["reply"]))
+
+        elif command == worker_pool.PUBLIC_MESSAGE:
+            table = self.tables.get(data["table_id"])
+            if table is not None:
+                fields = messages.to_str(data["fields"])
+                table.send_public(data["msg_id"], fields)
+                self._tournament_message(table, data["msg_id"], fields)
+
+        elif command == worker_pool.TAKE_OVER:
+            self._hand_over_server(channel, data)
+
+        elif command == worker_pool.SERVER_STATE:
+            self._adopt_server(channel, data)
+
+        else:
+            logging.warning("Unknown command '%s' from the %s.",
+                            command, "server process" if self._is_worker else "worker %d" % channel.worker_id)
+
+    def _adopt_client(self, fd, session):
+        """
+        Create a connection for the accepted client that was handed over by another process.
+        :param fd: the file descriptor of the client socket
+        :param session: the session data of the client
+        :return: the client
+        """
+        self._adopted_session = session
+        family = socket.AF_UNIX if session.get("family") == "unix" else socket.AF_INET
+        transport = reactor.adoptStreamConnection(fd, family, self)
+        os.close(fd)
+        client = transport.protocol
+        if session["state"] == cmn.ACCEPTED:
+            self.clients[client.client_id] = client
+        buf = base64.b64decode(session["buffer"])
+        if len(buf) > 0:
+            client.dataReceived(buf)
+        return client
+
+    def _release_clients(self, clients):
+        """
+        Release the connections of the given clients, so they can be handed over to another process.
+        :param clients: the clients
+        :return: the sessions and the file descriptors of the clients
+        """
+        sessions = []
+        fds = []
+        for client in clients:
+            sessions.append(client.session)
+            client.release()
+            client.handed_over = True
+            self.clients.pop(client.client_id, None)
+            self._num_unflushed += 1
+            fds.append(worker_pool.release_connection(client.transport))
+        return sessions, fds
+
+    def _hand_over_table(self, table):
+        """
+        Hand the clients of the full table over to the worker with the fewest tables.
+        :param table: the table
+        """
+        worker = min(self._workers, key=lambda w: w.num_tables)
+        worker.num_tables += 1
+        table.chat.flush()
+        clients = table.clients.values()
+        sessions, fds = self._release_clients(clients)
+        for client in clients:
+            self._remote_clients[client.client_id] = table
+        table.worker = worker
+        table.remote_ids = [client.client_id for client in clients]
+        table.clients = {}
+        self._pending_hand_overs[table.table_id] = set(table.remote_ids)
+        worker.send_command(worker_pool.HAND_OVER, {"table_id": table.table_id,
+                                                    "num_players": table.game.num_players,
+                                                    "num_rounds": table.game.num_rounds,
+                                                    "chat": table.chat.history, "tournament_key": table.tournament_key,
+                                                    "clients": sessions}, fds)
+        if len(table.spectators) > 0:
+            worker.send_command(worker_pool.WATCH_TABLE, table.table_id)
+        logging.info("Handed table %d over to worker %d.", table.table_id, worker.worker_id)
+
+    def handed_over(self, client):
+        """
+        Start the table in the worker once the output of all its handed over clients was flushed.
+        :param client: the handed over client
+        """
+        self._num_unflushed -= 1
+        if self._is_worker:
+            self._check_drained()
+            return
+        resume = self._pending_resumes.pop(client.client_id, None)
+        if resume is not None:
+            worker, table_id, session, fd = resume
+            worker.send_command(worker_pool.RESUME_CLIENT, {"table_id": table_id, "client": session}, [fd])
+            return
+        table = client.table
+        pending = self._pending_hand_overs[table.table_id]
+        pending.discard(client.client_id)
+        if len(pending) == 0:
+            del self._pending_hand_overs[table.table_id]
+            if table.table_id in self.tables:
+                table.worker.send_command(worker_pool.START_TABLE, table.table_id)
+
+    def remove_client(self, client):
+        """
+        Remove the disconnected client.
+        :param client: the client
+        """
+        if client.client_id in self.clients:
+            del self.clients[client.client_id]
+        self.output.discard(client)
+        if self._is_worker:
+            self._parent.send_command(worker_pool.CLIENT_LEFT, client.client_id)
+        else:
+            self._release_id(client.client_id)
+
+    def _release_remote_client(self, client_id):
+        """
+        Free the id and the username of a client that left while it played in a worker process.
+        Does nothing if the client is no longer remote.
+        :param client_id: the client id
+        """
+        if self._remote_clients.pop(client_id, None) is not None:
+            self._release_id(client_id)
+
+    def _release_id(self, client_id):
+        """
+        Free the id, the username and the resume token of the client.
+        :param client_id: the client id
+        """
+        self.usernames.remove(client_id)
+        self.client_ids.free(client_id)
+        token = self._resume_token_ids.pop(client_id, None)
+        if token is not None:
+            del self._resume_tokens[token]
+
+    def issue_resume_token(self, client):
+        """
+        Create the token that allows the accepted client to resume its session after a disconnect and send it.
+        :param client: the client
+        """
+        if self.resume_timeout is None:
+            return
+        token = os.urandom(16).encode("hex")
+        self._resume_tokens[token] = (client.client_id, client.username)
+        self._resume_token_ids[client.client_id] = token
+        client.send_message(cmn.RESUME_TOKEN, token)
+
+    def resume_session(self, client, username, token):
+        """
+        Give the session with the resume token to the new connection of the client: The connection gets the client id
+        and, if the client sits at a table, the seat. The old connection is closed.
+        :param client: the new connection
+        :param username: the username of the session
+        :param token: the resume token
+        :return: False if the token is invalid, else True
+        """
+        client_id, session_username = self._resume_tokens.get(token, (None, None))
+        if client_id is None or session_username != username:
+            return False
+        old_client = self.clients.get(client_id)
+        if old_client is None and client_id in self._suspended:
+            old_client = self._suspended[client_id][0]
+        remote_table = self._remote_clients.get(client_id)
+        if old_client is None and remote_table is None:
+            return False
+        if remote_table is not None and client.family == "memory":
+            # In-process connections have no socket that could be handed to the worker.
+            return False
+
+        if old_client is not None:
+            self._discard_connection(old_client)
+        client.resume_session(client_id, username)
+        if remote_table is not None:
+            # The game runs in a worker. It gets the connection once the accept message was sent.
+            sessions, fds = self._release_clients([client])
+            self._pending_resumes[client_id] = (remote_table.worker, remote_table.table_id, sessions[0], fds[0])
+        elif old_client.table is not None:
+            self._resume_seat(client, old_client.table)
+        return True
+
+    def _resume_seat(self, client, table):
+        """
+        Give the seat of the client at the table to its new connection and send the state of the table.
+        :param client: the new connection
+        :param table: the table
+        """
+        old_client = table.clients[client.client_id]
+        if old_client is not client:
+            self._discard_connection(old_client)
+        client.table = table
+        table.clients[client.client_id] = client
+        if table.game.started:
+            table.game.resume(client.client_id)
+        else:
+            client.send_message(cmn.JOINED_TABLE, table.table_id)
+
+    def _discard_connection(self, client):
+        """
+        Forget the old connection of a resumed session: A suspended client is no longer suspended, a connected client
+        is closed without any cleanup.
+        :param client: the old connection
+        """
+        if client.replaced:
+            return
+        client.replaced = True
+        suspended = self._suspended.get(client.client_id)
+        if suspended is not None and suspended[0] is client:
+            del self._suspended[client.client_id]
+            suspended[1].cancel()
+        else:
+            self.output.discard(client)
+            client.release()
+            client.transport.abortConnection()
+        if self.clients.get(client.client_id) is client:
+            del self.clients[client.client_id]
+        if client.watching is not None:
+            self.unwatch_table(client)
+
+    def suspend_client(self, client):
+        """
+        Keep the seat of the disconnected client, so it can resume its session.
+        :param client: the disconnected client
+        :return: False if sessions can not be resumed, else True
+        """
+        if self.resume_timeout is None:
+            return False
+        logging.info("Keeping the seat of %s for %d seconds.", client.username, self.resume_timeout)
+        timer = self.timers.schedule(self.resume_timeout, self._suspension_expired, client)
+        self._suspended[client.client_id] = (client, timer)
+        if self.clients.get(client.client_id) is client:
+            del self.clients[client.client_id]
+        self.output.discard(client)
+        return True
+
+    def _suspension_expired(self, client):
+        """
+        Give up the seat of the client that did not resume its session in time.
+        :param client: the disconnected client
+        """
+        logging.info("%s did not come back in time.", client.username)
+        del self._suspended[client.client_id]
+        if client.table is not None:
+            self.leave_table(client)
+        self.remove_client(client)
+
+    def table_list(self):
+        """
+        Return a list with the entries [table id, number of players, number of seated players, started].
+        :return: the table list
+        """
+        return [[t.table_id, t.game.num_players, t.num_seated, t.started] for t in self.tables.values()]
+
+    def create_table(self, num_players=None, num_rounds=None):
+        """
+        Create a new table.
+        :param num_players: the number of players, defaults to the server setting
+        :param num_rounds: the number of rounds, defaults to the server setting
+        :return: the table
+        """
+        if num_players is None:
+            num_players = self._num_players
+            if num_rounds is None:
+                num_rounds = self._num_rounds
+        table_id = self._next_table_id
+        self._next_table_id += 1
+        table = self._new_table(table_id, num_players, num_rounds)
+        self._open_tables[table_id] = table
+        logging.info("Created table %d for %d players.", table_id, num_players)
+        return table
+
+    def _new_table(self, table_id, num_players, num_rounds):
+        """
+        Create the table with its game and add it to the tables.
+        :param table_id: the table id
+        :param num_players: the number of players
+        :param num_rounds: the number of rounds
+        :return: the table
+        """
+        journal_callback = None if self.journal is None else functools.partial(self.journal.append, table_id)
+        game = WizardGame(num_players, num_rounds, functools.partial(self._table_finished, table_id), self.output,
+                          table_id, self.timers, self.turn_time, functools.partial(self._public_message, table_id),
+                          self.clock, journal_callback)
+        table = Table(table_id, game, self.output, self.clock.callLater)
+        self.tables[table_id] = table
+        return table
+
+    def enqueue(self, client, num_players, band):
+        """
+        Put the client into the matchmaking queue. If enough players wait, their table is created and the game starts.
+        Waiting clients are not reaped.
+        :param client: the client
+        :param num_players: the table size
+        :param band: the skill band, None for any skill
+        """
+        matched = self.matchmaking.enqueue(client.client_id, client, num_players, band)
+        if matched is None:
+            self.reaper.untrack(client)
+            expected_wait = self.matchmaking.expected_wait(client.client_id)
+            logging.info("%s waits for a table for %d players.", client.username, num_players)
+            client.send_message(cmn.QUEUED, num_players, self.matchmaking.num_waiting(client.client_id),
+                                -1 if expected_wait is None else int(math.ceil(expected_wait)))
+            return
+        table = self.create_table(num_players, self._num_rounds if num_players == self._num_players else None)
+        logging.info("Matched %d players at table %d.", num_players, table.table_id)
+        for matched_client, waited in matched:
+            MATCHMAKING_SECONDS.child.observe(waited)
+            self.reaper.track(matched_client, cmn.ACCEPTED)
+            self.join_table(matched_client, table)
+
+    def leave_queue(self, client):
+        """
+        Remove the client from the matchmaking queue.
+        :param client: the client
+        """
+        num_players = self.matchmaking.remove(client.client_id)
+        logging.info("%s left the matchmaking queue.", client.username)
+        client.send_message(cmn.LEFT_QUEUE, num_players)
+        self.reaper.track(client, cmn.ACCEPTED)
+
+    def table_state(self, table):
+        """
+        Return the state of the table for the admin console.
+        :param table: the table
+        :return: the state
+        """
+        if table.worker is not None:
+            return "running in worker"
+        if not table.game.started:
+            return "open"
+        return "%s, %s's turn" % (MOVE_STATES[table.game.state], table.game.current_player_username)
+
+    def admin_table(self, table, command, args):
+        """
+        Run the console command for the table. Tables in workers run the command in the worker.
+        :param table: the table
+        :param command: the command, "game" or "profile"
+        :param args: the command arguments
+        :return: deferred with the output
+        """
+        if table.worker is None:
+            return defer.succeed(self._run_admin_command(table, command, args))
+        request_id = self._next_admin_request
+        self._next_admin_request += 1
+        d = defer.Deferred()
+        self._admin_requests[request_id] = (table.worker, d)
+        table.worker.send_command(worker_pool.ADMIN, {"id": request_id, "table_id": table.table_id,
+                                                      "command": command, "args": args})
+        return d
+
+    def _run_admin_command(self, table, command, args):
+        """
+        Run the console command for the table of this process.
+        :param table: the table
+        :param command: the command
+        :param args: the command arguments
+        :return: the output
+        """
+        if command == "game":
+            if not table.game.started:
+                return "The game at table %d did not start yet." % table.table_id
+            dumped = table.game.dump()
+            dumped["usernames"] = [table.clients[i].username for i in dumped["player_ids"]]
+            return json.dumps(dumped, indent=2, sort_keys=True)
+        if args[0] == "start":
+            if table.profiler is None:
+                table.profiler = cProfile.Profile()
+            return "Profiling table %d." % table.table_id
+        if table.profiler is None:
+            return "Table %d is not profiled." % table.table_id
+        out = StringIO.StringIO()
+        pstats.Stats(table.profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        table.profiler = None
+        return out.getvalue()
+
+    def _lobby_members(self):
+        """
+        Return the members of the lobby chat: the accepted clients that do not sit at a table.
+        :return: the clients
+        """
+        return [client for client in self.clients.itervalues() if client.table is None]
+
+    def find_open_table(self):
+        """
+        Return the oldest open table with the default size. If there is none, a new table is created.
+        :return: the table
+        """
+        for table in self._open_tables.itervalues():
+            if table.game.num_players == self._num_players and not table.is_full and table.reserved is None:
+                return table
+        return self.create_table()
+
+    def join_table(self, client, table):
+        """
+        Seat the client at the table and start the game if the table is full.
+        :param client: the client
+        :param table: the table
+        """
+        assert isinstance(client, (ClientConnection, bots.BotPlayer))
+        assert isinstance(table, Table)
+        client.table = table
+        table.clients[client.client_id] = client
+        logging.info("%s joined table %d.", client.username, table.table_id)
+        client.send_message(cmn.JOINED_TABLE, table.table_id)
+        table.chat.send_history(client)
+        table.send_all(cmn.NEW_USER, client.username)
+
+        if table.is_full:
+            del self._open_tables[table.table_id]
+            self._cancel_bot_fill(table)
+            # In-process connections and bots can not be handed over.
+            if len(self._workers) > 0 and all(c.family not in ("memory", "bot") for c in table.clients.itervalues()):
+                self._hand_over_table(table)
+            else:
+                self._start_game(table)
+        elif client.family != "bot":
+            self._schedule_bot_fill(table)
+
+    def _new_bot(self, username=None):
+        """
+        Create a bot.
+        :param username: the username, by default "Bot-" and the number of the bot, which no client can choose
+        :return: the bot
+        """
+        bot_id = next(self._bot_ids)
+        if username is None:
+            username = "Bot-%d" % -bot_id
+        return bots.BotPlayer(bot_id, username, self.bot_pool, TEXT_CODEC, self.clock)
+
+    def _schedule_bot_fill(self, table):
+        """
+        (Re)start the time that the open table waits for players before bots take the empty seats.
+        :param table: the table
+        """
+        if self.bot_fill_time is None:
+            return
+        self._cancel_bot_fill(table)
+        table.bot_fill_timer = self.timers.schedule(self.bot_fill_time, self._fill_with_bots, table)
+
+    def _cancel_bot_fill(self, table):
+        """
+        Stop waiting for players at the table.
+        :param table: the table
+        """
+        if table.bot_fill_timer is not None:
+            table.bot_fill_timer.cancel()
+            table.bot_fill_timer = None
+
+    def _fill_with_bots(self, table):
+        """
+        Seat bots at the open table until it is full, which starts the game.
+        :param table: the table
+        """
+        table.bot_fill_timer = None
+        if self._open_tables.get(table.table_id) is not table:
+            # The table was closed or handed over to a new server process in the meantime.
+            return
+        logging.info("Filling table %d with %d bots.", table.table_id, table.game.num_players - table.num_seated)
+        while not table.is_full:
+            self.join_table(self._new_bot(), table)
+
+    def _replace_with_bot(self, table, client):
+        """
+        Give the seat of the player who left the running game to a bot with the same username, the client views know
+        the players by their usernames. Nothing happens if no other players are left.
+        :param table: the table
+        :param client: the player who left
+        :return: True if a bot took the seat else False
+        """
+        if not self.bot_replace or all(c.family == "bot" for c in table.clients.itervalues()):
+            return False
+        bot = self._new_bot(client.username)
+        bot.table = table
+        table.clients[bot.client_id] = bot
+        if self.journal is not None:
+            self.journal.append(table.table_id, "bot", [bot.client_id, bot.username])
+        table.game.replace_player(client.client_id, bot.client_id)
+        return True
+
+    def _start_game(self, table):
+        """
+        Start the game of the full table. The players and their resume tokens are journaled before the game.
+        :param table: the table
+        """
+        logging.info("Starting the game at table %d.", table.table_id)
+        if self.journal is not None:
+            self.journal.append(table.table_id, "table", {"num_players": table.game.num_players,
+                                                          "num_rounds": table.game.num_rounds,
+                                                          "players": self._journal_players(table)})
+        table.game.start(table.clients)
+
+    def _journal_players(self, table):
+        """
+        Return the players of the table as they are journaled.
+        :param table: the table
+        :return: list with [client id, username, resume token, whether the player is a bot]
+        """
+        return [[client_id, client.username, self._resume_token_ids.get(client_id), client.family == "bot"]
+                for client_id, client in table.clients.iteritems()]
+
+    def _journal_snapshot(self):
+        """
+        Return the snapshot of all started tables for the journal.
+        :return: dict with the next table id and the tables with their players and game states
+        """
+        tables = [{"table_id": table.table_id, "num_players": table.game.num_players,
+                   "num_rounds": table.game.num_rounds, "players": self._journal_players(table),
+                   "game": table.game.dump()}
+                  for table in self.tables.itervalues() if table.game.started]
+        return {"next_table_id": self._next_table_id, "tables": tables}
+
+    def recover_journal(self):
+        """
+        Rebuild the started tables from the newest snapshot and the following records of the journal, then start a new
+        journal segment. The players of the recovered tables are disconnected until they resume their sessions.
+        """
+        start = timeit.default_timer()
+        players = {}  # table id => the journaled players
+        for table_id, kind, data in self.journal.recover():
+            if kind == journal.SNAPSHOT:
+                self._next_table_id = data["next_table_id"]
+                for entry in data["tables"]:
+                    table = self._new_table(entry["table_id"], entry["num_players"], entry["num_rounds"])
+                    table.game.load(entry["game"], {})
+                    players[table.table_id] = entry["players"]
+            elif kind == "table":
+                self._new_table(table_id, data["num_players"], data["num_rounds"])
+                self._next_table_id = max(self._next_table_id, table_id+1)
+                players[table_id] = data["players"]
+            elif kind == "close":
+                del self.tables[table_id]
+                del players[table_id]
+            elif kind == "bot":
+                players[table_id].append([data[0], data[1], None, True])
+            else:
+                self.tables[table_id].game.apply(kind, data)
+        for table_id, table_players in players.iteritems():
+            self._recover_table(self.tables[table_id], table_players)
+        if len(players) > 0:
+            logging.info("Recovered %d tables from the journal in %.2f seconds.",
+                         len(self.tables), timeit.default_timer() - start)
+        self.journal.start(self._journal_snapshot)
+
+    def _recover_table(self, table, players):
+        """
+        Seat the players at the recovered table and suspend them, so they can resume their sessions. The players get
+        new client ids, their resume tokens stay the same. The bots are created again.
+        :param table: the table
+        :param players: the journaled players
+        """
+        game = table.game
+        if not game.started:
+            # The journal ended before the first round.
+            del self.tables[table.table_id]
+            return
+        dumped = game.dump()
+        client_ids = {}
+        for entry in players:
+            old_id, username, token = entry[:3]
+            username = str(username)
+            if old_id not in dumped["player_ids"]:
+                # The player left and a bot took the seat.
+                continue
+            if len(entry) > 3 and entry[3]:
+                bot = self._new_bot(username)
+                client_ids[old_id] = bot.client_id
+                bot.table = table
+                table.clients[bot.client_id] = bot
+                continue
+            client_id = self.client_ids.allocate()
+            client_ids[old_id] = client_id
+            self.usernames.add(username, client_id)
+            if token is not None:
+                self._resume_tokens[str(token)] = (client_id, username)
+                self._resume_token_ids[client_id] = str(token)
+            client = ClientConnection(self, "0.0.0.0", 0, {"id": client_id, "username": username,
+                                                           "state": cmn.ACCEPTED, "binary": False,
+                                                           "binary_requested": False, "buffer": ""})
+            client.makeConnection(DetachedTransport())
+            client.table = table
+            table.clients[client_id] = client
+        dumped["player_ids"] = [client_ids[i] for i in dumped["player_ids"]]
+        game.load(dumped, table.clients)
+        for client in table.clients.values():
+            if client.family != "bot":
+                client.connectionLost()
+        if table.table_id in self.tables:
+            game.continue_game()
+
+    def watch_table(self, client, table):
+        """
+        Add the client as spectator to the table. Spectators are not reaped while they watch.
+        :param client: the client
+        :param table: the table
+        """
+        client.watching = table
+        self.reaper.untrack(client)
+        logging.info("%s watches table %d.", client.username, table.table_id)
+        client.send_message(cmn.WATCHING_TABLE, table.table_id)
+        table.add_spectator(client)
+
+    def unwatch_table(self, client):
+        """
+        Remove the spectator from the table it watches.
+        :param client: the client
+        """
+        table = client.watching
+        client.watching = None
+        table.remove_spectator(client)
+        logging.info("%s stopped watching table %d.", client.username, table.table_id)
+
+    def _close_spectators(self, table):
+        """
+        Send the spectators of the closed table back to the lobby.
+        :param table: the table
+        """
+        for client in table.remove_spectators():
+            self.reaper.track(client, cmn.ACCEPTED)
+
+    def _public_message(self, table_id, msg_id, fields):
+        """
+        Pass the public message of the game to the spectators of the table and to the tournament. A worker forwards
+        the message to the server process if the table is watched, and the start and the round points of tournament
+        games.
+        :param table_id: the table id
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        table = self.tables.get(table_id)
+        if table is None:
+            return
+        if self._is_worker:
+            if table.watched or (table.tournament_key is not None and msg_id in (cmn.START_GAME, cmn.MADE_POINTS)):
+                self._parent.send_command(worker_pool.PUBLIC_MESSAGE,
+                                          {"table_id": table_id, "msg_id": msg_id, "fields": fields})
+        else:
+            table.send_public(msg_id, fields)
+            self._tournament_message(table, msg_id, fields)
+
+    def leave_table(self, client):
+        """
+        Remove the client from its table. If the game is running, the table is closed unless a bot takes the seat. An
+        open table is closed once only bots are left, unless it belongs to a tournament.
+        :param client: the client
+        """
+        assert isinstance(client, ClientConnection)
+        table = client.table
+        client.table = None
+        del table.clients[client._id]
+        logging.info("%s left table %d.", client.username, table.table_id)
+        table.send_all(cmn.USER_LEFT, client.username)
+        if table.game.started:
+            if not self._replace_with_bot(table, client):
+                self.close_table(table)
+        elif table.tournament_key is None and all(c.family == "bot" for c in table.clients.itervalues()):
+            # Tournament tables wait for their players.
+            self.close_table(table)
+
+    def close_table(self, table):
+        """
+        Close the table and move the remaining clients back to the lobby.
+        :param table: the table
+        """
+        assert isinstance(table, Table)
+        logging.info("Closing table %d.", table.table_id)
+        table.game.stop()
+        self._cancel_bot_fill(table)
+        if self.journal is not None and table.game.started:
+            self.journal.append(table.table_id, "close", None)
+        table.chat.flush()
+        table.send_all(cmn.TABLE_CLOSED, table.table_id)
+        self._close_spectators(table)
+        clients = []
+        for client in table.clients.values():
+            client.table = None
+            if client.family == "bot":
+                client.stop()
+                continue
+            suspended = self._suspended.pop(client.client_id, None)
+            if suspended is not None:
+                # The disconnected client has nothing to come back to.
+                suspended[1].cancel()
+                self.remove_client(client)
+            else:
+                clients.append(client)
+        table.clients = {}
+        del self.tables[table.table_id]
+        if table.table_id in self._open_tables:
+            del self._open_tables[table.table_id]
+
+        # Workers return the remaining clients to the lobby of the server process.
+        if self._is_worker:
+            sessions, fds = self._release_clients(clients)
+            self._parent.send_command(worker_pool.RETURN_CLIENTS, {"table_id": table.table_id, "clients": sessions}, fds)
+            self._check_drained()
+        else:
+            self._tournament_table_closed(table)
+            for client in clients:
+                self.seat_tournament_player(client)
+
+    def _table_finished(self, table_id):
+        """
+        Record the result and close the table after its game is over.
+        :param table_id: the table id
+        """
+        table = self.tables[table_id]
+        self._record_result(table.game.result())
+        self.close_table(table)
+
+    def _record_result(self, result):
+        """
+        Store the result of a finished game. Workers pass their results to the server process.
+        :param result: the result, see WizardGame.result
+        """
+        if self._is_worker:
+            self._parent.send_command(worker_pool.GAME_RESULT, result)
+        elif self.stats is not None:
+            self.stats.record(result)
+
+    def run_tournament(self, game_tournament, checkpoint):
+        """
+        Run the tournament. A tournament from a checkpoint continues its current round: Games that were recovered from
+        the journal keep running, the other unfinished games of the round are played again.
+        :param game_tournament: the tournament
+        :param checkpoint: the checkpoint of the tournament
+        """
+        self.tournament = game_tournament
+        self._tournament_checkpoint = checkpoint
+        for key, entry in enumerate(game_tournament.tables):
+            if entry["finished"]:
+                continue
+            table = self.tables.get(entry["table_id"])
+            if table is not None and table.game.started:
+                table.tournament_key = key
+                table.reserved = set(player.lower() for player in entry["players"])
+                result = table.game.result()
+                game_tournament.game_started(key, [player["username"] for player in result["players"]])
+                game_tournament.set_points(key, dict((player["username"], sum(player["points"]))
+                                                     for player in result["players"]))
+            else:
+                logging.info("Playing the game of %s again.", ", ".join(entry["players"]))
+                game_tournament.set_points(key, {})
+                self._open_tournament_table(key)
+        logging.info("Running tournament '%s' with %d players.", game_tournament.name, len(game_tournament.players))
+        self._continue_tournament()
+
+    def _continue_tournament(self):
+        """
+        Pair the next round of the tournament once the current round is finished.
+        """
+        game_tournament = self.tournament
+        while game_tournament.round_finished:
+            if game_tournament.finished:
+                logging.info("Tournament '%s' is finished, the winner is %s.",
+                             game_tournament.name, game_tournament.standings()[0][0])
+                break
+            tables = game_tournament.next_round()
+            logging.info("Round %d of %d of tournament '%s' with %d tables.",
+                         game_tournament.round, game_tournament.num_rounds, game_tournament.name, len(tables))
+            for key in xrange(len(tables)):
+                self._open_tournament_table(key)
+        self._tournament_checkpoint.write()
+
+    def _open_tournament_table(self, key):
+        """
+        Open the table of the current tournament round and seat its players who are in the lobby.
+        :param key: the index of the table in the round
+        """
+        entry = self.tournament.tables[key]
+        table = self.create_table(len(entry["players"]), self.tournament.game_rounds)
+        table.tournament_key = key
+        table.reserved = set(player.lower() for player in entry["players"])
+        entry["table_id"] = table.table_id
+        entry["seats"] = None
+        for player in entry["players"]:
+            client = self.clients.get(self.usernames.client_id(player))
+            if client is not None:
+                self.seat_tournament_player(client)
+        if table.table_id in self._open_tables and len(table.clients) == 0:
+            self._schedule_bot_fill(table)
+
+    def seat_tournament_player(self, client):
+        """
+        Seat the client at its open tournament table if it is in the lobby. Spectators stop watching and waiting
+        clients leave the matchmaking queue.
+        :param client: the client
+        """
+        if self.tournament is None or client.table is not None:
+            return
+        username = client.username.lower()
+        for table in self._open_tables.itervalues():
+            if table.reserved is not None and username in table.reserved:
+                break
+        else:
+            return
+        if client.watching is not None:
+            self.unwatch_table(client)
+        if client.client_id in self.matchmaking:
+            self.leave_queue(client)
+        self.join_table(client, table)
+
+    def _tournament_message(self, table, msg_id, fields):
+        """
+        Take the seat order and the round points of a tournament game from its public messages.
+        :param table: the table
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        if self.tournament is None or table.tournament_key is None:
+            return
+        if msg_id == cmn.START_GAME:
+            self.tournament.game_started(table.tournament_key, fields[0])
+        elif msg_id == cmn.MADE_POINTS:
+            self.tournament.add_points(table.tournament_key, fields[0])
+            self._tournament_checkpoint.changed()
+
+    def _tournament_table_closed(self, table):
+        """
+        Mark the closed table in the tournament and pair the next round if it was the last table of the round.
+        :param table: the table
+        """
+        if self.tournament is None or table.tournament_key is None:
+            return
+        self.tournament.close_table(table.tournament_key)
+        table.tournament_key = None
+        if self.tournament.round_finished:
+            self._continue_tournament()
+        else:
+            self._tournament_checkpoint.changed()
+
+    def tournament_status(self):
+        """
+        Return the state of the tournament for the admin console.
+        :return: list with the lines of the round and the standings
+        """
+        game_tournament = self.tournament
+        if game_tournament is None:
+            return ["No tournament is running."]
+        num_closed = sum(1 for entry in game_tournament.tables if entry["finished"])
+        lines = ["Tournament '%s' (%s): round %d of %d, %d of %d tables closed" %
+                 (game_tournament.name, game_tournament.pairing, game_tournament.round, game_tournament.num_rounds,
+                  num_closed, len(game_tournament.tables))]
+        lines.extend("%4d. %-16s %8d" % (rank, player, points)
+                     for rank, (player, points) in enumerate(game_tournament.standings(), 1))
+        return lines
+
+    def send_history(self, client, username):
+        """
+        Send the recent games of the user to the client once they are looked up.
+        :param client: the client
+        :param username: the username
+        """
+        if self.stats is None:
+            client.send_message(cmn.NO_STATISTICS, cmn.GET_HISTORY)
+            return
+        d = self.stats.history(username)
+        d.addCallback(lambda games: self._send_lookup(client, cmn.PLAYER_HISTORY, username, games))
+        d.addErrback(self._lookup_failed, client, cmn.GET_HISTORY)
+
+    def send_top_players(self, client):
+        """
+        Send the players with the most points to the client once they are looked up.
+        :param client: the client
+        """
+        if self.stats is None:
+            client.send_message(cmn.NO_STATISTICS, cmn.GET_TOP_PLAYERS)
+            return
+        d = self.stats.top()
+        d.addCallback(lambda players: self._send_lookup(client, cmn.TOP_PLAYERS, players))
+        d.addErrback(self._lookup_failed, client, cmn.GET_TOP_PLAYERS)
+
+    def _send_lookup(self, client, msg_id, *fields):
+        """
+        Send the result of a lookup, unless the client disconnected or moved to another process in the meantime.
+        :param client: the client
+        :param msg_id: the message id
+        :param fields: the message fields
+        """
+        if self.clients.get(client.client_id) is client and not client.handed_over:
+            client.send_message(msg_id, *fields)
+
+    def _lookup_failed(self, failure, client, msg_id):
+        """
+        Log the failed lookup and tell the client that there are no statistics.
+        :param failure: the failure
+        :param client: the client
+        :param msg_id: the message id of the request
+        """
+        logging.error("Could not look up the statistics: %s", failure.getErrorMessage())
+        self._send_lookup(client, cmn.NO_STATISTICS, msg_id)
 
 
 parser = argparse.ArgumentParser(description="Wizard cardgame - Server")
 parser.add_argument("--port", type=int, required=True,
                     help="listen port for incoming connections")
 parser.add_argument("-n", "--num_players", type=int, required=True,
-                    help="number of players")
+                    help="number of players at tables that are opened by a quick join")
 parser.add_argument("-k", "--num_rounds", type=int, default=None,
-                    help="number of rounds, default: floor(60/num_players)")
+                    help="number of rounds at tables that are opened by a quick join, default: floor(60/num_players)")
 parser.add_argument("-v", "--verbose", action="count", default=0,
                     help="show verbose output")
 parser.add_argument("--debug", action="store_true",
                     help="show debug output")
+parser.add_argument("--log_sample_tables", type=int, default=1,
+                    help="only write the debug output of every n-th table")
+parser.add_argument("--log_thread", action="store_true",
+                    help="write the log in a background thread")
+parser.add_argument("--high_water", type=int, default=64,
+                    help="send buffer size in KiB per client before the client is considered lagging, default: 64")
+parser.add_argument("--lag_grace_period", type=float, default=10.0,
+                    help="seconds a lagging client may stay above the high-water mark before it is disconnected, "
+                         "default: 10")
+parser.add_argument("--turn_time", type=float, default=60.0,
+                    help="seconds per move before the server moves for the player, 0 means no limit, default: 60")
+parser.add_argument("--handshake_timeout", type=float, default=10.0,
+                    help="seconds a new connection may take to finish the handshake, 0 means no limit, default: 10")
+parser.add_argument("--idle_timeout", type=float, default=900.0,
+                    help="seconds an accepted client may stay silent before it is disconnected, 0 means no limit, "
+                         "default: 900")
+parser.add_argument("--resume_timeout", type=float, default=120.0,
+                    help="seconds the seat of a disconnected player is kept, so the player can resume the game, 0 "
+                         "disables resuming, default: 120")
+parser.add_argument("--metrics_port", type=int, default=None,
+                    help="serve the metrics on http://127.0.0.1:PORT/metrics, default: no metrics endpoint")
+parser.add_argument("--backend", choices=["twisted", "asyncio"], default="twisted",
+                    help="the event loop, asyncio runs on the deprecated trollius package and only serves plain TCP "
+                         "games, the features that need the Twisted reactor are refused, default: twisted")
+parser.add_argument("--upgrade_socket", type=str, default=None,
+                    help="path of a UNIX socket for upgrades: a new server that is started with the same path takes "
+                         "over the listening socket and the lobby, the started games are finished by the old server")
+parser.add_argument("--journal", type=str, default=None,
+                    help="directory of a journal of the started games, the games are recovered from the journal at "
+                         "startup and the players get their seats back when they resume their sessions")
+parser.add_argument("--journal_fsync_interval", type=float, default=0.1,
+                    help="seconds between two group commits of the journal, default: 0.1")
+parser.add_argument("--journal_snapshot_interval", type=float, default=60.0,
+                    help="seconds between two snapshots of all tables in the journal, default: 60")
+parser.add_argument("--stats_db", type=str, default=None,
+                    help="path of a SQLite database where the results of the finished games are stored, the clients "
+                         "can look up the history of a player and the top players")
+parser.add_argument("--stats_batch_interval", type=float, default=1.0,
+                    help="seconds between two batched writes of the game results, default: 1")
+parser.add_argument("--chat_rate", type=float, default=1.0,
+                    help="chat messages per second and client, default: 1")
+parser.add_argument("--chat_burst", type=int, default=5,
+                    help="chat messages a client may send at once before the rate limit applies, default: 5")
+parser.add_argument("--admin_socket", type=str, default=None,
+                    help="path of a UNIX socket for the admin console, e. g. for socat - UNIX-CONNECT:PATH")
+parser.add_argument("--listen", type=str, action="append", default=[], metavar="ADDRESS",
+                    help="additional address for the clients, tcp:[HOST:]PORT or unix:PATH, may be repeated, e. g. "
+                         "unix:/tmp/wizard.sock for bots on the same host")
+parser.add_argument("--bot_fill_time", type=float, default=0.0,
+                    help="seconds an open table waits for players before bots take the empty seats, 0 means never, "
+                         "default: 0")
+parser.add_argument("--bot_replace", action="store_true",
+                    help="a bot takes the seat of a player who leaves a running game instead of closing the table")
+parser.add_argument("--bot_think_time", type=float, default=1.0,
+                    help="seconds a bot may think about a move, default: 1")
+parser.add_argument("--bot_processes", type=int, default=2,
+                    help="number of processes that decide the moves of the bots, each worker has its own, default: 2")
+parser.add_argument("--tournament", type=str, default=None, metavar="CONFIG",
+                    help="run the tournament of the json file CONFIG with the usernames of the players and optionally "
+                         "name, pairing (swiss or round_robin), rounds, table_size and game_rounds, the progress is "
+                         "checkpointed to CONFIG.checkpoint and resumed after a restart; the running games only "
+                         "continue with --journal, which can not be combined with --workers, else the unfinished games "
+                         "of the round are played again")
+parser.add_argument("--workers", type=int, default=0,
+                    help="number of worker processes that run the games, default: run the games in the server process")
+parser.add_argument("--worker_fd", type=int, default=None,
+                    help=argparse.SUPPRESS)
+
+
+def _worker_argv(argv):
+    """
+    Return the command line of the worker processes: the server command line without the --workers option.
+    :param argv: the server command line
+    :return: the worker command line
+    """
+    worker_argv = [os.path.abspath(argv[0])]
+    skip = False
+    for arg in argv[1:]:
+        if skip:
+            skip = False
+        elif arg == "--workers":
+            skip = True
+        elif not arg.startswith("--workers="):
+            worker_argv.append(arg)
+    return worker_argv
 
 
 def main(args):
     """
-    Set the logging level and start the reactor loop.
+    Set the logging level and start the event loop.
     :param args: command line arguments
     """
     # Set the logging level and create the logger.
@@ -622,17 +3013,116 @@ def main(args):
         logging_level = logging.DEBUG
     logging_handler = logging.StreamHandler(sys.stdout)
     logging_handler.setFormatter(cmn.ColoredFormatter())
-    logging.root.addHandler(logging_handler)
-    logging.root.setLevel(logging_level)
+    log_listener = log.configure(logging_handler, logging_level, args.log_sample_tables, args.log_thread)
 
     # Check the number of players.
-    assert args.num_players > 0
-
-    # Start the reactor.
-    reactor.listenTCP(args.port, ClientConnector(WizardGame(args.num_players, args.num_rounds)))
+    assert 0 < args.num_players <= cmn.MAX_NUM_PLAYERS
+
+    # The chat rate limit needs a positive rate and room for at least one message.
+    if args.chat_rate <= 0 or args.chat_burst < 1:
+        parser.error("--chat_rate must be greater than 0 and --chat_burst at least 1.")
+
+    # The old server of an upgrade runs its remaining games like a worker, it can not have workers of its own.
+    if args.upgrade_socket is not None and args.workers > 0:
+        parser.error("--upgrade_socket can not be combined with --workers.")
+
+    # The journal holds the games of this process, the players of recovered games come back by resuming the session.
+    if args.journal is not None:
+        if args.workers > 0 or args.upgrade_socket is not None:
+            parser.error("--journal can not be combined with --workers or --upgrade_socket.")
+        if args.resume_timeout <= 0:
+            parser.error("--journal needs a --resume_timeout greater than 0.")
+
+    # The tournament tables are reserved in the server process, an upgrade would drop them.
+    if args.tournament is not None and args.upgrade_socket is not None:
+        parser.error("--tournament can not be combined with --upgrade_socket.")
+
+    # In-process connections only exist for servers that are embedded in another program, e. g. the benchmark.
+    for address in args.listen:
+        try:
+            if transports.parse_address(address)[0] == "memory":
+                parser.error("--listen does not accept memory addresses.")
+        except ValueError as ex:
+            parser.error(str(ex))
+
+    # The asyncio backend runs the same connections and games, the timers use the clock of the asyncio loop. The
+    # features that use the Twisted reactor directly (processes, UNIX sockets, the web server, threads) are not ported.
+    use_bots = args.bot_fill_time > 0 or args.bot_replace
+    loop = None
+    clock = reactor
+    if args.backend == "asyncio":
+        if args.workers > 0 or args.metrics_port is not None or args.upgrade_socket is not None or \
+                args.stats_db is not None or args.admin_socket is not None or len(args.listen) > 0 or use_bots:
+            parser.error("--workers, --metrics_port, --upgrade_socket, --stats_db, --admin_socket, --listen and the bots "
+                         "need the twisted backend.")
+        loop = asyncio_backend.new_event_loop()
+        clock = asyncio_backend.Clock(loop)
+
+    # The bot processes are forked before the process opens any sockets.
+    bot_pool = None
+    if use_bots:
+        if args.bot_think_time <= 0 or args.bot_processes <= 0:
+            parser.error("--bot_think_time and --bot_processes must be greater than 0.")
+        bot_pool = bots.BotPool(args.bot_processes, args.bot_think_time)
+
+    game_journal = None
+    if args.journal is not None:
+        game_journal = journal.Journal(args.journal, args.journal_fsync_interval, args.journal_snapshot_interval, clock)
+    # Workers pass the results to the server process, which is the only writer of the statistics.
+    stats_store = None
+    if args.stats_db is not None and args.worker_fd is None:
+        stats_store = stats.StatsStore(args.stats_db, args.stats_batch_interval)
+    connector = ClientConnector(args.num_players, args.num_rounds, args.high_water*1024, args.lag_grace_period,
+                                args.turn_time if args.turn_time > 0 else None, args.handshake_timeout,
+                                args.idle_timeout, args.resume_timeout if args.resume_timeout > 0 else None, clock,
+                                game_journal, stats_store, args.chat_rate, args.chat_burst, bot_pool,
+                                args.bot_fill_time if args.bot_fill_time > 0 else None, args.bot_replace)
+    if game_journal is not None:
+        connector.recover_journal()
+    if args.tournament is not None and args.worker_fd is None:
+        checkpoint = tournament.Checkpoint(args.tournament + ".checkpoint", lambda: connector.tournament.dump(),
+                                           clock=clock)
+        try:
+            with open(args.tournament) as f:
+                config = json.load(f)
+            state = checkpoint.read()
+            game_tournament = tournament.Tournament.from_config(config) if state is None else \
+                tournament.Tournament.load(state)
+        except (IOError, ValueError, KeyError) as ex:
+            parser.error("Invalid tournament %s: %s" % (args.tournament, ex))
+        connector.run_tournament(game_tournament, checkpoint)
+    if args.worker_fd is not None:
+        # Run as worker process: The games are handed over by the server process.
+        connector.connect_parent(args.worker_fd)
+        if args.metrics_port is not None:
+            connector.report_metrics()
+    elif loop is None:
+        # Start the worker processes and listen for incoming connections or take over from the running server.
+        assert args.workers >= 0
+        for process, fd in worker_pool.spawn_workers(args.workers, _worker_argv(sys.argv)):
+            connector.add_worker(fd)
+        if args.upgrade_socket is None or not connector.take_over(args.port, args.metrics_port, args.upgrade_socket,
+                                                                  args.admin_socket, args.listen):
+            connector.listen(reactor.listenTCP(args.port, connector), args.metrics_port, args.upgrade_socket,
+                             args.admin_socket, args.listen)
+
+    # Start the event loop.
     logging.info("Server is running.")
-    reactor.run()
+    if loop is None:
+        reactor.run()
+    else:
+        asyncio_backend.serve(loop, connector, args.port)
+    if game_journal is not None:
+        game_journal.stop()
+    if stats_store is not None:
+        stats_store.close()
+    if bot_pool is not None:
+        bot_pool.close()
+    if HANDLERS.profile:
+        HANDLERS.log_profile()
     logging.info("Shutdown successful.")
+    if log_listener is not None:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
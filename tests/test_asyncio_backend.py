@@ -0,0 +1,66 @@
+import logging
+import unittest
+import core.asyncio_backend as asyncio_backend
+import server
+
+asyncio = asyncio_backend.asyncio
+
+
+if asyncio is not None:
+    class Client(asyncio.Protocol):
+        """
+        Answers the handshake with the given line and records everything the server sends until it closes the
+        connection.
+        """
+
+        def __init__(self, answer, closed):
+            self.answer = answer
+            self.closed = closed
+            self.data = ""
+            self.transport = None
+
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def data_received(self, data):
+            if self.data.find("\r\n") < 0 <= (self.data + data).find("\r\n"):
+                self.transport.write(self.answer + "\r\n")
+            self.data += data
+
+        def connection_lost(self, exc):
+            self.closed.set_result(self.data)
+
+
+@unittest.skipIf(asyncio is None, "The asyncio backend needs the trollius package.")
+class AsyncioBackendTest(unittest.TestCase):
+    """
+    Runs the server on an asyncio loop with a TCP port on localhost.
+    """
+
+    def setUp(self):
+        logging.disable(logging.WARNING)  # the refused handshakes are logged
+        self.loop = asyncio_backend.new_event_loop()
+        self.connector = server.ClientConnector(3, 2, clock=asyncio_backend.Clock(self.loop))
+        self.server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: asyncio_backend.Protocol(self.connector), "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        logging.disable(logging.NOTSET)
+
+    def _connect(self, answer):
+        closed = asyncio.Future(loop=self.loop)
+        self.loop.run_until_complete(self.loop.create_connection(lambda: Client(answer, closed), "127.0.0.1",
+                                                                 self.port))
+        return self.loop.run_until_complete(asyncio.wait_for(closed, 10, loop=self.loop))
+
+    def test_bad_handshake(self):
+        data = self._connect("nonsense")
+        self.assertIn("Your are not a wizard cardgame client.", data)
+
+
+if __name__ == "__main__":
+    unittest.main()
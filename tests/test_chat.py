@@ -0,0 +1,75 @@
+import unittest
+from twisted.internet.task import Clock
+import core.common as cmn
+from core.chat import ChatChannel, TokenBucket
+
+
+class Output(object):
+    """
+    Records the broadcasts instead of sending them.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def broadcast(self, connections, msg_id, fields, table_id=None):
+        assert msg_id == cmn.CHAT_MESSAGES
+        self.batches.append(fields[0])
+
+
+class Member(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, msg_id, *fields):
+        self.messages.append((msg_id, fields))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_and_refill(self):
+        clock = Clock()
+        bucket = TokenBucket(2.0, 3, clock)
+        self.assertEqual([bucket.consume() for _ in xrange(4)], [True, True, True, False])
+        self.assertAlmostEqual(bucket.wait_time(), 0.5)
+        clock.advance(0.5)
+        self.assertTrue(bucket.consume())
+        clock.advance(10)
+        self.assertEqual([bucket.consume() for _ in xrange(4)], [True, True, True, False])
+
+
+class ChatChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.output = Output()
+        self.channel = ChatChannel(lambda: [], self.output, history_size=5, interval=0.1,
+                                   call_later=self.clock.callLater)
+
+    def test_messages_of_an_interval_are_sent_together(self):
+        self.channel.post("a", "hi")
+        self.channel.post("b", "hello")
+        self.assertEqual(self.output.batches, [])
+        self.clock.advance(0.1)
+        self.assertEqual(self.output.batches, [[["a", "hi"], ["b", "hello"]]])
+
+    def test_no_message_is_dropped(self):
+        for i in xrange(12):
+            self.channel.post("a", str(i))
+        self.clock.advance(0.1)
+        self.assertEqual([len(batch) for batch in self.output.batches], [5, 5, 2])
+        self.assertEqual([text for batch in self.output.batches for _, text in batch], [str(i) for i in xrange(12)])
+
+    def test_history(self):
+        for i in xrange(7):
+            self.channel.post("a", str(i))
+        self.channel.flush()
+        self.assertEqual([text for _, text in self.channel.history], [str(i) for i in xrange(2, 7)])
+        member = Member()
+        self.channel.send_history(member)
+        self.assertEqual(member.messages, [(cmn.CHAT_MESSAGES, (self.channel.history,))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from core.client_index import IdAllocator, UsernameIndex
+
+
+class IdAllocatorTest(unittest.TestCase):
+
+    def test_allocates_all_ids_once(self):
+        allocator = IdAllocator(100)
+        ids = [allocator.allocate() for _ in xrange(100)]
+        self.assertEqual(sorted(ids), range(100))
+        self.assertEqual(allocator.num_free, 0)
+        self.assertRaises(IndexError, allocator.allocate)
+
+    def test_freed_ids_come_back(self):
+        allocator = IdAllocator(10)
+        ids = [allocator.allocate() for _ in xrange(10)]
+        allocator.free(ids[3])
+        allocator.free(ids[7])
+        self.assertEqual(sorted([allocator.allocate(), allocator.allocate()]), sorted([ids[3], ids[7]]))
+
+    def test_dump_and_load(self):
+        allocator = IdAllocator(50)
+        for _ in xrange(20):
+            allocator.allocate()
+        allocator.free(allocator.allocate())
+        copy = IdAllocator(50)
+        copy.load(allocator.dump())
+        self.assertEqual(copy.num_free, allocator.num_free)
+        self.assertEqual(sorted(copy.allocate() for _ in xrange(copy.num_free)),
+                         sorted(allocator.allocate() for _ in xrange(allocator.num_free)))
+
+
+class UsernameIndexTest(unittest.TestCase):
+
+    def test_usernames_are_case_insensitive(self):
+        index = UsernameIndex()
+        self.assertTrue(index.add("Alice", 1))
+        self.assertFalse(index.add("alice", 2))
+        self.assertIn("ALICE", index)
+        self.assertEqual(index.client_id("aLiCe"), 1)
+
+    def test_remove(self):
+        index = UsernameIndex()
+        index.add("alice", 1)
+        index.remove(1)
+        index.remove(1)
+        self.assertEqual(len(index), 0)
+        self.assertTrue(index.add("Alice", 2))
+
+    def test_dump_and_load(self):
+        index = UsernameIndex()
+        index.add("alice", 1)
+        index.add("Bob", 2)
+        copy = UsernameIndex()
+        copy.load(index.dump())
+        self.assertEqual(copy.client_id("bob"), 2)
+        self.assertEqual(len(copy), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+from twisted.internet.task import Clock
+import core.journal as journal
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        records = [(None, journal.SNAPSHOT, {"tables": []}), (3, "card", "H7"), (3, "close", None)]
+        data = "".join(journal.encode_record(*record) for record in records)
+        self.assertEqual(list(journal.decode_records(data)), records)
+
+    def test_torn_record_ends_segment(self):
+        data = journal.encode_record(1, "trump", "H") + journal.encode_record(1, "card", "H7")
+        for end in xrange(len(data) - 1, len(data) // 2, -1):
+            self.assertEqual(len(list(journal.decode_records(data[:end]))), 1)
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = Clock()
+        self.tables = {"tables": [1, 2]}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _journal(self, fsync_interval=0.1):
+        return journal.Journal(self.directory, fsync_interval, 60.0, self.clock)
+
+    def test_recover_snapshot_and_records(self):
+        j = self._journal()
+        self.assertEqual(j.recover(), [])
+        j.start(lambda: self.tables)
+        j.append(1, "trump", "H")
+        self.clock.advance(0.1)
+        j.append(2, "card", "S2")
+        j.stop()
+        records = self._journal().recover()
+        self.assertEqual(records, [(None, journal.SNAPSHOT, self.tables), (1, "trump", "H"), (2, "card", "S2")])
+
+    def test_group_commit(self):
+        j = self._journal()
+        j.start(lambda: self.tables)
+        j.append(1, "trump", "H")
+        j.append(1, "tricks", 2)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 2)  # the snapshot loop and one commit
+        j.stop()
+        self.assertEqual(len(self._journal().recover()), 3)
+
+    def test_snapshot_starts_new_segment(self):
+        j = self._journal()
+        j.start(lambda: self.tables)
+        j.append(1, "trump", "H")
+        self.tables = {"tables": [2]}
+        self.clock.advance(60.0)
+        j.append(2, "card", "S2")
+        j.stop()
+        self.assertEqual(os.listdir(self.directory), ["00000002.journal"])
+        self.assertEqual(self._journal().recover(), [(None, journal.SNAPSHOT, self.tables), (2, "card", "S2")])
+
+    def test_torn_snapshot_uses_previous_segment(self):
+        j = self._journal()
+        j.start(lambda: self.tables)
+        j.append(1, "trump", "H")
+        j.stop()
+        with open(os.path.join(self.directory, "00000002.journal"), "wb") as f:
+            f.write(journal.encode_record(None, journal.SNAPSHOT, self.tables)[:10])
+        self.assertEqual(self._journal().recover(), [(None, journal.SNAPSHOT, self.tables), (1, "trump", "H")])
+
+
+if __name__ == "__main__":
+    unittest.main()
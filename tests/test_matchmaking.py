@@ -0,0 +1,48 @@
+import unittest
+from twisted.internet.task import Clock
+from core.matchmaking import MatchmakingQueue
+
+
+class MatchmakingQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.queue = MatchmakingQueue(smoothing=0.5, clock=self.clock)
+
+    def test_full_bucket_forms_table(self):
+        self.assertIsNone(self.queue.enqueue(1, "a", 3))
+        self.clock.advance(2)
+        self.assertIsNone(self.queue.enqueue(2, "b", 3))
+        self.assertEqual(self.queue.num_waiting(2), 2)
+        self.clock.advance(1)
+        self.assertEqual(self.queue.enqueue(3, "c", 3), [("a", 3), ("b", 1), ("c", 0)])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_buckets_are_separate(self):
+        self.queue.enqueue(1, "a", 2, band=1)
+        self.queue.enqueue(2, "b", 2, band=2)
+        self.queue.enqueue(3, "c", 3, band=1)
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual(self.queue.key(1), (2, 1))
+        self.assertEqual([client for client, _ in self.queue.enqueue(4, "d", 2, band=2)], ["b", "d"])
+
+    def test_remove(self):
+        self.queue.enqueue(1, "a", 2)
+        self.assertEqual(self.queue.remove(1), 2)
+        self.assertIsNone(self.queue.remove(1))
+        self.assertNotIn(1, self.queue)
+        self.assertIsNone(self.queue.enqueue(2, "b", 2))
+
+    def test_expected_wait(self):
+        self.queue.enqueue(1, "a", 4)
+        self.assertIsNone(self.queue.expected_wait(1))
+        self.clock.advance(4)
+        self.queue.enqueue(2, "b", 4)
+        self.assertEqual(self.queue.expected_wait(2), 8)
+        self.clock.advance(2)
+        self.queue.enqueue(3, "c", 4)
+        self.assertEqual(self.queue.expected_wait(3), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import struct
+import unittest
+import core.common as cmn
+import core.messages as messages
+
+
+# A sample value of each field type.
+SAMPLES = {messages.STR: "bob says hi",
+           messages.INT: -42,
+           messages.CARD: "W2",
+           messages.SUIT: "H",
+           messages.CARDS: ["C2", "HA", "L0"],
+           messages.INTS: [30, -10, 0],
+           messages.STRS: ["alice", "bob"],
+           messages.SCORES: [["alice", 120], ["bob", -20]],
+           messages.JSON: {"tables": [[1, 3, 2, ["alice", "bob"]]]}}
+
+
+def sample_fields(msg_id, schema):
+    return [SAMPLES[field_type] for field_type in schema[msg_id]]
+
+
+class BinaryCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = messages.BinaryCodec(messages.SERVER_MESSAGES)
+
+    def test_round_trip(self):
+        for msg_id in messages.SERVER_MESSAGES:
+            fields = sample_fields(msg_id, messages.SERVER_MESSAGES)
+            frame = self.codec.encode(msg_id, fields)
+            self.assertEqual(messages.decode_frame(frame, 0, messages.SERVER_MESSAGES), (msg_id, fields, len(frame)))
+
+    def test_client_messages_round_trip(self):
+        codec = messages.BinaryCodec(messages.CLIENT_MESSAGES)
+        for msg_id in messages.CLIENT_MESSAGES:
+            fields = sample_fields(msg_id, messages.CLIENT_MESSAGES)
+            frame = codec.encode(msg_id, fields)
+            self.assertEqual(messages.decode_frame(frame, 0, messages.CLIENT_MESSAGES), (msg_id, fields, len(frame)))
+
+    def test_consecutive_frames(self):
+        data = self.codec.encode(cmn.CARDS, [["C2"]]) + self.codec.encode(cmn.WINS_TRICK, ["bob"])
+        msg_id, fields, offset = messages.decode_frame(data, 0, messages.SERVER_MESSAGES)
+        self.assertEqual((msg_id, fields), (cmn.CARDS, [["C2"]]))
+        self.assertEqual(messages.decode_frame(data, offset, messages.SERVER_MESSAGES),
+                         (cmn.WINS_TRICK, ["bob"], len(data)))
+
+    def test_incomplete_frame(self):
+        frame = self.codec.encode(cmn.WINS_TRICK, ["bob"])
+        for end in xrange(len(frame)):
+            self.assertIsNone(messages.decode_frame(frame[:end], 0, messages.SERVER_MESSAGES))
+
+    def test_large_table_list(self):
+        tables = [[table_id, 4, 2, ["user%d" % i for i in xrange(4)]] for table_id in xrange(4000)]
+        frame = self.codec.encode(cmn.TABLE_LIST, [tables])
+        self.assertGreater(len(frame), 1 << 16)
+        self.assertEqual(messages.decode_frame(frame, 0, messages.SERVER_MESSAGES)[1], [tables])
+
+    def test_oversized_payload(self):
+        with self.assertRaises(ValueError):
+            self.codec.encode(cmn.UNKNOWN_MESSAGE, ["x" * (messages.MAX_PAYLOAD_SIZE + 1)])
+        with self.assertRaises(ValueError):
+            self.codec.encode(cmn.CARDS, [["C2"] * (messages.MAX_LIST_SIZE + 1)])
+
+    def test_oversized_frame_header(self):
+        header = struct.pack("!IH", messages.MAX_PAYLOAD_SIZE + 1, cmn.WINS_TRICK)
+        with self.assertRaises(messages.InvalidMessageException):
+            messages.decode_frame(header, 0, messages.SERVER_MESSAGES)
+
+    def test_invalid_frames(self):
+        frame = self.codec.encode(cmn.WINS_TRICK, ["bob"])
+        unknown = struct.pack("!IH", 0, 999)
+        trailing = struct.pack("!IH", len(frame) - 5, cmn.WINS_TRICK) + frame[6:] + "x"
+        for data in (unknown, trailing):
+            with self.assertRaises(messages.InvalidMessageException):
+                messages.decode_frame(data, 0, messages.SERVER_MESSAGES)
+
+
+class TextCodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for msg_id in messages.SERVER_MESSAGES:
+            fields = sample_fields(msg_id, messages.SERVER_MESSAGES)
+            line = messages.encode_text(msg_id, fields, messages.SERVER_MESSAGES)
+            self.assertEqual(messages.decode_text(line, messages.SERVER_MESSAGES), (msg_id, fields))
+
+    def test_last_field_keeps_separator(self):
+        self.assertEqual(messages.decode_text("%d#a#b" % cmn.CHAT, messages.CLIENT_MESSAGES), (cmn.CHAT, ["a#b"]))
+
+    def test_invalid_lines(self):
+        for line in ("", "abc", "x#1", "999#", "%d#a" % cmn.PLAYER_SAID_TRICKS, "%d#bob#x" % cmn.PLAYER_SAID_TRICKS):
+            with self.assertRaises(messages.InvalidMessageException):
+                messages.decode_text(line, messages.SERVER_MESSAGES)
+
+
+if __name__ == "__main__":
+    unittest.main()
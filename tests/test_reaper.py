@@ -0,0 +1,72 @@
+import unittest
+from twisted.internet.task import Clock
+from core.reaper import IdleReaper
+
+PENDING, WAIT_FOR_NAME, ACCEPTED = range(3)
+
+
+class IdleReaperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.closed = []
+        self.reaper = IdleReaper({PENDING: 10, WAIT_FOR_NAME: 10, ACCEPTED: 30},
+                                 lambda connection, state: self.closed.append((connection, state)),
+                                 clock=self.clock, deadline_states=(PENDING, WAIT_FOR_NAME))
+
+    def test_activity_refreshes_accepted(self):
+        self.reaper.track("a", ACCEPTED)
+        for _ in xrange(5):
+            self.clock.advance(10)
+            self.reaper.touch("a")
+        self.assertEqual(self.reaper.sweep(), 0)
+        self.clock.advance(30)
+        self.assertEqual(self.reaper.sweep(), 1)
+        self.assertEqual(self.closed, [("a", ACCEPTED)])
+
+    def test_handshake_deadline_is_absolute(self):
+        self.reaper.track("a", PENDING)
+        self.clock.advance(6)
+        self.reaper.touch("a")
+        self.reaper.track("a", WAIT_FOR_NAME)
+        self.clock.advance(3)
+        self.assertEqual(self.reaper.sweep(), 0)
+        self.clock.advance(1)
+        self.assertEqual(self.reaper.sweep(), 1)
+        self.assertEqual(self.closed, [("a", WAIT_FOR_NAME)])
+
+    def test_accepted_gets_new_timeout(self):
+        self.reaper.track("a", PENDING)
+        self.clock.advance(9)
+        self.reaper.track("a", ACCEPTED)
+        self.clock.advance(20)
+        self.assertEqual(self.reaper.sweep(), 0)
+        self.assertEqual(len(self.reaper), 1)
+
+    def test_untrack(self):
+        self.reaper.track("a", PENDING)
+        self.reaper.untrack("a")
+        self.clock.advance(60)
+        self.assertEqual(self.reaper.sweep(), 0)
+        self.assertEqual(len(self.reaper), 0)
+
+    def test_keep(self):
+        reaper = IdleReaper({ACCEPTED: 30}, lambda connection, state: self.closed.append((connection, state)),
+                            clock=self.clock, keep=lambda connection: connection == "seated")
+        reaper.track("seated", ACCEPTED)
+        reaper.track("lobby", ACCEPTED)
+        self.clock.advance(30)
+        self.assertEqual(reaper.sweep(), 1)
+        self.assertEqual(self.closed, [("lobby", ACCEPTED)])
+        self.assertEqual(len(reaper), 1)
+
+    def test_periodic_sweep(self):
+        self.reaper.start()
+        self.reaper.track("a", PENDING)
+        self.clock.pump([5] * 3)
+        self.assertEqual(self.closed, [("a", PENDING)])
+        self.reaper.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+import logging
+import unittest
+from twisted.internet.protocol import ClientFactory
+from twisted.internet.task import Clock
+from twisted.protocols.basic import LineReceiver
+import core.common as cmn
+import core.messages as messages
+import core.transports as transports
+import server
+
+ADDRESS = "memory:test"
+
+
+class ServerClock(Clock):
+    """
+    The test clock with the shutdown triggers of the reactor, which are never fired.
+    """
+
+    def addSystemEventTrigger(self, phase, event_type, f, *args, **kwargs):
+        pass
+
+
+class Player(LineReceiver):
+    """
+    Logs in, sends its first message and then plays the first legal card, the trump hearts and zero tricks (one if zero
+    is not allowed). The received messages are recorded.
+    """
+
+    def __init__(self, username, first_message, binary):
+        self.username = username
+        self.first_message = first_message
+        self.binary = binary
+        self.received = []
+        self._state = cmn.WAIT_FOR_HANDSHAKE
+        self._buffer = ""
+        self._codec = messages.BinaryCodec(messages.CLIENT_MESSAGES)
+
+    def lineReceived(self, line):
+        if self._state == cmn.WAIT_FOR_HANDSHAKE:
+            self.sendLine("%d%s" % (cmn.handshake_fun(int(line)), "#" + cmn.BINARY_PROTOCOL if self.binary else ""))
+            self._state = cmn.PENDING
+        elif self._state == cmn.PENDING:
+            self.sendLine(self.username)
+            self._state = cmn.WAIT_FOR_NAME
+        else:
+            msg_id, fields = messages.decode_text(line, messages.SERVER_MESSAGES)
+            if msg_id == cmn.NEW_USER and self._state == cmn.WAIT_FOR_NAME:
+                self._state = cmn.ACCEPTED
+                if self.binary:
+                    self.setRawMode()
+            self.handle(msg_id, fields)
+
+    def rawDataReceived(self, data):
+        data = self._buffer + data
+        offset = 0
+        while True:
+            msg = messages.decode_frame(data, offset, messages.SERVER_MESSAGES)
+            if msg is None:
+                break
+            msg_id, fields, offset = msg
+            self.handle(msg_id, fields)
+        self._buffer = data[offset:]
+
+    def send(self, msg_id, *fields):
+        if self.binary:
+            self.transport.write(self._codec.encode(msg_id, fields))
+        else:
+            self.sendLine(messages.encode_text(msg_id, fields, messages.CLIENT_MESSAGES))
+
+    def handle(self, msg_id, fields):
+        self.received.append((msg_id, fields))
+        if msg_id == cmn.NEW_USER and self.first_message is not None:
+            self.send(*self.first_message)
+            self.first_message = None
+        elif msg_id == cmn.ASK_TRUMP:
+            self.send(cmn.SAY_TRUMP, "H")
+        elif msg_id == cmn.ASK_TRICKS:
+            self.send(cmn.SAY_TRICKS, 0)
+        elif msg_id == cmn.INVALID_NUM_TRICKS:
+            self.send(cmn.SAY_TRICKS, 1)
+        elif msg_id == cmn.ASK_CARD:
+            self.send(cmn.SAY_CARD, fields[2][0])
+
+    def received_ids(self):
+        return [msg_id for msg_id, _ in self.received]
+
+
+class Stranger(LineReceiver):
+    """
+    Answers the handshake with a wrong number and records the received lines until the connection is closed.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.closed = False
+
+    def lineReceived(self, line):
+        if len(self.received) == 0:
+            self.sendLine("nonsense")
+        self.received.append(line)
+
+    def connectionLost(self, reason):
+        self.closed = True
+
+
+class PlayerFactory(ClientFactory):
+
+    def __init__(self, player):
+        self.player = player
+
+    def buildProtocol(self, addr):
+        return self.player
+
+
+class MemoryGameTest(unittest.TestCase):
+    """
+    Plays games over in-process connections. The server, the connections and the timers all run on a test clock.
+    """
+
+    def setUp(self):
+        logging.disable(logging.WARNING)  # the refused requests are logged
+        self.clock = ServerClock()
+        self.connector = server.ClientConnector(3, 2, clock=self.clock)
+        self.port = transports.listen(ADDRESS, self.connector, self.clock)
+
+    def tearDown(self):
+        self.port.stopListening()
+        logging.disable(logging.NOTSET)
+
+    def _connect(self, username, first_message=(cmn.JOIN_TABLE, ""), binary=False):
+        factory = PlayerFactory(Player(username, first_message, binary))
+        transports.connect(ADDRESS, factory, self.clock)
+        return factory.player
+
+    def _run(self, done, max_seconds=60.0):
+        while not done() and self.clock.seconds() < max_seconds:
+            self.clock.advance(0.01)
+        self.assertTrue(done())
+
+    def _play_game(self, binary):
+        players = [self._connect("player%d" % i, binary=binary) for i in xrange(3)]
+        self._run(lambda: all(cmn.FINAL_WINNERS in p.received_ids() for p in players))
+        for player in players:
+            ids = player.received_ids()
+            self.assertEqual([msg_id for msg_id in ids if 400 <= msg_id < 500 and msg_id != cmn.INVALID_NUM_TRICKS],
+                             [])
+            self.assertEqual(ids.count(cmn.MADE_POINTS), 2)
+        finals = [fields for player in players for msg_id, fields in player.received if msg_id == cmn.FINAL_POINTS]
+        self.assertEqual(len(finals), 3)
+        self.assertTrue(all(points == finals[0] for points in finals))
+        start = [fields[0] for msg_id, fields in players[0].received if msg_id == cmn.START_GAME][0]
+        self.assertEqual(sorted(start), ["player0", "player1", "player2"])
+
+    def test_text_game(self):
+        self._play_game(binary=False)
+
+    def test_binary_game(self):
+        self._play_game(binary=True)
+
+    def test_create_table(self):
+        invalid = [self._connect("invalid%d" % i, (cmn.CREATE_TABLE, table)) for i, table in
+                   enumerate(["3#0", "3#-2", "0", "3#1#1", "x"])]
+        valid = self._connect("valid", (cmn.CREATE_TABLE, "2#1"))
+        self._run(lambda: all(len(p.received) > 1 for p in invalid + [valid]))
+        for player in invalid:
+            self.assertIn(cmn.INVALID_TABLE_SIZE, player.received_ids())
+        self.assertIn(cmn.JOINED_TABLE, valid.received_ids())
+
+    def test_list_tables(self):
+        creators = [self._connect("creator%d" % i, (cmn.CREATE_TABLE, "3")) for i in xrange(2)]
+        self._run(lambda: all(cmn.JOINED_TABLE in p.received_ids() for p in creators))
+        viewer = self._connect("viewer", (cmn.LIST_TABLES,), binary=True)
+        self._run(lambda: cmn.TABLE_LIST in viewer.received_ids())
+        tables = [fields[0] for msg_id, fields in viewer.received if msg_id == cmn.TABLE_LIST][0]
+        self.assertEqual(len(tables), 2)
+
+    def test_bad_handshake(self):
+        factory = PlayerFactory(Stranger())
+        transports.connect(ADDRESS, factory, self.clock)
+        self._run(lambda: factory.player.closed)
+        self.assertEqual(factory.player.received[1:], ["Your are not a wizard cardgame client."])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+from twisted.internet.task import Clock
+import core.stats as stats
+
+
+def result(*usernames):
+    """
+    Return the result of a game with one round, the first player wins.
+    """
+    return {"num_players": len(usernames), "num_rounds": 1,
+            "players": [{"username": username, "points": [30 if seat == 0 else -10], "said": [1], "made": [1]}
+                        for seat, username in enumerate(usernames)]}
+
+
+class StatsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = stats.StatsStore(os.path.join(self.directory, "stats.db"), clock=Clock())
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_usernames_are_case_insensitive(self):
+        self.assertEqual(self.store._write([(1.0, result("Alice", "bob")), (2.0, result("ALICE", "Bob"))]),
+                         set(["alice", "bob"]))
+        top = self.store._query(stats._TOP_QUERY, (10,))
+        self.assertEqual([(row[0], row[1], row[2]) for row in top], [("ALICE", 2, 2), ("Bob", 2, 0)])
+        history = self.store._query(stats._HISTORY_QUERY, ("alice", 10))
+        self.assertEqual([row[3] for row in history], [30, 30])
+
+
+if __name__ == "__main__":
+    unittest.main()
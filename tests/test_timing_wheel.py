@@ -0,0 +1,62 @@
+import logging
+import unittest
+from twisted.internet.task import Clock
+from core.timing_wheel import TimingWheel
+
+
+class TimingWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimingWheel(resolution=0.1, slot_bits=2, num_levels=3, clock=self.clock)
+        self.fired = []
+
+    def _advance(self, seconds):
+        for _ in xrange(int(round(seconds / 0.1))):
+            self.clock.advance(0.1)
+
+    def test_timers_fire_in_order(self):
+        for delay in (2.5, 0.1, 1.0, 0.35):
+            self.wheel.schedule(delay, self.fired.append, delay)
+        self._advance(0.4)
+        self.assertEqual(self.fired, [0.1, 0.35])
+        self._advance(2.1)
+        self.assertEqual(self.fired, [0.1, 0.35, 1.0, 2.5])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cancel(self):
+        timer = self.wheel.schedule(0.5, self.fired.append, "a")
+        self.assertTrue(timer.active())
+        timer.cancel()
+        self.assertFalse(timer.active())
+        self._advance(1.0)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_long_delays_are_clamped(self):
+        self.wheel.schedule(1000.0, self.fired.append, "late")
+        self._advance(6.0)
+        self.assertEqual(self.fired, [])
+        self._advance(0.5)
+        self.assertEqual(self.fired, ["late"])
+
+    def test_failing_callback_does_not_stop_the_wheel(self):
+        self.wheel.schedule(0.1, lambda: 1 // 0)
+        self.wheel.schedule(0.2, self.fired.append, "b")
+        logging.disable(logging.ERROR)
+        try:
+            self._advance(0.2)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(self.fired, ["b"])
+
+    def test_stop(self):
+        timer = self.wheel.schedule(0.3, self.fired.append, "a")
+        self.wheel.stop()
+        self.assertFalse(timer.active())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+import tempfile
+import itertools
+import unittest
+from twisted.internet.task import Clock
+import core.tournament as tournament
+
+
+def players(n):
+    return ["p%d" % i for i in xrange(n)]
+
+
+def pairs(tables):
+    return [frozenset(pair) for table in tables for pair in itertools.combinations(table, 2)]
+
+
+class RoundRobinTest(unittest.TestCase):
+
+    def test_tables_of_two_meet_exactly_once(self):
+        for n in (2, 3, 5, 6, 9):
+            schedule = tournament.round_robin_schedule(players(n), 2)
+            self.assertEqual(len(schedule), n + n % 2 - 1)
+            met = [pair for tables in schedule for pair in pairs(tables)]
+            self.assertEqual(len(met), n * (n-1) // 2)
+            self.assertEqual(len(set(met)), len(met))
+
+    def test_larger_tables_cover_all_pairs(self):
+        for n, table_size in ((5, 3), (8, 4), (9, 3), (13, 4), (30, 6)):
+            schedule = tournament.round_robin_schedule(players(n), table_size)
+            met = set(pair for tables in schedule for pair in pairs(tables))
+            self.assertEqual(len(met), n * (n-1) // 2)
+
+    def test_rounds_seat_everyone_once(self):
+        for n, table_size in ((5, 2), (10, 4), (13, 4)):
+            for tables in tournament.round_robin_schedule(players(n), table_size):
+                seated = [player for table in tables for player in table]
+                self.assertEqual(len(seated), len(set(seated)))
+                self.assertTrue(all(2 <= len(table) <= table_size for table in tables))
+                self.assertGreaterEqual(len(seated), n - 1)
+
+    def test_schedule_is_deterministic(self):
+        self.assertEqual(tournament.round_robin_schedule(players(12), 4),
+                         tournament.round_robin_schedule(players(12), 4))
+
+    def test_default_rounds_cover_all_pairs(self):
+        t = tournament.Tournament("rr", players(8), tournament.ROUND_ROBIN, table_size=4)
+        met = set()
+        while not t.finished:
+            met.update(pairs(table["players"] for table in t.next_round()))
+            for key in xrange(len(t.tables)):
+                t.close_table(key)
+        self.assertEqual(len(met), 28)
+        self.assertEqual(t.round, len(t.schedule))
+
+
+class SwissTest(unittest.TestCase):
+
+    def test_first_round_in_seed_order(self):
+        t = tournament.Tournament("swiss", players(8), table_size=4)
+        self.assertEqual(t.num_rounds, 3)
+        self.assertEqual([table["players"] for table in t.next_round()],
+                         [["p0", "p1", "p2", "p3"], ["p4", "p5", "p6", "p7"]])
+
+    def test_avoids_players_that_met(self):
+        met = dict((p, {}) for p in players(4))
+        met["p0"]["p1"] = met["p1"]["p0"] = 1
+        self.assertEqual(tournament.swiss_tables(players(4), 2, met), [["p0", "p2"], ["p1", "p3"]])
+
+    def test_single_player_gets_bye(self):
+        met = dict((p, {}) for p in players(5))
+        tables = tournament.swiss_tables(players(5), 2, met)
+        self.assertEqual(len(tables), 2)
+        self.assertEqual(sorted(p for table in tables for p in table), players(4))
+
+    def test_points_and_standings(self):
+        t = tournament.Tournament("swiss", players(4), table_size=2)
+        t.next_round()
+        t.game_started(0, ["P1", "p0"])
+        t.add_points(0, [30, -10])
+        t.game_started(1, ["p2", "bot"])
+        t.add_points(1, [20, 50])
+        self.assertEqual(t.standings(), [("p1", 30), ("p2", 20), ("p3", 0), ("p0", -10)])
+        t.set_points(1, {"p2": 40, "p3": 10})
+        self.assertEqual(t.points["p2"], 40)
+        self.assertEqual(t.points["p3"], 10)
+        self.assertFalse(t.round_finished)
+        t.close_table(0)
+        t.close_table(1)
+        self.assertTrue(t.round_finished)
+        self.assertEqual(t.next_round()[0]["players"][0], "p2")
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_dump_and_load(self):
+        for pairing in (tournament.SWISS, tournament.ROUND_ROBIN):
+            t = tournament.Tournament("t", players(6), pairing, table_size=3, game_rounds=2)
+            t.next_round()
+            t.game_started(0, t.tables[0]["players"])
+            t.add_points(0, [10, 20, 30])
+            loaded = tournament.Tournament.load(json.loads(json.dumps(t.dump())))
+            self.assertEqual(loaded.dump(), t.dump())
+
+    def test_checkpoint_write_and_read(self):
+        t = tournament.Tournament("t", players(4))
+        clock = Clock()
+        checkpoint = tournament.Checkpoint(os.path.join(self.directory, "t.checkpoint"), t.dump, clock=clock)
+        self.assertIsNone(checkpoint.read())
+        checkpoint.changed()
+        checkpoint.changed()
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        clock.advance(1.0)
+        self.assertEqual(checkpoint.read(), json.loads(json.dumps(t.dump())))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import Clock
+import core.transports as transports
+
+
+class Producer(object):
+    """
+    Records the calls of the transport.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def pauseProducing(self):
+        self.calls.append("pause")
+
+    def resumeProducing(self):
+        self.calls.append("resume")
+
+    def stopProducing(self):
+        self.calls.append("stop")
+
+
+class Receiver(Protocol):
+
+    def __init__(self):
+        self.data = ""
+        self.lost = False
+
+    def dataReceived(self, data):
+        self.data += data
+
+    def connectionLost(self, reason=None):
+        self.lost = True
+
+
+class MemoryTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        address = transports.MemoryAddress("test", 0)
+        self.sender = transports.MemoryTransport(address, address, self.clock)
+        self.receiver = transports.MemoryTransport(address, address, self.clock)
+        self.sender.other = self.receiver
+        self.receiver.other = self.sender
+        self.sender.protocol = Receiver()
+        self.receiver.protocol = Receiver()
+        self.producer = Producer()
+        self.sender.bufferSize = 10
+        self.sender.registerProducer(self.producer, True)
+
+    def test_pause_above_buffer_size(self):
+        self.sender.write("x" * 10)
+        self.assertEqual(self.producer.calls, [])
+        self.sender.write("x")
+        self.sender.write("x")
+        self.assertEqual(self.producer.calls, ["pause"])
+        self.clock.advance(0)
+        self.assertEqual(self.receiver.protocol.data, "x" * 12)
+        self.assertEqual(self.producer.calls, ["pause", "resume"])
+
+    def test_stop_producing_closes(self):
+        self.sender.write("bye")
+        self.sender.stopProducing()
+        self.clock.advance(0)
+        self.assertEqual(self.receiver.protocol.data, "bye")
+        self.assertTrue(self.sender.protocol.lost and self.receiver.protocol.lost)
+        self.assertEqual(self.producer.calls, ["stop"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import socket
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet.protocol import ClientCreator, Factory, Protocol
+from twisted.trial import unittest
+import core.worker_pool as worker_pool
+
+
+class Peer(Protocol):
+    """
+    Fires made when the connection is made, received with the first data and closed when it is lost.
+    """
+
+    def __init__(self):
+        self.made = defer.Deferred()
+        self.received = defer.Deferred()
+        self.closed = defer.Deferred()
+
+    def connectionMade(self):
+        self.made.callback(self)
+
+    def dataReceived(self, data):
+        if not self.received.called:
+            self.received.callback(data)
+
+    def connectionLost(self, reason):
+        self.closed.callback(None)
+
+
+class ReleaseConnectionTest(unittest.TestCase):
+    """
+    Hands a connection over to a duplicate of its socket like the server does with the connections of its workers.
+    """
+
+    def setUp(self):
+        self.server = Peer()
+        factory = Factory()
+        factory.buildProtocol = lambda addr: self.server
+        self.port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    timeout = 10
+
+    @defer.inlineCallbacks
+    def test_connection_survives(self):
+        client = yield ClientCreator(reactor, Peer).connectTCP("127.0.0.1", self.port.getHost().port)
+        yield self.server.made
+        fd = worker_pool.release_connection(self.server.transport)
+        yield self.server.closed
+        sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+        os.close(fd)
+        sock.sendall("still there")
+        data = yield client.received
+        self.assertEqual(data, "still there")
+        self.assertFalse(client.closed.called)
+        sock.close()
+        yield client.closed